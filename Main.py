@@ -1,56 +1,133 @@
 # main.py
+# Point d'entrée : python Main.py [fetch|process|analyse|export|all] [options]
+# Seuls les modules des étapes lancées sont importés (voir pipeline.call)
+import logging
+import argparse
 from datetime import datetime, timedelta
-import extract_data
-import process_data
-import export_excel
+import cache
+import pipeline
+import instrumentation
 
-end_date = datetime.now()
-start_date = end_date - timedelta(days=1080)
+logger = logging.getLogger(__name__)
 
-start_date_str = start_date.strftime("%Y-%m-%d")
-end_date_str = end_date.strftime("%Y-%m-%d")
-print(f"Fetching data from {start_date_str} to {end_date_str}")
+# Incrémental : ne télécharger que ce qui manque depuis le dernier run (voir datas/watermarks.json)
+INCREMENTAL = True
+
+# Fenêtre de données récupérée
+NB_JOURS = 1080
+
+# Sous-commandes -> groupe d'étapes du pipeline (None = toutes)
+commands = {
+    "fetch": ("fetch", "télécharger les données brutes (datas/)"),
+    "process": ("process", "nettoyer les données et construire les cubes (data_clean/)"),
+    "analyse": ("analyse", "détecter les épisodes et évaluer les normes"),
+    "export": ("export", "générer le rapport Excel"),
+    "all": (None, "tout le pipeline (défaut)"),
+}
 
 
 #####################################################################################
-#                              
+#
 #                                    RUN SCRIPT
 #
 #####################################################################################
 
-# =========  EXTRACT DATAS ========= #
-print("Fetching pollution data...")
-extract_data.fetch_pollution_data(start_date, end_date)
-
-print("Fetching population data...")
-extract_data.fetch_population_data()
-
-print("Fetching enterprise data...")
-extract_data.fetch_enterprise_data()
-
-# =========  PROCESSING DATAS ========= #
-
-print("Processing N02 data...")
-process_data.process_NO2_data()
-
-print("Processing PM10 data...")
-process_data.process_PM10_data()
-
-print("Processing population data...")
-process_data.process_population_data()
-
-print("Processing enterprise data...")
-process_data.process_enterprise_data()
-
-print("Extraction and processing completed successfully.")
-
-# =========  ANALYSE ========= #
-
-import analyse
-analyse.analyse_NO2_200_3days()
-analyse.analyse_PM10()
-
-# =========  EXPORT EXCEL ========= #
-print("Generating Excel report with graphs...")
-export_excel.run_export()
-print("Excel export completed.")
+def build_parser():
+    # Options communes, acceptées avant ou après la sous-commande
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--only", help="étapes à exécuter, séparées par des virgules (ex: process_NO2,analyse_NO2)")
+    common.add_argument("--from", dest="from_stage", help="exécuter cette étape et toutes celles qui en dépendent")
+    common.add_argument("--force", action="store_true", help="ne pas sauter les étapes déjà à jour (à combiner avec --only pour relancer une étape)")
+    common.add_argument("--full", action="store_true", help="retélécharger toute la fenêtre (pas d'incrémental)")
+    common.add_argument("--workers", type=int, default=4, help="nombre d'étapes en parallèle")
+    common.add_argument("--processes", action="store_true", help="pool de processus au lieu de threads")
+    common.add_argument("--list", action="store_true", help="lister les étapes et leurs dépendances")
+    common.add_argument("--log-level", default="INFO", help="niveau de log (DEBUG, INFO, WARNING...)")
+    common.add_argument("--quiet", action="store_true", help="n'afficher que les avertissements et erreurs")
+    common.add_argument("--no-cache", action="store_true", help="ne pas reprendre les sorties du cache (cache/) quand les entrées n'ont pas changé")
+    common.add_argument("--no-metrics", action="store_true", help="ne pas mesurer les étapes (pas de rapport dans metrics/)")
+    common.add_argument("--trace-memory", action="store_true", help="pic mémoire de chaque étape via tracemalloc (plus lent, étapes une par une)")
+    common.add_argument("--profile", choices=["cprofile", "sample"], help="profiler chaque étape (metrics/profiles/)")
+    common.add_argument("--hourly", action="store_true",
+                        help="télécharger aussi les mesures horaires (~24x plus volumineuses) et évaluer les normes horaires dessus")
+    common.add_argument("--partition-by", choices=["departement"],
+                        help="un pipeline par département (un processus chacun), tables regroupées ensuite")
+    common.add_argument("--partitions", metavar="FICHIER",
+                        help="partitions JSON {nom: {\"departements\": [...], \"stations\": [...]}} (voir partitions.py)")
+
+    parser = argparse.ArgumentParser(description="Pipeline qualité de l'air Pays de la Loire", parents=[common])
+    subparsers = parser.add_subparsers(dest="command", metavar="{" + ",".join(commands) + "}")
+    for command, (_, help_text) in commands.items():
+        # SUPPRESS : une option absente après la sous-commande n'écrase pas celle donnée avant
+        subparsers.add_parser(command, parents=[common], help=help_text, argument_default=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    command = args.command or "all"
+
+    instrumentation.setup_logging("WARNING" if args.quiet else args.log_level)
+    cache.enabled = not args.no_cache
+
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=NB_JOURS)
+
+    start_date_str = start_date.strftime("%Y-%m-%d")
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    if command in ("fetch", "all"):
+        logger.info("Fetching data from %s to %s", start_date_str, end_date_str)
+
+    # Partitions : définies dans un fichier, ou un département chacune
+    partitions = None
+    if args.partitions or args.partition_by:
+        import partitions as partitioning
+        partitions = (partitioning.load_definitions(args.partitions) if args.partitions
+                      else partitioning.by_departement())
+
+    incremental = INCREMENTAL and not args.full
+    stages = pipeline.build_stages(start_date, end_date, incremental=incremental,
+                                   partitions=list(partitions) if partitions else None, hourly=args.hourly)
+
+    group = commands[command][0]
+    if args.list:
+        if partitions:
+            print(f"Dans chaque partition ({', '.join(partitions)}) : {', '.join(pipeline.partition_stages)}")
+        for stage in stages:
+            if group is None or stage.group == group:
+                deps = ", ".join(dep.name for dep in stage.deps) or "-"
+                print(f"{stage.name:<22} <- {deps}")
+        return
+
+    only = args.only.split(",") if args.only else None
+    from_stage = args.from_stage
+    memory = "tracemalloc" if args.trace_memory else "rss"
+    failed = False
+    if partitions:
+        known = {stage.name for stage in stages} | set(pipeline.partition_stages)
+        for name in (only or []) + ([from_stage] if from_stage else []):
+            if name not in known:
+                raise SystemExit(f"Étape inconnue : {name} (disponibles : {', '.join(sorted(known))})")
+
+        statuses = partitioning.run_partitions(partitions, start_date, end_date, incremental=incremental,
+                                               only=only, from_stage=from_stage, group=group, force=args.force,
+                                               max_workers=args.workers, metrics=not args.no_metrics,
+                                               memory=memory, profile=args.profile)
+        failed = partitioning.failed(statuses)
+
+        # Étapes globales : une étape de partition demandée -> tout ce qui suit la fusion
+        root_names = {stage.name for stage in stages}
+        if from_stage in pipeline.partition_stages and from_stage not in root_names:
+            from_stage = "merge_partitions"
+        if only is not None:
+            only = [name for name in only if name in root_names]
+
+    selected = pipeline.select_stages(stages, only=only, from_stage=from_stage, group=group)
+    status, _ = pipeline.run(stages, selected, force=args.force, max_workers=args.workers, processes=args.processes,
+                             metrics=not args.no_metrics, memory=memory, profile=args.profile)
+    failed = failed or any(state in ("échec", "bloqué") for state in status.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,79 +1,149 @@
-import pandas as pd
-import os
+import logging
+import storage
+import database
+import normes
+import dimensions
+import exposition
+import instrumentation
 
-# Dossier des données nettoyées
-clean_dir = os.path.join(os.getcwd(), "data_clean")
+logger = logging.getLogger(__name__)
 
 #####################################################################################
 #                              ANALYSE N02
 #####################################################################################
 def analyse_NO2_200_3days():
-    print("\n/////////////////////////////////////////////////////////////////////////////////////////////////////")
-    print("//         Analyse NO2 - Seuil d'alerte 200 µg/m3 sur 3 jours glissants                            //")
-    print("/////////////////////////////////////////////////////////////////////////////////////////////////////\n")
+    logger.info("Analyse NO2 - Seuil d'alerte 200 µg/m3 sur 3 jours consécutifs")
 
-    # Charger le fichier NO2
-    df_no2 = pd.read_csv(os.path.join(clean_dir, "NO2_data.csv"))
+    # Épisodes d'au moins 3 jours calendaires consécutifs avec une moyenne journalière > 200,
+    # calculés dans la base SQLite (database.py) ; un trou dans les mesures coupe l'épisode
+    norme = normes.get_norme("no2_3jours")
+    df_journalier_alert = database.detect_episodes("NO2", norme["valeur"], min_days=norme["jours_consecutifs"])
+    df_journalier_alert = dimensions.with_names(df_journalier_alert)
 
-    # Forcer format date
-    df_no2['date_local'] = pd.to_datetime(df_no2['date_local'])
+    logger.info("Nombre d'épisodes NO2 (200 µg/m3 sur 3 jours consécutifs) : %d", len(df_journalier_alert))
+    logger.info("Nombre de jours concernés : %d", df_journalier_alert['nb_jours'].sum())
+    logger.info("Communes concernées :\n%s", df_journalier_alert['commune'].cat.remove_unused_categories().value_counts())
 
-    # Calculer moyenne journalière par commune, station, date
-    df_journalier = df_no2.groupby(['commune', 'station', 'date_local'])['no2_value'].mean().reset_index()
+    # Sauvegarder le résultat
+    storage.save_table(df_journalier_alert, "NO2_alert_200_3days")
+    logger.info("NO2 200 µg/m3 3 jours alerte sauvegardée dans data_clean/NO2_alert_200_3days.%s", storage.backend)
 
-    # Marquer les jours > 200
-    seuil_recommandation = 200
-    df_journalier['over_200'] = df_journalier['no2_value'] > seuil_recommandation
 
-    # Trier par commune, station, date
-    df_journalier = df_journalier.sort_values(by=['commune', 'station', 'date_local'])
 
-    # Appliquer une rolling window de 3 jours (correction avec transform)
-    df_journalier['over_200_rolling3'] = (
-        df_journalier
-        .groupby(['commune', 'station'])['over_200']
-        .transform(lambda x: x.rolling(window=3, min_periods=3).sum())
-    )
+#####################################################################################
+#                              ANALYSE PM10
+#####################################################################################
 
-    # Identifier les séquences où les 3 jours sont > 200
-    df_journalier_alert = df_journalier[df_journalier['over_200_rolling3'] >= 3]
+def analyse_PM10():
+    logger.info("Analyse PM10 - Seuil d'alerte 80 µg/m3 sur 1 jour")
 
-    print(f"Nombre d'alertes NO2 (200 µg/m3 sur 3 jours glissants) : {len(df_journalier_alert)}\n")
-    print("Communes concernées :")
-    print(df_journalier_alert['commune'].value_counts())
+    # Épisodes de jours consécutifs au-dessus du seuil (même moteur que le NO2, sur 1 jour)
+    norme = normes.get_norme("pm10_alerte")
+    df_alert_pm10 = database.detect_episodes("PM10", norme["valeur"], min_days=norme["jours_consecutifs"])
+    df_alert_pm10 = dimensions.with_names(df_alert_pm10)
 
-    # Sauvegarder le résultat
-    df_journalier_alert.to_csv(os.path.join(clean_dir, "NO2_alert_200_3days.csv"), index=False)
-    print("\nNO2 200 µg/m3 3 jours alerte sauvegardée dans data_clean/NO2_alert_200_3days.csv\n")
+    logger.info("Nombre d'épisodes de dépassement PM10 : %d", len(df_alert_pm10))
+    logger.info("Nombre de jours de dépassement PM10 : %d", df_alert_pm10['nb_jours'].sum())
+    logger.info("Communes concernées (PM10) :\n%s", df_alert_pm10['commune'].cat.remove_unused_categories().value_counts())
 
+    # Sauvegarde éventuelle
+    storage.save_table(df_alert_pm10, "PM10_alerts")
+    logger.info("PM10 alerte sauvegardée dans data_clean/PM10_alerts.%s", storage.backend)
 
 
 #####################################################################################
-#                              ANALYSE PM10
+#                              ANALYSE TOUTES NORMES
 #####################################################################################
 
-def analyse_PM10():
-    print("\n/////////////////////////////////////////////////////////////////////////////////////////////////////")
-    print("//          Analyse PM10 - Seuil d'alerte 80 µg/m3 sur 1 jour                                      //")
-    print("/////////////////////////////////////////////////////////////////////////////////////////////////////\n")
-    df_pm10 = pd.read_csv(os.path.join(clean_dir, "PM10_data.csv"))
+# hourly : normes horaires reprises de alertes_horaires (mesures horaires) pour les polluants qui y figurent
+def analyse_normes(hourly=False):
+    logger.info("Analyse de toutes les normes (normes.py) par station et par année")
 
-    # Lignes au-dessus du seuil
-    seuil_pm10 = 80
-    df_alert_pm10 = df_pm10[df_pm10['pm10_value'] > seuil_pm10]
+    # Toutes les normes de tous les polluants évaluées en une requête SQL (une branche par norme)
+    df_alertes = database.evaluate_norms()
+    if hourly and storage.table_exists("alertes_horaires"):
+        import pandas as pd
 
-    print(f"Nombre de dépassements PM10 : {len(df_alert_pm10)}")
-    print("Communes concernées (PM10) :")
-    print(df_alert_pm10['commune'].value_counts())
+        df_horaires = storage.load_table("alertes_horaires", columns=list(df_alertes.columns))
+        remplacees = (df_alertes['fenetre'] == "horaire") & df_alertes['polluant'].isin(df_horaires['polluant'].unique())
+        logger.info("Normes horaires évaluées sur les mesures horaires (%s)", ", ".join(map(str, df_horaires['polluant'].unique())))
+        df_alertes = (pd.concat([df_alertes[~remplacees], df_horaires], ignore_index=True)
+                      .sort_values(['polluant', 'norme_id', 'commune_id', 'station_id', 'annee'])
+                      .reset_index(drop=True))
+    df_alertes = dimensions.with_names(df_alertes)
 
-    # Sauvegarde éventuelle
-    df_alert_pm10.to_csv(os.path.join(clean_dir, "PM10_alerts.csv"), index=False)
-    print("PM10 alerte sauvegardée dans data_clean/PM10_alerts.csv\n")
+    logger.info("Nombre de (norme, station, année) avec dépassement : %d", len(df_alertes))
+    logger.info("Dont non conformes (au-delà des dépassements autorisés) : %d", int(df_alertes['non_conforme'].sum()))
+    logger.info("Dépassements par norme :\n%s", df_alertes.groupby(['polluant', 'norme'], observed=True)['nb_depassements'].sum())
+
+    storage.save_table(df_alertes, "alertes_normes")
+    logger.info("Alertes normes sauvegardées dans data_clean/alertes_normes.%s", storage.backend)
+
+
+
+#####################################################################################
+#                              NORMES HORAIRES
+#####################################################################################
+
+def analyse_horaire():
+    import hourly
+
+    logger.info("Analyse des normes horaires sur les mesures horaires (dépassements par station et par année)")
+    df_horaires = dimensions.with_names(hourly.evaluate_hourly_norms())
+
+    logger.info("Nombre de (norme, station, année) avec dépassement horaire : %d", len(df_horaires))
+    logger.info("Dont non conformes (au-delà des heures autorisées) : %d", int(df_horaires['non_conforme'].sum()))
+    logger.info("Heures de dépassement par norme :\n%s", df_horaires.groupby(['polluant', 'norme'], observed=True)['nb_depassements'].sum())
+
+    storage.save_table(df_horaires, "alertes_horaires")
+    logger.info("Alertes horaires sauvegardées dans data_clean/alertes_horaires.%s", storage.backend)
+
+
+#####################################################################################
+#                              EXPOSITION DE LA POPULATION
+#####################################################################################
+
+def analyse_exposition(incremental=True):
+    logger.info("Analyse de l'exposition de la population (personnes-jours au-dessus des seuils)")
+
+    df_communes, df_tranches = exposition.build_exposition(incremental)
+
+    logger.info("Nombre de (seuil, commune, année) exposés : %d", len(df_communes))
+    logger.info("Personnes-jours par seuil :\n%s",
+                df_tranches.groupby(['polluant', 'categorie'], observed=True)['personnes_jours'].sum())
+    logger.info("Personnes-jours par tranche de population :\n%s",
+                df_tranches.groupby(['tranche_population', 'polluant'], observed=True)['personnes_jours'].sum())
+    logger.info("Exposition sauvegardée dans data_clean/%s.%s et data_clean/%s.%s",
+                exposition.table_communes, storage.backend, exposition.table_tranches, storage.backend)
+
+
+#####################################################################################
+#                              ACTIVITÉ DES ENTREPRISES
+#####################################################################################
+
+def analyse_entreprises():
+    import entreprises
+
+    logger.info("Analyse des créations / fermetures d'établissements et des jours de dépassement par commune")
+    df_communes, df_correlations = entreprises.correlate_pollution()
+
+    logger.info("Communes x années mesurées : %d (%d jours de dépassement)", len(df_communes),
+                int(df_communes['jours_depassement'].sum()))
+    logger.info("Corrélation créations / fermetures avec les jours de dépassement par section :\n%s",
+                df_correlations.to_string(index=False))
 
+    storage.save_table(dimensions.with_names(df_communes), entreprises.table_communes)
+    storage.save_table(df_correlations, entreprises.table_correlations)
+    logger.info("Activité des entreprises sauvegardée dans data_clean/%s.%s et data_clean/%s.%s",
+                entreprises.table_communes, storage.backend, entreprises.table_correlations, storage.backend)
 
 
 if __name__ == "__main__":
+    instrumentation.setup_logging()
     analyse_NO2_200_3days()
     analyse_PM10()
+    analyse_normes()
+    analyse_exposition()
+    analyse_entreprises()
 
 
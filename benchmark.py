@@ -0,0 +1,1033 @@
+# benchmark.py
+# Benchmarks hors-ligne des étapes du pipeline (serveur HTTP local, données synthétiques)
+#
+#   python benchmark.py extract
+#   python benchmark.py sirene
+#   python benchmark.py ingest
+#   python benchmark.py raw
+#   python benchmark.py storage
+#   python benchmark.py episodes
+#   python benchmark.py dimensions
+#   python benchmark.py series
+#   python benchmark.py partitions
+#   python benchmark.py cache
+#   python benchmark.py database
+#   python benchmark.py live
+#   python benchmark.py hourly
+#   python benchmark.py entreprises
+#   python benchmark.py excel
+#   python benchmark.py startup
+#
+#   python benchmark.py suite [--stations 50 --days 1080 --enterprises 100000 --threshold 0.2]
+#       toutes les étapes process / rollup / analyse / export sur un jeu synthétique,
+#       historique dans benchmark_history.json, code retour 1 en cas de régression
+#
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import extract_data
+import process_data
+import raw_store
+import storage
+import episodes
+import synthetic
+import instrumentation
+
+
+#####################################################################################
+#                               BENCHMARK EXTRACT
+#####################################################################################
+
+def count_records(name):
+    return sum(1 for _ in raw_store.iter_records(name))
+
+
+def bench_extract(days=1080):
+    server, url = synthetic.start_stub_server(synthetic.PollutionStubHandler)
+    end_date = datetime(2025, 1, 1)
+    start_date = end_date - timedelta(days=days)
+
+    old_url, old_dir = extract_data.pollution_url, raw_store.raw_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            extract_data.pollution_url = url
+            raw_store.raw_dir = tmp
+
+            t0 = time.perf_counter()
+            extract_data.fetch_pollution_data(start_date, end_date)
+            serial = time.perf_counter() - t0
+            serial_count = count_records("NO2_Data")
+
+            t0 = time.perf_counter()
+            extract_data.fetch_pollution_data_concurrent(start_date, end_date)
+            concurrent = time.perf_counter() - t0
+            concurrent_count = count_records("NO2_Data")
+    finally:
+        extract_data.pollution_url, raw_store.raw_dir = old_url, old_dir
+        server.shutdown()
+
+    print(f"\nExtract pollution sur {days} jours :")
+    print(f"  serial     : {serial:6.2f}s ({serial_count} records NO2)")
+    print(f"  concurrent : {concurrent:6.2f}s ({concurrent_count} records NO2)")
+    print(f"  speedup    : x{serial / concurrent:.1f}")
+    return {"serial_s": serial, "concurrent_s": concurrent}
+
+
+# Base SIRENE au-delà de la limite des 10000 records : export en streaming et pages par fenêtres
+def bench_sirene(enterprises=120000):
+    synthetic.SIRENE_RECORDS[:] = [synthetic.make_enterprise_record(e, communes=1200) for e in range(enterprises)]
+    synthetic.SIRENE_RECORDS.sort(key=lambda r: r["datecreationetablissement"])
+    synthetic.SIRENE_DATES[:] = [r["datecreationetablissement"] for r in synthetic.SIRENE_RECORDS]
+    server, url = synthetic.start_stub_server(synthetic.OdsStubHandler)
+
+    results = {}
+    old_url, old_dir, old_rate = extract_data.ods_base_url, raw_store.raw_dir, extract_data.ods_rate_limit
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            extract_data.ods_base_url = url.rstrip("/")
+            raw_store.raw_dir = tmp
+            extract_data.ods_rate_limit = 200
+            for mode in ["export", "pages"]:
+                t0 = time.perf_counter()
+                extract_data.fetch_enterprise_data(mode=mode, max_workers=8)
+                seconds = time.perf_counter() - t0
+                count = count_records("enterprise_data")
+                results[mode] = {"seconds": seconds, "records": count}
+    finally:
+        extract_data.ods_base_url, raw_store.raw_dir, extract_data.ods_rate_limit = old_url, old_dir, old_rate
+        server.shutdown()
+
+    expected = sum(1 for r in synthetic.SIRENE_RECORDS if r["datecreationetablissement"] > "2024-01-01")
+    print(f"\nExtract SIRENE ({expected} établissements attendus, ancien plafond : 10000) :")
+    for mode, r in results.items():
+        status = "OK" if r["records"] == expected else "INCOMPLET"
+        print(f"  {mode:<7}: {r['seconds']:6.2f}s, {r['records']} records ({status})")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK INGESTION (MÉMOIRE)
+#####################################################################################
+
+# Ancien chemin : json.load de tout le fichier + json_normalize de tous les champs
+def legacy_read_pollution(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    df = pd.json_normalize(data.get("results", []))
+    return df[process_data.pollution_columns]
+
+
+# Temps mesuré sans tracemalloc (qui ralentit beaucoup le code Python pur), puis pic mémoire
+def measure(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_ingest(stations=100, days=1080):
+    old_dir = raw_store.raw_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir = tmp
+            path = raw_store.legacy_path("PM10_Data")
+            n = synthetic.write_pollution_file(path, stations, days)
+            size = os.path.getsize(path)
+
+            df_old, t_old, peak_old = measure(legacy_read_pollution, path)
+            df_new, t_new, peak_new = measure(process_data.read_pollution_records, "PM10_Data")
+            assert len(df_old) == len(df_new)
+    finally:
+        raw_store.raw_dir = old_dir
+
+    mb = 1024 * 1024
+    print(f"\nIngestion de {n} records ({size / mb:.0f} Mo) :")
+    print(f"  json.load + json_normalize : {t_old:6.2f}s, pic mémoire {peak_old / mb:7.1f} Mo")
+    print(f"  streaming                  : {t_new:6.2f}s, pic mémoire {peak_new / mb:7.1f} Mo")
+    return {"legacy_s": t_old, "legacy_peak": peak_old, "streaming_s": t_new, "streaming_peak": peak_new}
+
+
+#####################################################################################
+#                               BENCHMARK DONNÉES BRUTES (datas/)
+#####################################################################################
+
+# Taille sur disque, temps d'écriture et de lecture complète de chaque dataset brut :
+# ancien JSON indenté (json.load) contre JSON lines brut / gzip / zstd, avec json puis orjson
+def bench_raw(stations=100, days=1080, communes=1200, enterprises=100000):
+    datasets = synthetic.make_raw_datasets(stations, days, communes, enterprises)
+    formats = [None, "gzip"] + (["zstd"] if raw_store.zstandard is not None else [])
+    parsers = [("json", None)] + ([("orjson", raw_store.orjson)] if raw_store.orjson is not None else [])
+
+    results = {}
+    old_dir, old_compression, old_orjson = raw_store.raw_dir, raw_store.compression, raw_store.orjson
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir = tmp
+            for name, records in datasets.items():
+                path = raw_store.legacy_path(name)
+                key = raw_store.legacy_keys.get(name, raw_store.legacy_default_key)
+                t0 = time.perf_counter()
+                synthetic.write_legacy_file(path, key, records)
+                t_write = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                with open(path, "r", encoding="utf-8") as f:
+                    count = len(json.load(f)[key])
+                t_read = time.perf_counter() - t0
+                results[(name, "json indenté")] = {"records": count, "bytes": os.path.getsize(path),
+                                                   "write_s": t_write, "read_s": t_read}
+                os.remove(path)
+
+                for fmt in formats:
+                    raw_store.compression = fmt
+                    for parser, module in parsers:
+                        raw_store.orjson = module
+                        t0 = time.perf_counter()
+                        raw_store.write_records(name, records)
+                        t_write = time.perf_counter() - t0
+                        t0 = time.perf_counter()
+                        count = count_records(name)
+                        t_read = time.perf_counter() - t0
+                        results[(name, f"{raw_store.extensions[fmt]} {parser}")] = {
+                            "records": count, "bytes": os.path.getsize(raw_store.raw_path(name)),
+                            "write_s": t_write, "read_s": t_read,
+                        }
+                    raw_store.remove_raw(name)
+    finally:
+        raw_store.raw_dir, raw_store.compression, raw_store.orjson = old_dir, old_compression, old_orjson
+
+    print(f"\n{'dataset':<18}{'format':<22}{'records':>9}{'taille':>12}{'écriture':>11}{'lecture':>10}")
+    for (name, fmt), r in results.items():
+        print(f"{name:<18}{fmt:<22}{r['records']:>9}{r['bytes'] / 1024:>9.0f} Ko{r['write_s']:>10.2f}s{r['read_s']:>9.2f}s")
+    return {f"{name} {fmt}": r for (name, fmt), r in results.items()}
+
+
+#####################################################################################
+#                               BENCHMARK STOCKAGE (CSV / PARQUET)
+#####################################################################################
+
+tables = ["NO2_data", "PM10_data", "population_data", "enterprise_data"]
+
+
+def bench_storage(stations=100, days=1080, enterprises=100000):
+    results = {}
+    old_backend, old_export, old_raw, old_clean = storage.backend, storage.export_csv, raw_store.raw_dir, storage.clean_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir = tmp
+            storage.clean_dir = tmp
+            storage.export_csv = False
+            synthetic.write_raw_files(stations=stations, days=days, enterprises=enterprises)
+            process_data.process_pollution_data(["NO2", "PM10"])
+            process_data.process_population_data()
+            process_data.process_enterprise_data()
+
+            frames = {name: storage.load_table(name) for name in tables}
+            for fmt in ["csv", "parquet"]:
+                storage.backend = fmt
+                for name, df in frames.items():
+                    t0 = time.perf_counter()
+                    storage.save_table(df, name)
+                    t_write = time.perf_counter() - t0
+                    t0 = time.perf_counter()
+                    storage.load_table(name)
+                    t_read = time.perf_counter() - t0
+                    size = os.path.getsize(storage.table_path(name))
+                    results[f"{name}.{fmt}"] = {"rows": len(df), "write_s": t_write, "read_s": t_read, "bytes": size}
+    finally:
+        storage.backend, storage.export_csv, raw_store.raw_dir, storage.clean_dir = old_backend, old_export, old_raw, old_clean
+
+    print(f"\n{'table':<24}{'lignes':>9}{'écriture':>11}{'lecture':>10}{'taille':>12}")
+    for key, r in results.items():
+        print(f"{key:<24}{r['rows']:>9}{r['write_s']:>10.3f}s{r['read_s']:>9.3f}s{r['bytes'] / 1024:>9.0f} Ko")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK ÉPISODES DE DÉPASSEMENT
+#####################################################################################
+
+# Ancien chemin : rolling(3) par groupe via lambda (compte 3 lignes, pas 3 jours)
+def legacy_rolling_alerts(df, threshold=200):
+    daily = df.groupby(["commune", "station", "date_local"], observed=True)["no2_value"].mean().reset_index()
+    daily["over"] = daily["no2_value"] > threshold
+    daily = daily.sort_values(by=["commune", "station", "date_local"])
+    daily["over_rolling3"] = (
+        daily.groupby(["commune", "station"], observed=True)["over"]
+        .transform(lambda x: x.rolling(window=3, min_periods=3).sum())
+    )
+    return daily[daily["over_rolling3"] >= 3]
+
+
+def bench_episodes(stations=1000, years=10):
+    df = synthetic.make_daily_measures(stations, years * 365)
+
+    t0 = time.perf_counter()
+    legacy = legacy_rolling_alerts(df)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    result = episodes.detect_episodes(df, "no2_value", 200, min_days=3)
+    t_new = time.perf_counter() - t0
+
+    print(f"\nÉpisodes NO2 > 200 sur 3 jours, {stations} stations x {years} ans ({len(df)} lignes) :")
+    print(f"  rolling(3) par groupe (lambda) : {t_legacy:6.2f}s, {len(legacy)} fenêtres (trous de calendrier ignorés)")
+    print(f"  moteur vectorisé               : {t_new:6.2f}s, {len(result)} épisodes, {int(result['nb_jours'].sum())} jours")
+    return {"legacy_s": t_legacy, "vectorized_s": t_new}
+
+
+#####################################################################################
+#                               BENCHMARK SÉRIES MAPPÉES EN MÉMOIRE
+#####################################################################################
+
+# Épisodes sur le format long (DataFrame) ou sur les séries memmap (timeseries.py), ajout d'un jour
+# (comme build_series en incrémental : le dernier jour connu est effacé puis réécrit avec le suivant)
+def bench_series(stations=1000, years=10):
+    import timeseries
+
+    df = synthetic.make_daily_measures(stations, years * 365)
+    old_clean_dir = storage.clean_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.clean_dir = tmp
+        try:
+            t0 = time.perf_counter()
+            meta = timeseries.write_values("NO2", None, df["station_id"].to_numpy(), df["date_local"].to_numpy(),
+                                           df["no2_value"].to_numpy())
+            timeseries.save_index({"NO2": meta})
+            t_build = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            long_result = episodes.detect_episodes(df, "no2_value", 200, min_days=3)
+            t_long = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            series = timeseries.open_series("NO2")
+            rows, _, _, lengths, _ = episodes.find_runs_matrix(series.window(), 200, 3)
+            t_matrix = time.perf_counter() - t0
+            del series
+
+            last = np.datetime64(meta["start"], "D") + meta["days"] - 1
+            ids = np.tile(np.arange(stations), 2)
+            dates = np.repeat([last, last + 1], stations)
+            t0 = time.perf_counter()
+            timeseries.write_values("NO2", meta, ids, dates, np.full(len(ids), 100.0), clear_from=last)
+            t_append = time.perf_counter() - t0
+        finally:
+            storage.clean_dir = old_clean_dir
+
+    print(f"\nSéries par station, {stations} stations x {years} ans ({len(df)} lignes) :")
+    print(f"  construction du fichier      : {t_build:6.2f}s")
+    print(f"  épisodes, format long        : {t_long:6.2f}s, {len(long_result)} épisodes")
+    print(f"  épisodes, séries memmap      : {t_matrix:6.2f}s, {len(rows)} épisodes, {int(lengths.sum())} jours")
+    print(f"  ajout d'un jour              : {t_append * 1000:6.1f}ms")
+    return {"build_s": t_build, "long_s": t_long, "memmap_s": t_matrix, "append_s": t_append}
+
+
+#####################################################################################
+#                               BENCHMARK PARTITIONS
+#####################################################################################
+
+# Étapes des partitions (process -> rollup -> series -> analyses) : un seul processus ou un par partition
+def bench_partitions(partitions=5, stations=20, days=1080):
+    import logging
+    import pipeline
+    import partitions as partitioning
+    import instrumentation
+
+    definitions = {f"{44 + p}": {"departements": [f"{44 + p}"]} for p in range(partitions)}
+    only = [name for name in pipeline.partition_stages if name != "fetch_pollution"]
+    old_dirs = raw_store.raw_dir, storage.clean_dir, instrumentation.metrics_dir
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            root_raw = os.path.join(tmp, "datas")
+            for p, name in enumerate(definitions):
+                raw_store.raw_dir = os.path.join(root_raw, f"{storage.partition_prefix}{name}")
+                for polluant in ("PM10", "NO2"):
+                    records = synthetic.make_pollution_records(stations * partitions, days, extract_data.polluants[polluant])
+                    raw_store.write_records(f"{polluant}_Data", [r for r in records if r["departement_code"] == name])
+            raw_store.raw_dir = root_raw
+            storage.clean_dir = os.path.join(tmp, "data_clean")
+            instrumentation.metrics_dir = os.path.join(tmp, "metrics")
+
+            for label, workers in [("1 processus", 1), (f"{partitions} processus", partitions)]:
+                t0 = time.perf_counter()
+                statuses = partitioning.run_partitions(definitions, datetime(2022, 1, 1), datetime(2025, 1, 1),
+                                                       only=only, force=True, max_workers=workers, metrics=False,
+                                                       log_level="WARNING")
+                results[label] = time.perf_counter() - t0
+                if partitioning.failed(statuses):
+                    raise RuntimeError(f"échec d'une partition : {statuses}")
+    finally:
+        raw_store.raw_dir, storage.clean_dir, instrumentation.metrics_dir = old_dirs
+        logging.getLogger().setLevel(level)
+
+    print(f"\nPartitions : {partitions} x {stations} stations x {days} jours, 2 polluants :")
+    for label, seconds in results.items():
+        print(f"  {label:<12}: {seconds:6.2f}s")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK CACHE
+#####################################################################################
+
+# Pipeline complet (hors fetch) après un fetch qui réécrit datas/ à l'identique :
+# tout recalculer (dates des fichiers seules) ou reprendre les sorties du cache
+def bench_cache(stations=50, days=1080, enterprises=20000):
+    import logging
+    import pipeline
+    import cache
+    import export_excel
+
+    old_dirs = raw_store.raw_dir, storage.clean_dir, cache.cache_dir, export_excel.export_dir
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir = os.path.join(tmp, "datas")
+            storage.clean_dir = os.path.join(tmp, "data_clean")
+            cache.cache_dir = os.path.join(tmp, "cache")
+            export_excel.export_dir = os.path.join(tmp, "export_auto")
+            synthetic.write_raw_files(stations, days, enterprises=enterprises)
+            stages = pipeline.build_stages(datetime(2022, 1, 1), datetime(2025, 1, 1))
+            selected = [stage for stage in stages if stage.group != "fetch"]
+
+            for label, use_cache in [("premier run", True), ("sans cache", False), ("avec cache", True)]:
+                time.sleep(0.01)
+                for name in os.listdir(raw_store.raw_dir):
+                    os.utime(os.path.join(raw_store.raw_dir, name))
+                t0 = time.perf_counter()
+                status, _ = pipeline.run(stages, selected, metrics=False, use_cache=use_cache)
+                results[label] = time.perf_counter() - t0
+                if any(state in ("échec", "bloqué") for state in status.values()):
+                    raise RuntimeError(f"échec du pipeline : {status}")
+            cached = sum(state == "en cache" for state in status.values())
+            size_mb = sum(size for _, size, _ in cache.entries()) / (1024 * 1024)
+    finally:
+        raw_store.raw_dir, storage.clean_dir, cache.cache_dir, export_excel.export_dir = old_dirs
+        logging.getLogger().setLevel(level)
+
+    print(f"\nCache des étapes, {stations} stations x {days} jours, {enterprises} établissements, datas/ réécrit à l'identique :")
+    for label, seconds in results.items():
+        print(f"  {label:<12}: {seconds:6.2f}s")
+    print(f"  {cached} étapes reprises du cache, cache : {size_mb:.1f} Mo")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK BASE SQLITE
+#####################################################################################
+
+# Analyses en pandas (tables rechargées puis agrégées) ou en SQL dans data_clean/air.sqlite
+# (par défaut 10x le volume de la suite : 500 stations x 1080 jours, NO2 et PM10)
+def bench_database(stations=500, days=1080):
+    import normes
+    import database
+
+    old_dirs = storage.clean_dir, storage.shared_dir
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage.clean_dir, storage.shared_dir = tmp, None
+            rows = 0
+            for seed, polluant in enumerate(["NO2", "PM10"]):
+                df = synthetic.make_daily_measures(stations, days, storage.value_column(polluant), seed=seed)
+                storage.save_table(df.drop(columns=["commune", "station"]), f"{polluant}_data")
+                rows += len(df)
+            commune_ids = np.arange(stations // 2 + 1, dtype="int32")
+            storage.save_table(pd.DataFrame({"commune_id": commune_ids, "code_insee": [f"44{i:03d}" for i in commune_ids],
+                                             "commune": [f"Commune {i}" for i in commune_ids]}), "dim_commune")
+            storage.save_table(pd.DataFrame({"station_id": np.arange(stations, dtype="int32"),
+                                             "code_station": [f"FR{i:05d}" for i in range(stations)],
+                                             "station": [f"Station {i}" for i in range(stations)],
+                                             "commune_id": np.arange(stations, dtype="int32") // 2}), "dim_station")
+
+            t0 = time.perf_counter()
+            database.build_database(incremental=False)
+            t_build = time.perf_counter() - t0
+            size_mb = os.path.getsize(database.database_path()) / (1024 * 1024)
+
+            no2, pm10 = normes.get_norme("no2_3jours"), normes.get_norme("pm10_alerte")
+
+            def pandas_episodes(polluant, norme):
+                df = storage.load_table(f"{polluant}_data")
+                return episodes.detect_episodes(df, storage.value_column(polluant), norme["valeur"],
+                                                min_days=norme["jours_consecutifs"])
+
+            def pandas_normes():
+                return normes.evaluate_norms({p: storage.load_table(f"{p}_data") for p in ["NO2", "PM10"]})
+
+            def pandas_dashboard():
+                counts = [pandas_episodes(p, n)["commune_id"].value_counts() for p, n in [("NO2", no2), ("PM10", pm10)]]
+                return pd.concat(counts, axis=1).fillna(0)
+
+            cases = {
+                "épisodes NO2": (lambda: pandas_episodes("NO2", no2),
+                                 lambda: database.detect_episodes("NO2", no2["valeur"], no2["jours_consecutifs"])),
+                "toutes normes": (pandas_normes, database.evaluate_norms),
+                "Dashboard": (pandas_dashboard, database.alert_counts),
+            }
+            for name, (pandas_path, sql_path) in cases.items():
+                t0 = time.perf_counter()
+                expected = pandas_path()
+                t_pandas = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                result = sql_path()
+                t_sql = time.perf_counter() - t0
+                results[name] = {"pandas_s": t_pandas, "sql_s": t_sql}
+                if len(expected) != len(result):
+                    raise RuntimeError(f"{name} : {len(expected)} lignes en pandas, {len(result)} en SQL")
+    finally:
+        storage.clean_dir, storage.shared_dir = old_dirs
+
+    print(f"\nBase SQLite, {stations} stations x {days} jours, 2 polluants ({rows} mesures) :")
+    print(f"  chargement de la base : {t_build:6.2f}s ({size_mb:.0f} Mo)")
+    for name, timing in results.items():
+        print(f"  {name:<14}: pandas {timing['pandas_s']:6.2f}s, SQL {timing['sql_s']:6.2f}s")
+    return dict(results, build_s=t_build)
+
+
+#####################################################################################
+#                               BENCHMARK ALERTES EN CONTINU
+#####################################################################################
+
+# Un jour publié à la fois (serveur de rejeu) : interrogation du service live_alerts
+# contre la relecture complète de l'historique par episodes.detect_episodes à chaque nouveau jour
+def bench_live(stations=500, days=365):
+    import asyncio
+    import normes
+    import live_alerts
+
+    rng = np.random.default_rng(0)
+    start = datetime(2023, 1, 1)
+    records = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for s, value in enumerate(np.minimum(rng.gamma(4.0, 55.0, stations), 999).round(1)):
+            record = synthetic.make_pollution_record("44", s, day, extract_data.polluants["NO2"])
+            record["valeur"] = float(value)
+            records.append(record)
+    norme = normes.get_norme("no2_3jours")
+
+    old_dirs, old_url = (storage.clean_dir, storage.shared_dir), extract_data.pollution_url
+    replay = live_alerts.Replay(records, speed=None)
+    server, extract_data.pollution_url = live_alerts.start_replay_server(replay)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage.clean_dir, storage.shared_dir = tmp, None
+            events = []
+            service = live_alerts.AlertService(norms=[norme["id"]], handlers=[events.append], clock=replay.now)
+
+            async def follow():
+                timings = []
+                while not replay.finished():
+                    t0 = time.perf_counter()
+                    await service.poll()
+                    timings.append(time.perf_counter() - t0)
+                    replay.advance()
+                return timings
+
+            live_timings = asyncio.run(follow())
+    finally:
+        server.shutdown()
+        storage.clean_dir, storage.shared_dir = old_dirs
+        extract_data.pollution_url = old_url
+
+    df = pd.DataFrame({
+        "commune_id": np.zeros(len(records), dtype="int32"),
+        "station_id": np.array([int(r["code_station"][-3:]) for r in records], dtype="int32"),
+        "date_local": pd.to_datetime([r["date_heure_local"][:10] for r in records]),
+        "valeur": np.array([r["valeur"] for r in records], dtype="float32"),
+    })
+    t0 = time.perf_counter()
+    expected = episodes.detect_episodes(df, "valeur", norme["valeur"], min_days=norme["jours_consecutifs"])
+    t_batch = time.perf_counter() - t0
+    alerts = sum(1 for event in events if event["type"] == "alerte")
+    if alerts != len(expected):
+        raise RuntimeError(f"{alerts} alertes en continu, {len(expected)} épisodes en batch")
+
+    per_poll = statistics.median(live_timings)
+    print(f"\nAlertes en continu, {stations} stations x {days} jours ({alerts} alertes, identiques au batch) :")
+    print(f"  interrogation du service (HTTP local + état) : {per_poll * 1000:7.1f} ms par jour publié")
+    print(f"  batch sur tout l'historique               : {t_batch * 1000:7.1f} ms à chaque nouveau jour")
+    return {"live_poll_s": per_poll, "batch_s": t_batch}
+
+
+#####################################################################################
+#                               BENCHMARK MESURES HORAIRES
+#####################################################################################
+
+# Mois bruts horaires (datas/horaire/) -> tables mensuelles -> normes horaires par station et par année
+def bench_hourly(stations=50, days=365):
+    import hourly
+    import normes
+
+    rng = np.random.default_rng(0)
+    start = datetime(2023, 1, 1)
+    old_dirs = raw_store.raw_dir, storage.clean_dir, storage.shared_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir, storage.clean_dir, storage.shared_dir = os.path.join(tmp, "datas"), os.path.join(tmp, "clean"), None
+            index, records = {}, 0
+            for month, month_start, month_end in extract_data.month_ranges(start, start + timedelta(days=days) - timedelta(hours=1)):
+                hours = int((month_end - month_start).total_seconds() // 3600) + 1
+                values = np.minimum(rng.gamma(2.0, 45.0, (hours, stations)), 999).round(1)
+                batch = []
+                for h in range(hours):
+                    t = month_start + timedelta(hours=h)
+                    stamp_tu, stamp_local = t.strftime("%Y-%m-%dT%H:00:00Z"), t.strftime("%Y-%m-%dT%H:00:00+01:00")
+                    for s in range(stations):
+                        batch.append({"code_station": f"FR44{s:03d}", "nom_station": f"Station 44-{s}",
+                                      "code_commune": f"44{s:03d}", "nom_commune": f"Commune 44-{s}",
+                                      "valeur": float(values[h, s]), "date_heure_tu": stamp_tu, "date_heure_local": stamp_local})
+                os.makedirs(os.path.dirname(raw_store.raw_path(extract_data.hourly_dataset("NO2", month))), exist_ok=True)
+                index.setdefault("NO2", {})[month] = {"records": raw_store.write_records(extract_data.hourly_dataset("NO2", month), batch),
+                                                       "complete": True}
+                records += len(batch)
+            instrumentation.write_atomic(extract_data.hourly_index_path(), json.dumps(index))
+
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            hourly.process_hourly(incremental=False)
+            t_process = time.perf_counter() - t0
+            _, peak_process = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            alerts = hourly.evaluate_hourly_norms()
+            t_evaluate = time.perf_counter() - t0
+            _, peak_evaluate = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            limite = normes.get_norme("no2_limite_horaire")
+            df = hourly.load_months("NO2", sorted(index["NO2"]))
+            expected = int((df["no2_value"] > limite["valeur"]).sum())
+            got = int(alerts.loc[alerts["norme_id"] == limite["id"], "nb_depassements"].sum())
+            if expected != got:
+                raise RuntimeError(f"{got} heures de dépassement comptées, {expected} attendues")
+    finally:
+        raw_store.raw_dir, storage.clean_dir, storage.shared_dir = old_dirs
+
+    print(f"\nMesures horaires NO2, {stations} stations x {days} jours ({records} mesures) :")
+    print(f"  nettoyage mois par mois : {t_process:6.2f}s (pic {peak_process / 1e6:6.1f} Mo)")
+    print(f"  normes horaires         : {t_evaluate:6.2f}s (pic {peak_evaluate / 1e6:6.1f} Mo, {len(alerts)} lignes)")
+    return {"process_s": t_process, "evaluate_s": t_evaluate}
+
+
+#####################################################################################
+#                               BENCHMARK ACTIVITÉ DES ENTREPRISES
+#####################################################################################
+
+# Cube créations / fermetures : construction complète, puis mise à jour après le dernier mois d'établissements
+# (comptes vérifiés sur les records bruts)
+def bench_entreprises(enterprises=500000, communes=2000):
+    import entreprises
+
+    records = [synthetic.make_enterprise_record(e, communes) for e in range(enterprises)]
+    # créations du 2024-01-01 au 2025-08-22 : août 2025 ajouté au second passage
+    first = [r for r in records if r["datecreationetablissement"] < "2025-08"]
+    old_dirs = raw_store.raw_dir, storage.clean_dir, storage.shared_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir, storage.clean_dir, storage.shared_dir = os.path.join(tmp, "datas"), tmp, None
+            raw_store.write_records("enterprise_data", first)
+            process_data.process_enterprise_data()
+            entreprises.build_activity_cube(incremental=False)
+
+            raw_store.write_records("enterprise_data", records)
+            process_data.process_enterprise_data()
+            t0 = time.perf_counter()
+            entreprises.build_activity_cube(incremental=False)
+            t_full = time.perf_counter() - t0
+            full = storage.load_table(entreprises.table_cube)
+
+            raw_store.write_records("enterprise_data", first)
+            process_data.process_enterprise_data()
+            entreprises.build_activity_cube(incremental=False)
+            raw_store.write_records("enterprise_data", records)
+            process_data.process_enterprise_data()
+            t0 = time.perf_counter()
+            entreprises.build_activity_cube(incremental=True)
+            t_incremental = time.perf_counter() - t0
+            cube = storage.load_table(entreprises.table_cube)
+    finally:
+        raw_store.raw_dir, storage.clean_dir, storage.shared_dir = old_dirs
+
+    closed = sum(1 for r in records if r["datefermetureetablissement"])
+    for name, df in [("complet", full), ("incrémental", cube)]:
+        if int(df["nb_creations"].sum()) != enterprises or int(df["nb_fermetures"].sum()) != closed:
+            raise RuntimeError(f"cube {name} : {df['nb_creations'].sum()} créations / {df['nb_fermetures'].sum()} fermetures, "
+                               f"{enterprises} / {closed} attendues")
+
+    print(f"\nCube des entreprises, {enterprises} établissements ({len(cube)} lignes) :")
+    print(f"  cube complet             : {t_full:6.2f}s")
+    print(f"  mise à jour incrémentale : {t_incremental:6.2f}s")
+    return {"full_s": t_full, "incremental_s": t_incremental}
+
+
+#####################################################################################
+#                               BENCHMARK CLÉS ENTIÈRES
+#####################################################################################
+
+# Regroupement et jointure sur les noms (texte) ou sur commune_id / station_id (int32)
+def bench_dimensions(stations=1000, years=10):
+    df = synthetic.make_daily_measures(stations, years * 365)
+    communes = pd.DataFrame({"commune_id": np.arange(stations // 2 + 1, dtype="int32")})
+    communes["commune"] = [f"Commune {i}" for i in communes["commune_id"]]
+    communes["population_totale"] = np.arange(len(communes)) * 100
+
+    keys = {
+        "texte": (df[["commune", "station", "date_local", "no2_value"]].astype({"commune": object, "station": object}),
+                  ["commune", "station"], "commune", communes[["commune", "population_totale"]]),
+        "int32": (df[["commune_id", "station_id", "date_local", "no2_value"]],
+                  ["commune_id", "station_id"], "commune_id", communes[["commune_id", "population_totale"]]),
+    }
+    results = {}
+    print(f"\nClés de regroupement, {stations} stations x {years} ans ({len(df)} lignes) :")
+    for name, (frame, group_cols, join_col, right) in keys.items():
+        t0 = time.perf_counter()
+        frame.groupby(group_cols + [frame["date_local"].dt.year])["no2_value"].mean()
+        t_group = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        frame.merge(right, on=join_col, how="left")
+        t_merge = time.perf_counter() - t0
+
+        memory_mb = frame[group_cols].memory_usage(deep=True).sum() / (1024 * 1024)
+        results[name] = {"groupby_s": t_group, "merge_s": t_merge, "keys_mb": memory_mb}
+        print(f"  {name:<6}: groupby {t_group:6.2f}s, merge {t_merge:6.2f}s, colonnes clés {memory_mb:7.1f} Mo")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK EXPORT EXCEL
+#####################################################################################
+
+# Exécuté dans un sous-processus pour que le pic RSS de chaque writer soit indépendant
+def excel_worker(mode, rows):
+    import resource
+    from openpyxl import Workbook
+    import export_excel
+
+    stations = 100
+    df = synthetic.make_daily_measures(stations, rows // stations)
+    path = os.path.join(tempfile.gettempdir(), f"bench_export_{os.getpid()}.xlsx")
+
+    t0 = time.perf_counter()
+    wb = Workbook(write_only=(mode == "streaming"))
+    if mode != "streaming":
+        wb.remove(wb.active)
+    export_excel.write_sheet(wb, "NO2", df)
+    wb.save(path)
+    elapsed = time.perf_counter() - t0
+    os.remove(path)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"rows": len(df), "seconds": elapsed, "peak_rss_mb": peak_kb / 1024}))
+
+
+def bench_excel(rows=500000):
+    results = {}
+    for mode in ["memory", "streaming"]:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "excel_worker", mode, str(rows)],
+            capture_output=True, text=True, check=True,
+        )
+        results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"\nExport Excel de {results['memory']['rows']} lignes :")
+    for mode, r in results.items():
+        print(f"  {mode:<10}: {r['seconds']:6.2f}s, {r['rows'] / r['seconds']:9.0f} lignes/s, pic RSS {r['peak_rss_mb']:7.0f} Mo")
+    return results
+
+
+#####################################################################################
+#                               BENCHMARK DÉMARRAGE
+#####################################################################################
+
+# Bibliothèques lourdes dont on vérifie qu'elles ne sont pas chargées inutilement
+heavy_modules = ["pandas", "pyarrow", "requests", "openpyxl", "matplotlib"]
+
+
+# Coût d'import (python -X importtime) de Main.py + des modules des étapes d'une sous-commande
+# (les imports faits à l'intérieur des fonctions d'étape sont payés pendant l'étape)
+def startup_imports(command):
+    import pipeline
+    import Main
+
+    group = Main.commands[command][0]
+    stages = pipeline.build_stages(datetime(2024, 1, 1), datetime(2025, 1, 1))
+    modules = sorted({stage.func.args[0] for stage in stages if group is None or stage.group == group})
+    code = "; ".join(["import Main"] + [f"import {module}" for module in modules] + [
+        "import sys",
+        f"print(','.join(m for m in {heavy_modules!r} if m in sys.modules))",
+    ])
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                         capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    # lignes "import time: self | cumulé | module" ; modules de premier niveau = sans indentation
+    total_us = 0
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", line)
+        if match and not match.group(2).startswith(" "):
+            total_us += int(match.group(1))
+    loaded = out.stdout.strip()
+    return total_us / 1e6, loaded.split(",") if loaded else []
+
+
+def bench_startup(repeat=5):
+    results = {}
+    print("\nDémarrage par sous-commande (imports, meilleur de %d) :" % repeat)
+    for command in ["fetch", "process", "analyse", "export", "all"]:
+        runs = [startup_imports(command) for _ in range(repeat)]
+        seconds = min(run[0] for run in runs)
+        results[command] = {"import_s": seconds, "modules": runs[0][1]}
+        print(f"  {command:<8}: {seconds * 1000:6.0f} ms  ({', '.join(runs[0][1]) or 'aucune bibliothèque lourde'})")
+    return results
+
+
+#####################################################################################
+#                               SUITE DE NON-RÉGRESSION
+#####################################################################################
+
+history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.json")
+
+# Régression : plus lent (ou plus gourmand) que la médiane des derniers runs comparables de plus de `threshold`
+history_window = 5
+min_seconds = 0.05   # écarts plus petits ignorés (bruit de mesure)
+min_memory_mb = 5
+
+
+# Étapes mesurées : celles du pipeline, sauf les fetch (réseau ; voir extract et sirene)
+def suite_stages():
+    import pipeline
+    import rollup
+    from functools import partial
+
+    stages = [s for s in pipeline.build_stages(datetime(2024, 1, 1), datetime(2025, 1, 1)) if not s.name.startswith("fetch")]
+    for stage in stages:
+        if stage.name == "rollup":
+            stage.func = partial(rollup.build_rollups, incremental=False)  # même travail à chaque répétition
+        if stage.name == "series":
+            stage.func = partial(pipeline.call, "timeseries", "build_series", incremental=False)
+        if stage.name == "analyse_exposition":
+            stage.func = partial(pipeline.call, "analyse", "analyse_exposition", incremental=False)
+        if stage.name == "database":
+            stage.func = partial(pipeline.call, "database", "build_database", incremental=False)
+        if stage.name == "rollup_entreprises":
+            stage.func = partial(pipeline.call, "entreprises", "build_activity_cube", incremental=False)
+    return stages
+
+
+# Exécuter une étape dans un processus neuf ; sortie : une ligne JSON
+# mode "time" : temps mur et CPU, sans traçage
+# mode "memory" : pic des allocations Python / numpy / pandas de l'étape (tracemalloc, qui ralentit)
+def suite_worker(stage_name, directory, mode):
+    import io
+    import contextlib
+    import cache
+    import export_excel
+
+    raw_store.raw_dir = directory
+    storage.clean_dir = directory
+    export_excel.export_dir = directory
+    # graphiques rendus à chaque répétition, rien d'écrit dans le cache/ du dépôt
+    cache.cache_dir = os.path.join(directory, "cache")
+    cache.enabled = False
+    stage = next(s for s in suite_stages() if s.name == stage_name)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "memory":
+            tracemalloc.start()
+            stage.func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result = {"peak_mb": peak / (1024 * 1024)}
+        else:
+            wall, cpu = time.perf_counter(), time.process_time()
+            stage.func()
+            result = {"seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+    print(json.dumps(result))
+
+
+def run_suite_stage(stage_name, directory, mode):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "suite_worker", stage_name, directory, mode],
+        capture_output=True, text=True, env=dict(os.environ, MPLBACKEND="Agg"),
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"{stage_name} a échoué :\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Comparer chaque étape à la médiane des derniers runs de même échelle sur la même machine
+def compare_to_history(results, history, scale, threshold):
+    previous = [run for run in history if run["scale"] == scale and run["machine"] == platform.node()]
+    previous = previous[-history_window:]
+
+    report = {}
+    for name, r in results.items():
+        past = [run["results"][name] for run in previous if name in run["results"]]
+        if not past:
+            report[name] = {"status": "nouveau"}
+            continue
+        base_s = statistics.median(p["seconds"] for p in past)
+        base_mb = statistics.median(p["peak_mb"] for p in past)
+        slower = r["seconds"] > base_s * (1 + threshold) and r["seconds"] - base_s > min_seconds
+        bigger = r["peak_mb"] > base_mb * (1 + threshold) and r["peak_mb"] - base_mb > min_memory_mb
+        report[name] = {
+            "status": "RÉGRESSION" if slower or bigger else "ok",
+            "base_s": base_s,
+            "base_mb": base_mb,
+        }
+    return report
+
+
+def run_suite(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark.py suite", description="Benchmark de non-régression des étapes du pipeline")
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--days", type=int, default=1080)
+    parser.add_argument("--communes", type=int, default=1200)
+    parser.add_argument("--enterprises", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="répétitions par étape (on garde la meilleure)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="régression tolérée (0.2 = +20%%)")
+    parser.add_argument("--only", help="étapes à mesurer, séparées par des virgules")
+    parser.add_argument("--history", default=history_file)
+    parser.add_argument("--no-save", action="store_true", help="ne pas ajouter ce run à l'historique")
+    args = parser.parse_args(argv)
+
+    scale = {"stations": args.stations, "days": args.days, "communes": args.communes, "enterprises": args.enterprises}
+    stages = suite_stages()
+    names = [stage.name for stage in stages]
+    if args.only:
+        names = [name for name in names if name in args.only.split(",")]
+
+    # Étapes amont des étapes mesurées : exécutées une fois, sans mesure, pour produire leurs entrées
+    needed = set(names)
+    for stage in reversed(stages):
+        if stage.name in needed:
+            needed.update(dep.name for dep in stage.deps)
+
+    results = {}
+    old_dir = raw_store.raw_dir
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_store.raw_dir = tmp
+            t0 = time.perf_counter()
+            synthetic.write_raw_files(polluants=process_data.polluants, **scale)
+            print(f"Données synthétiques générées en {time.perf_counter() - t0:.1f}s ({scale})")
+
+            # Étapes dans l'ordre du pipeline : chacune lit les sorties des précédentes
+            for stage in stages:
+                name = stage.name
+                if name not in needed:
+                    continue
+                if name not in names:
+                    run_suite_stage(name, tmp, "time")
+                    continue
+                runs = [run_suite_stage(name, tmp, "time") for _ in range(args.repeat)]
+                results[name] = {key: min(run[key] for run in runs) for key in runs[0]}
+                results[name].update(run_suite_stage(name, tmp, "memory"))
+                print(f"  {name:<22}{results[name]['seconds']:8.2f}s")
+    finally:
+        raw_store.raw_dir = old_dir
+
+    history = load_history(args.history)
+    report = compare_to_history(results, history, scale, args.threshold)
+
+    print(f"\n{'étape':<22}{'mur':>9}{'cpu':>9}{'pic':>10}{'réf. mur':>11}{'réf. pic':>11}  statut")
+    for name, r in results.items():
+        ref = report[name]
+        base_s = f"{ref['base_s']:.2f}s" if "base_s" in ref else "-"
+        base_mb = f"{ref['base_mb']:.0f} Mo" if "base_mb" in ref else "-"
+        print(f"{name:<22}{r['seconds']:>8.2f}s{r['cpu_seconds']:>8.2f}s{r['peak_mb']:>7.0f} Mo"
+              f"{base_s:>11}{base_mb:>11}  {ref['status']}")
+
+    if not args.no_save:
+        history.append({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "scale": scale,
+            "results": results,
+        })
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=4)
+
+    regressions = [name for name, ref in report.items() if ref["status"] == "RÉGRESSION"]
+    if regressions:
+        print(f"\nRégression (> {args.threshold:.0%}) : {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "sirene": bench_sirene,
+    "ingest": bench_ingest,
+    "raw": bench_raw,
+    "storage": bench_storage,
+    "episodes": bench_episodes,
+    "dimensions": bench_dimensions,
+    "series": bench_series,
+    "partitions": bench_partitions,
+    "cache": bench_cache,
+    "database": bench_database,
+    "live": bench_live,
+    "hourly": bench_hourly,
+    "entreprises": bench_entreprises,
+    "excel": bench_excel,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["excel_worker"]:
+        excel_worker(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    if sys.argv[1:2] == ["suite_worker"]:
+        suite_worker(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit(0)
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(run_suite(sys.argv[2:]))
+
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,386 @@
+# cache.py
+# Mémoïsation des étapes du pipeline par empreinte de contenu
+# Clé d'une étape : fonction et arguments + code des modules utilisés (seuils de normes.py, règles de
+# nettoyage de process_data.py...) + contenu de chaque fichier d'entrée.
+# Un fetch qui réécrit datas/ à l'identique change les dates des fichiers mais pas la clé :
+# les sorties sont reprises du cache au lieu de tout recalculer (et de redessiner les graphiques).
+# cache/stages/<clé>/ : copie des sorties + manifest.json ; cache/charts/<clé>.png : graphiques du rapport
+# Les entrées les moins récemment utilisées sont supprimées dès que le dossier dépasse max_size_mb
+import os
+import ast
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import contextlib
+import importlib.util
+import storage
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+cache_dir = os.path.join(script_dir, "cache")
+
+# Main.py --no-cache : ni étapes ni graphiques repris du cache
+enabled = True
+
+# Taille maximale du cache (sorties des étapes + graphiques)
+max_size_mb = 2048
+
+chunk_size = 1024 * 1024
+digest_size = 16
+
+_lock = threading.Lock()
+_hashes = None  # chemin -> [taille, mtime_ns, empreinte] (cache/hashes.json)
+_sources = {}   # module -> empreinte de son code et des modules locaux qu'il importe
+
+
+# enabled fixé le temps d'un bloc (pipeline.run(use_cache=...)), puis remis à sa valeur
+@contextlib.contextmanager
+def enabled_as(value):
+    global enabled
+    previous, enabled = enabled, value
+    try:
+        yield
+    finally:
+        enabled = previous
+
+
+def set_enabled(value):
+    global enabled
+    enabled = value
+
+
+def stages_dir():
+    return os.path.join(cache_dir, "stages")
+
+
+def charts_dir():
+    return os.path.join(cache_dir, "charts")
+
+
+def hashes_path():
+    return os.path.join(cache_dir, "hashes.json")
+
+
+# Copie puis renommage, fichier temporaire propre à l'appel (partitions en parallèle dans le même cache)
+# Les autres écritures passent par instrumentation.write_atomic
+def copy_atomic(source, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+#####################################################################################
+#                               EMPREINTES
+#####################################################################################
+
+def new_hash():
+    return hashlib.blake2b(digest_size=digest_size)
+
+
+def hash_bytes(data):
+    h = new_hash()
+    h.update(data)
+    return h.hexdigest()
+
+
+def hash_file(path):
+    h = new_hash()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_hashes():
+    global _hashes
+    if _hashes is None:
+        try:
+            with open(hashes_path(), encoding="utf-8") as f:
+                _hashes = json.load(f)
+        except (FileNotFoundError, ValueError):
+            _hashes = {}
+    return _hashes
+
+
+def save_hashes():
+    with _lock:
+        text = json.dumps(load_hashes())
+    instrumentation.write_atomic(hashes_path(), text)
+
+
+# Empreinte d'un fichier dont on connaît déjà le contenu (copie restaurée, sortie stockée)
+def remember(path, digest, stat=None):
+    stat = stat or os.stat(path)
+    with _lock:
+        load_hashes()[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+
+
+# Empreinte du contenu d'un fichier, relu seulement si sa taille ou sa date a changé
+def file_digest(path):
+    stat = os.stat(path)
+    with _lock:
+        known = load_hashes().get(os.path.abspath(path))
+    if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+        return known[2]
+    digest = hash_file(path)
+    remember(path, digest, stat)
+    return digest
+
+
+# Modules du dépôt importés par un module (imports dans les fonctions compris)
+def local_imports(source):
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+    return sorted(name for name in names if os.path.exists(os.path.join(script_dir, f"{name}.py")))
+
+
+# Empreinte du code d'un module et de tous les modules locaux dont il dépend
+# (les seuils et paramètres sont des constantes des modules : les changer invalide les étapes concernées)
+def source_digest(module):
+    if module not in _sources:
+        h = new_hash()
+        seen, todo = set(), [module]
+        while todo:
+            name = todo.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            spec = importlib.util.find_spec(name)
+            if spec is None or not spec.origin or not os.path.exists(spec.origin):
+                continue
+            with open(spec.origin, "rb") as f:
+                source = f.read()
+            todo += local_imports(source)
+            h.update(f"{name}:{hash_bytes(source)};".encode())
+        _sources[module] = h.hexdigest()
+    return _sources[module]
+
+
+# Fonction d'une étape : partial(call, "analyse", "analyse_NO2", ...) -> texte stable
+def describe(func):
+    if hasattr(func, "func"):
+        return repr((describe(func.func), func.args, sorted(func.keywords.items())))
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+# Clé d'une étape : None si elle n'est pas mémoïsable (sans entrée, comme un fetch, ou déclarée non cacheable)
+def stage_key(stage):
+    if not stage.cacheable or not stage.inputs or not stage.outputs:
+        return None
+    h = new_hash()
+    h.update(repr((stage.name, describe(stage.func), storage.backend, storage.export_csv)).encode())
+    if stage.module:
+        h.update(source_digest(stage.module).encode())
+    for path in stage.inputs:
+        digest = file_digest(path) if os.path.exists(path) else "absent"
+        h.update(f"{os.path.basename(path)}:{digest};".encode())
+    return h.hexdigest()
+
+
+#####################################################################################
+#                               SORTIES DES ÉTAPES
+#####################################################################################
+
+# Sorties déclarées + copie CSV des tables qui en ont une (storage.has_csv_copy)
+def output_files(stage):
+    files = []
+    for path in stage.outputs:
+        files.append(path)
+        base, ext = os.path.splitext(path)
+        if ext == f".{storage.backend}" and storage.has_csv_copy(os.path.basename(base)):
+            files.append(base + ".csv")
+    return files
+
+
+def read_manifest(entry):
+    try:
+        with open(os.path.join(entry, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# Reprendre les sorties d'une exécution précédente avec la même clé ; False si absente du cache
+# Une sortie déjà identique n'est pas recopiée, seulement datée (l'étape sera "à jour" au prochain run)
+def restore(stage, key):
+    entry = os.path.join(stages_dir(), key)
+    manifest = read_manifest(entry)
+    files = output_files(stage)
+    if manifest is None or len(manifest["files"]) != len(files):
+        return False
+
+    import dimensions  # (pandas : seulement si l'étape est dans le cache)
+    # identifiants des tables en cache encore attribués (data_clean/ effacé depuis, par exemple)
+    if not dimensions.extends(manifest["dimensions"]):
+        logger.info("%s : dimensions modifiées depuis la mise en cache, étape recalculée", stage.name)
+        return False
+
+    try:
+        copied = 0
+        for i, (path, item) in enumerate(zip(files, manifest["files"])):
+            if item is None:
+                continue
+            if os.path.exists(path) and file_digest(path) == item["digest"]:
+                os.utime(path)
+            else:
+                copy_atomic(os.path.join(entry, str(i)), path)
+                copied += 1
+            remember(path, item["digest"])
+        os.utime(os.path.join(entry, "manifest.json"))
+    except FileNotFoundError:
+        return False  # entrée supprimée entre-temps (éviction par un autre processus)
+    save_hashes()
+    logger.info("[cache] %s : sorties reprises du cache (%d fichiers copiés)", stage.name, copied)
+    return True
+
+
+# Garder une copie des sorties d'une étape qui vient de tourner
+def store(stage, key):
+    import dimensions
+
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return
+    os.makedirs(stages_dir(), exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(dir=stages_dir(), prefix=f".{key}.")
+    items, size = [], 0
+    try:
+        for i, path in enumerate(output_files(stage)):
+            if not os.path.exists(path):
+                items.append(None)
+                continue
+            stat = os.stat(path)
+            copy = os.path.join(tmp_entry, str(i))
+            shutil.copyfile(path, copy)
+            digest = hash_file(copy)
+            if os.stat(path).st_mtime_ns == stat.st_mtime_ns:
+                remember(path, digest, stat)
+            items.append({"name": os.path.basename(path), "digest": digest})
+            size += os.path.getsize(copy)
+        manifest = {"stage": stage.name, "files": items, "size": size, "dimensions": dimensions.signature()}
+        instrumentation.write_atomic(os.path.join(tmp_entry, "manifest.json"), json.dumps(manifest, indent=4))
+
+        entry = os.path.join(stages_dir(), key)
+        if os.path.exists(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # même clé stockée au même moment par une autre partition : la sienne suffit
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    save_hashes()
+    evict()
+
+
+#####################################################################################
+#                               GRAPHIQUES
+#####################################################################################
+
+def update_hash(h, value):
+    if isinstance(value, dict):
+        for k in sorted(value):
+            h.update(repr(k).encode())
+            update_hash(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for item in value:
+            update_hash(h, item)
+        h.update(b"]")
+    elif hasattr(value, "dtype") and hasattr(value, "tobytes"):  # tableau numpy
+        h.update(f"{value.dtype}{value.shape}".encode())
+        h.update(repr(value.tolist()).encode() if value.dtype.hasobject else value.tobytes())
+    else:
+        h.update(repr(value).encode())
+
+
+# Clé d'un graphique : données et paramètres de la spec + code de rendu (charts.py)
+def chart_key(spec):
+    h = new_hash()
+    h.update(source_digest("charts").encode())
+    update_hash(h, spec)
+    return h.hexdigest()
+
+
+def chart_path(key):
+    return os.path.join(charts_dir(), f"{key}.png")
+
+
+def load_chart(key):
+    try:
+        with open(chart_path(key), "rb") as f:
+            png = f.read()
+        os.utime(chart_path(key))
+        return png
+    except FileNotFoundError:
+        return None
+
+
+def store_chart(key, png):
+    instrumentation.write_atomic(chart_path(key), png)
+
+
+#####################################################################################
+#                               ÉVICTION
+#####################################################################################
+
+# (dernière utilisation, taille, chemin) de chaque entrée du cache
+def entries():
+    result = []
+    if os.path.isdir(stages_dir()):
+        for name in os.listdir(stages_dir()):
+            entry = os.path.join(stages_dir(), name)
+            manifest = read_manifest(entry)
+            if name.startswith(".") or manifest is None:
+                continue
+            try:
+                result.append((os.path.getmtime(os.path.join(entry, "manifest.json")), manifest["size"], entry))
+            except FileNotFoundError:
+                continue
+    if os.path.isdir(charts_dir()):
+        for name in os.listdir(charts_dir()):
+            path = os.path.join(charts_dir(), name)
+            try:
+                if name.endswith(".png"):
+                    result.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except FileNotFoundError:
+                continue
+    return result
+
+
+# Supprimer les entrées les moins récemment utilisées jusqu'à repasser sous max_size_mb
+def evict(limit_mb=None):
+    limit = (max_size_mb if limit_mb is None else limit_mb) * 1024 * 1024
+    items = sorted(entries())
+    total = sum(size for _, size, _ in items)
+    removed = 0
+    for _, size, path in items:
+        if total <= limit:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("[cache] %d entrées supprimées (cache ramené à %.0f Mo)", removed, total / (1024 * 1024))
+    return removed
+
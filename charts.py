@@ -0,0 +1,140 @@
+# charts.py
+# Rendu des graphiques du rapport : API objet de matplotlib (Agg, sans état pyplot global),
+# rendu en parallèle dans un pool de processus, PNG gardés en mémoire (aucun fichier temporaire)
+# et dans cache/charts/ par empreinte des données : seuls les graphiques modifiés sont redessinés
+# matplotlib, pandas et openpyxl ne sont importés qu'au moment de s'en servir
+import io
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cache
+
+logger = logging.getLogger(__name__)
+
+# Backend non interactif, hérité par les processus de rendu (jamais de fenêtre Tk/Qt à ouvrir)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+#####################################################################################
+#                               SPÉCIFICATIONS
+#####################################################################################
+
+# Une spec est un dict picklable : données déjà agrégées + paramètres d'affichage
+# kind : "line", "threshold" ou "bar"
+
+# Moyenne de y par valeur de x (évolution dans le temps, top activités...)
+def line_chart(df, x, y, title):
+    if x not in df.columns or y not in df.columns:
+        logger.warning("Colonnes '%s' ou '%s' non trouvées. Ignoré.", x, y)
+        return None
+    serie = df.groupby(x, observed=True, sort=True)[y].mean()
+    return {"kind": "line", "title": title, "x": serie.index.to_numpy(), "y": serie.to_numpy(),
+            "ylabel": y, "figsize": (8, 5)}
+
+
+# Moyenne journalière + une ligne horizontale par seuil [(valeur, libellé, couleur)]
+def threshold_chart(df, x, y, title, seuils):
+    import pandas as pd
+
+    if x not in df.columns or y not in df.columns:
+        logger.warning("Données invalides pour %s", title)
+        return None
+    serie = df.groupby(pd.to_datetime(df[x]), sort=True)[y].mean()
+    return {"kind": "threshold", "title": title, "x": serie.index.to_numpy(), "y": serie.to_numpy(),
+            "xlabel": "Date", "ylabel": y, "seuils": list(seuils), "figsize": (10, 5)}
+
+
+def bar_chart(data, col_x, col_y, title):
+    if data.empty:
+        logger.warning("Données vides pour : %s", title)
+        return None
+    return {"kind": "bar", "title": title, "x": data[col_x].astype(str).to_numpy(), "y": data[col_y].to_numpy(),
+            "figsize": (10, 5)}
+
+
+#####################################################################################
+#                               RENDU
+#####################################################################################
+
+# Rendre une spec en PNG (bytes), sans passer par pyplot
+def render_chart(spec):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=spec["figsize"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    if spec["kind"] == "bar":
+        ax.bar(spec["x"], spec["y"])
+        ax.tick_params(axis="x", labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment("right")
+    else:
+        color = "black" if spec["kind"] == "threshold" else None
+        ax.plot(spec["x"], spec["y"], marker="o", label="Moyenne réelle", color=color)
+        for val, label, seuil_color in spec.get("seuils", []):
+            ax.axhline(y=val, color=seuil_color, linestyle="--", label=label)
+        ax.tick_params(axis="x", labelrotation=45)
+        if spec.get("seuils"):
+            ax.legend()
+
+    ax.set_title(spec["title"])
+    if spec.get("xlabel"):
+        ax.set_xlabel(spec["xlabel"])
+    if spec.get("ylabel"):
+        ax.set_ylabel(spec["ylabel"])
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+# Rendre toutes les specs ; retourne la liste des PNG dans le même ordre (None pour une spec None)
+# use_cache : un graphique dont les données et la spec n'ont pas changé est repris de cache/charts/
+# (None = cache.enabled)
+def render_charts(specs, max_workers=None, processes=True, use_cache=None):
+    use_cache = cache.enabled if use_cache is None else use_cache
+    pngs = [None] * len(specs)
+    keys = {}
+    if use_cache:
+        for i, spec in enumerate(specs):
+            if spec is not None:
+                keys[i] = cache.chart_key(spec)
+                pngs[i] = cache.load_chart(keys[i])
+    todo = [i for i, spec in enumerate(specs) if spec is not None and pngs[i] is None]
+    if keys:
+        logger.info("Graphiques : %d repris du cache, %d à rendre", len(keys) - len(todo), len(todo))
+    if not todo:
+        return pngs
+
+    for i, png in zip(todo, render_all([specs[i] for i in todo], max_workers, processes)):
+        pngs[i] = png
+        if i in keys:
+            cache.store_chart(keys[i], png)
+    if keys:
+        cache.evict()
+    return pngs
+
+
+# "spawn" : sûr même si l'export tourne dans un thread du pipeline
+def render_all(specs, max_workers=None, processes=True):
+    if processes and len(specs) > 1:
+        max_workers = max_workers or min(len(specs), os.cpu_count() or 1)
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                return list(executor.map(render_chart, specs))
+        except BrokenProcessPool as e:
+            # ex : script appelant sans `if __name__ == "__main__":`, on rend dans ce processus
+            logger.warning("Pool de rendu indisponible (%s), rendu séquentiel des graphiques.", e)
+    return [render_chart(spec) for spec in specs]
+
+
+def png_image(png):
+    from openpyxl.drawing.image import Image
+
+    return Image(io.BytesIO(png))
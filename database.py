@@ -0,0 +1,441 @@
+# database.py
+# Base analytique SQLite des tables nettoyées : data_clean/air.sqlite
+# Tables de faits (mesures de tous les polluants en format long) et de dimensions (communes, stations,
+# population, établissements), indexées sur (polluant, station, date) et sur la commune.
+# Les analyses d'épisodes, les normes et le résumé du Dashboard sont des requêtes SQL poussées dans la base :
+# seul le résultat (quelques milliers de lignes au plus) remonte dans pandas.
+# SQLite (bibliothèque standard) plutôt que DuckDB : aucune dépendance à installer sur les postes Windows
+#
+#   python database.py "SELECT commune, COUNT(*) FROM fact_mesure JOIN dim_commune USING (commune_id) GROUP BY 1"
+#   python database.py --tables
+import os
+import sys
+import sqlite3
+import logging
+import pathlib
+import argparse
+import contextlib
+import storage
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+database_name = "air.sqlite"
+
+# Délai d'attente si une autre connexion écrit (secondes)
+busy_timeout = 60
+
+# Lignes insérées par executemany
+insert_chunk = 200000
+
+schema = """
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fact_mesure (
+    polluant TEXT NOT NULL,
+    commune_id INTEGER NOT NULL,
+    station_id INTEGER NOT NULL,
+    date_local TEXT NOT NULL,
+    valeur REAL
+);
+CREATE TABLE IF NOT EXISTS dim_commune (
+    commune_id INTEGER PRIMARY KEY,
+    code_insee TEXT,
+    commune TEXT
+);
+CREATE TABLE IF NOT EXISTS dim_station (
+    station_id INTEGER PRIMARY KEY,
+    code_station TEXT,
+    station TEXT,
+    commune_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS population (
+    commune_id INTEGER NOT NULL,
+    population_totale REAL,
+    tranche_population TEXT
+);
+CREATE TABLE IF NOT EXISTS entreprise (
+    commune_id INTEGER NOT NULL,
+    etat TEXT,
+    activite_principale TEXT,
+    soussection TEXT,
+    section TEXT,
+    date_creation TEXT,
+    date_fermeture TEXT
+);
+-- Moyenne journalière par station (même calcul que le cube journalier de rollup.py), recalculée au chargement
+CREATE TABLE IF NOT EXISTS mesure_journaliere (
+    polluant TEXT NOT NULL,
+    commune_id INTEGER NOT NULL,
+    station_id INTEGER NOT NULL,
+    date_local TEXT NOT NULL,
+    moyenne REAL,
+    nb_mesures INTEGER
+);
+"""
+
+daily_insert = """
+INSERT INTO mesure_journaliere
+    SELECT polluant, commune_id, station_id, date_local, AVG(valeur), COUNT(valeur)
+    FROM fact_mesure WHERE polluant = ?
+    GROUP BY station_id, date_local, commune_id
+"""
+
+# Index recréés après chaque chargement des faits (insertion en masse sans index, plus rapide)
+# idx_journalier_seuil : les épisodes ne lisent que les jours au-dessus du seuil (quelques % des lignes)
+fact_indexes = {
+    "idx_mesure_station_date": "fact_mesure (polluant, station_id, date_local)",
+    "idx_mesure_commune": "fact_mesure (commune_id, polluant, date_local)",
+    "idx_journalier_station_date": "mesure_journaliere (polluant, station_id, date_local)",
+    "idx_journalier_seuil": "mesure_journaliere (polluant, moyenne, station_id, date_local, commune_id)",
+}
+indexes = {
+    "idx_dim_station_commune": "dim_station (commune_id)",
+    "idx_population_commune": "population (commune_id)",
+    "idx_entreprise_commune": "entreprise (commune_id)",
+}
+
+# Tables chargées telles quelles : nom SQLite -> (table de data_clean/, colonnes, table commune aux partitions)
+dimension_tables = {
+    "dim_commune": ("dim_commune", ["commune_id", "code_insee", "commune"], True),
+    "dim_station": ("dim_station", ["station_id", "code_station", "station", "commune_id"], True),
+    "population": ("population_data", ["commune_id", "population_totale", "tranche_population"], False),
+    "entreprise": ("enterprise_data", ["commune_id", "etat", "activite_principale", "soussection", "section",
+                                       "date_creation", "date_fermeture"], False),
+}
+
+
+def database_path():
+    return os.path.join(storage.clean_dir, database_name)
+
+
+# Tables de data_clean/ lues par build_database (entrées de l'étape "database" du pipeline)
+def source_paths():
+    paths = [storage.table_path(f"{polluant}_data") for polluant in storage.polluants]
+    for table, _, shared in dimension_tables.values():
+        paths.append(storage.table_path(table, directory=storage.shared_clean_dir() if shared else None))
+    return paths
+
+
+#####################################################################################
+#                               CONNEXION
+#####################################################################################
+
+# readonly : requêtes ad hoc et analyses (une erreur plutôt qu'une base vide si elle n'existe pas)
+def connect(readonly=True):
+    path = database_path()
+    if readonly:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} absente : lancer l'étape database (python Main.py process)")
+        # URI "file:///C:/..." : chemins Windows, "?" ou "#" dans le chemin échappés
+        uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, timeout=busy_timeout)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=busy_timeout)
+    connection.execute("PRAGMA cache_size = -262144")  # 256 Mo de cache de pages
+    connection.execute("PRAGMA temp_store = MEMORY")
+    return connection
+
+
+# Résultat d'une requête en DataFrame ; parse_dates : colonnes texte "AAAA-MM-JJ" à convertir
+def query(sql, params=(), parse_dates=None):
+    import pandas as pd
+
+    with contextlib.closing(connect()) as connection:
+        df = pd.read_sql_query(sql, connection, params=params)
+    for col in parse_dates or []:
+        df[col] = pd.to_datetime(df[col]).astype('datetime64[ns]')
+    instrumentation.count("rows_in", len(df))
+    return df
+
+
+#####################################################################################
+#                               CHARGEMENT DEPUIS data_clean/
+#####################################################################################
+
+# Une table n'est rechargée que si son fichier a changé depuis le dernier chargement
+def signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def iso_dates(values):
+    import numpy as np
+
+    values = np.asarray(values, dtype="datetime64[D]")
+    text = np.datetime_as_string(values).astype(object)
+    text[np.isnat(values)] = None
+    return text
+
+
+# Colonnes pandas -> listes Python (dates en texte ISO, NaN / NA en NULL)
+def to_rows(df):
+    import pandas as pd
+
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            columns.append(iso_dates(series.to_numpy()).tolist())
+        elif series.hasnans:
+            columns.append(series.astype(object).where(series.notna(), None).tolist())
+        else:
+            columns.append(series.to_numpy().tolist())
+    return zip(*columns)
+
+
+def insert_frame(connection, table, df):
+    placeholders = ", ".join("?" * len(df.columns))
+    sql = f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({placeholders})"
+    for start in range(0, len(df), insert_chunk):
+        connection.executemany(sql, to_rows(df.iloc[start:start + insert_chunk]))
+    instrumentation.count("rows_out", len(df))
+
+
+def set_source(connection, name, path):
+    if path is None:
+        connection.execute("DELETE FROM sources WHERE name = ?", (name,))
+    else:
+        connection.execute("INSERT OR REPLACE INTO sources (name, signature) VALUES (?, ?)", (name, signature(path)))
+
+
+# Étape "database" : recharger les tables de data_clean/ qui ont changé
+# Rien n'a changé : le fichier n'est pas réécrit (ni daté, ni recopié dans le cache des étapes)
+def build_database(incremental=True):
+    logger.info("Building SQLite database...")
+    if not incremental and os.path.exists(database_path()):
+        os.remove(database_path())
+
+    with contextlib.closing(connect(readonly=False)) as connection:
+        connection.executescript(schema)
+        known = dict(connection.execute("SELECT name, signature FROM sources").fetchall())
+
+        # Mesures : un bloc de lignes par polluant, remplacé si sa table a changé
+        changed = []
+        for polluant in storage.polluants:
+            name = f"{polluant}_data"
+            path = storage.table_path(name)
+            current = signature(path) if os.path.exists(path) else None
+            if current != known.get(name):
+                changed.append((polluant, name, path if current else None))
+
+        reloaded = len(changed)
+        with connection:
+            if changed:
+                for index in fact_indexes:
+                    connection.execute(f"DROP INDEX IF EXISTS {index}")
+            for polluant, name, path in changed:
+                connection.execute("DELETE FROM fact_mesure WHERE polluant = ?", (polluant,))
+                connection.execute("DELETE FROM mesure_journaliere WHERE polluant = ?", (polluant,))
+                if path is not None:
+                    value_col = storage.value_column(polluant)
+                    df = storage.load_table(name, columns=['commune_id', 'station_id', 'date_local', value_col])
+                    df = df.rename(columns={value_col: 'valeur'})
+                    df.insert(0, 'polluant', polluant)
+                    insert_frame(connection, "fact_mesure", df)
+                    connection.execute(daily_insert, (polluant,))
+                    logger.info("fact_mesure : %d mesures %s chargées", len(df), polluant)
+                set_source(connection, name, path)
+            for index, definition in fact_indexes.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {definition}")
+
+        # Dimensions, population et établissements : table entière rechargée
+        for table, (name, columns, shared) in dimension_tables.items():
+            directory = storage.shared_clean_dir() if shared else None
+            path = storage.table_path(name, directory=directory)
+            current = signature(path) if storage.table_exists(name, directory=directory) else None
+            if current == known.get(name):
+                continue
+            reloaded += 1
+            with connection:
+                connection.execute(f"DELETE FROM {table}")
+                if current is not None:
+                    df = storage.load_table(name, columns=columns, directory=directory)
+                    insert_frame(connection, table, df)
+                    logger.info("%s : %d lignes chargées", table, len(df))
+                set_source(connection, name, path if current else None)
+
+        if not reloaded:
+            logger.info("Base SQLite à jour (%s)", database_path())
+            return
+        with connection:
+            for index, definition in indexes.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {definition}")
+        connection.execute("ANALYZE")
+
+    instrumentation.count_file("bytes_written", database_path())
+    logger.info("Base SQLite sauvegardée dans %s (%d tables rechargées)", database_path(), reloaded)
+
+
+#####################################################################################
+#                               REQUÊTES D'ANALYSE
+#####################################################################################
+
+# Épisodes : jours consécutifs (trou dans les mesures = fin d'épisode) avec une moyenne journalière > seuil
+# (îlots : jour - rang du jour dans la station est constant le long d'un épisode)
+# Retourne (cte, params) à placer dans un WITH ; colonnes commune_id, station_id, date_debut, date_fin,
+# nb_jours, valeur_max
+def episodes_cte(name, polluant, threshold, min_days=1):
+    sql = f"""
+    {name}_jours AS (
+        SELECT commune_id, station_id, date_local, moyenne,
+               CAST(julianday(date_local) AS INTEGER)
+               - ROW_NUMBER() OVER (PARTITION BY station_id ORDER BY date_local) AS ilot
+        FROM mesure_journaliere
+        WHERE polluant = ? AND moyenne > ?
+    ),
+    {name} AS (
+        SELECT s.commune_id, j.station_id, MIN(j.date_local) AS date_debut, MAX(j.date_local) AS date_fin,
+               COUNT(*) AS nb_jours, MAX(j.moyenne) AS valeur_max
+        FROM {name}_jours j
+        JOIN dim_station s ON s.station_id = j.station_id
+        GROUP BY j.station_id, j.ilot
+        HAVING COUNT(*) >= ?
+    )"""
+    return sql, [polluant, threshold, min_days]
+
+
+# Même format que episodes.detect_episodes (commune_id, station_id, date_debut, date_fin, nb_jours, valeur_max)
+def detect_episodes(polluant, threshold, min_days=1):
+    import numpy as np
+
+    cte, params = episodes_cte("episodes", polluant, threshold, min_days)
+    df = query(f"WITH {cte} SELECT * FROM episodes ORDER BY commune_id, station_id, date_debut",
+               params, parse_dates=['date_debut', 'date_fin'])
+    return df.astype({'commune_id': np.int32, 'station_id': np.int32, 'nb_jours': np.int32, 'valeur_max': np.float32})
+
+
+# Toutes les normes de normes.NORMES, même résultat que normes.evaluate_norms
+# Normes journalières et annuelles : une lecture de mesure_journaliere par polluant (une colonne SUM / AVG par norme),
+# normes sur plusieurs jours : une requête d'épisodes par norme
+def evaluate_norms():
+    import numpy as np
+    import pandas as pd
+    import normes
+
+    polluants = [row[0] for row in query_rows("SELECT DISTINCT polluant FROM mesure_journaliere ORDER BY polluant")]
+    registry = [n for n in normes.NORMES if n["polluant"] in polluants]
+    if not registry:
+        return normes.empty_alerts()
+
+    keys = ['polluant', 'commune_id', 'station_id', 'annee']
+    results = []
+    for polluant in polluants:
+        columns, params = [], []
+        for norme in registry:
+            if norme["polluant"] != polluant:
+                continue
+            if norme["fenetre"] == "annuelle":
+                columns.append(f'AVG(moyenne) > ? AS "{norme["id"]}"')
+                params.append(norme["valeur"])
+            elif norme["jours_consecutifs"] == 1:
+                columns.append(f'SUM(moyenne > ?) AS "{norme["id"]}"')
+                params.append(norme["valeur"])
+        if not columns:
+            continue
+        yearly = query(f"""
+            SELECT polluant, commune_id, station_id, CAST(strftime('%Y', date_local) AS INTEGER) AS annee,
+                   {', '.join(columns)}
+            FROM mesure_journaliere WHERE polluant = ?
+            GROUP BY commune_id, station_id, annee""", params + [polluant])
+        results.append(yearly.melt(id_vars=keys, var_name='norme_id', value_name='nb_depassements'))
+
+    # jours des épisodes assez longs, comptés dans l'année du premier jour de l'épisode
+    for norme in [n for n in registry if n["fenetre"] != "annuelle" and n["jours_consecutifs"] > 1]:
+        cte, params = episodes_cte("runs", norme["polluant"], norme["valeur"], norme["jours_consecutifs"])
+        results.append(query(f"""
+            WITH {cte}
+            SELECT ? AS polluant, commune_id, station_id, CAST(strftime('%Y', date_debut) AS INTEGER) AS annee,
+                   ? AS norme_id, SUM(nb_jours) AS nb_depassements
+            FROM runs GROUP BY commune_id, station_id, annee""", params + [norme["polluant"], norme["id"]]))
+
+    alerts = pd.concat(results, ignore_index=True)
+    alerts = alerts[alerts['nb_depassements'] > 0]
+    if alerts.empty:
+        return normes.empty_alerts()
+
+    columns = ['id', 'norme', 'valeur', 'fenetre', 'depassements_autorises']
+    alerts = alerts.merge(pd.DataFrame(registry)[columns], left_on='norme_id', right_on='id', how='left').drop(columns='id')
+    alerts['non_conforme'] = alerts['nb_depassements'] > alerts['depassements_autorises'].fillna(0)
+    alerts = alerts.astype({'commune_id': np.int32, 'station_id': np.int32, 'annee': np.int16, 'nb_depassements': np.int32})
+    return alerts.sort_values(['polluant', 'norme_id', 'commune_id', 'station_id', 'annee']).reset_index(drop=True)
+
+
+# Nombre d'épisodes NO2 (200 µg/m³ sur 3 jours) et PM10 (alerte) par commune, pour le Dashboard
+# (commune_id, commune, nb_alertes_no2, nb_alertes_pm10)
+def alert_counts():
+    import normes
+
+    no2, pm10 = normes.get_norme("no2_3jours"), normes.get_norme("pm10_alerte")
+    no2_cte, no2_params = episodes_cte("no2", "NO2", no2["valeur"], no2["jours_consecutifs"])
+    pm10_cte, pm10_params = episodes_cte("pm10", "PM10", pm10["valeur"], pm10["jours_consecutifs"])
+    sql = f"""
+    WITH {no2_cte}, {pm10_cte},
+    comptes AS (
+        SELECT commune_id, COUNT(*) AS nb_no2, 0 AS nb_pm10 FROM no2 GROUP BY commune_id
+        UNION ALL
+        SELECT commune_id, 0, COUNT(*) FROM pm10 GROUP BY commune_id
+    )
+    SELECT c.commune_id, d.commune, SUM(c.nb_no2) AS nb_alertes_no2, SUM(c.nb_pm10) AS nb_alertes_pm10
+    FROM comptes c
+    LEFT JOIN dim_commune d ON d.commune_id = c.commune_id
+    GROUP BY c.commune_id
+    ORDER BY c.commune_id"""
+    return query(sql, no2_params + pm10_params)
+
+
+def query_rows(sql, params=()):
+    with contextlib.closing(connect()) as connection:
+        return connection.execute(sql, params).fetchall()
+
+
+#####################################################################################
+#                               REQUÊTES AD HOC (CLI)
+#####################################################################################
+
+def describe_tables():
+    rows = query_rows("SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY type, name")
+    lines = []
+    for kind, name, sql in rows:
+        count = query_rows(f"SELECT COUNT(*) FROM {name}")[0][0] if kind == "table" else "-"
+        lines.append(f"-- {kind} {name} ({count} lignes)\n{sql};")
+    return "\n\n".join(lines)
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description=f"Requêtes SQL sur data_clean/{database_name}")
+    parser.add_argument("sql", nargs="?", help="requête SQL (lecture seule)")
+    parser.add_argument("--tables", action="store_true", help="afficher le schéma des tables et vues")
+    parser.add_argument("--csv", metavar="FICHIER", help="écrire le résultat en CSV au lieu de l'afficher")
+    parser.add_argument("--max-rows", type=int, default=50, help="nombre de lignes affichées")
+    args = parser.parse_args(argv)
+
+    if args.tables or not args.sql:
+        print(describe_tables())
+        return 0
+    try:
+        df = query(args.sql)
+    except sqlite3.Error as e:
+        print(f"Erreur SQL : {e}", file=sys.stderr)
+        return 1
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"{len(df)} lignes écrites dans {args.csv}")
+    else:
+        with pd.option_context("display.max_rows", args.max_rows, "display.width", 200):
+            print(df)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,354 @@
+# dimensions.py
+# Dimensions communes et stations : identifiants entiers compacts (int32, 0..n-1) utilisés comme clés
+# dans les tables de faits (mesures, cubes, alertes, population, établissements)
+# Une commune est reconnue par son code INSEE quand la source le donne, sinon par son nom normalisé
+# (sans accents, casse ni ponctuation) ; une station par son code, sinon par son nom.
+# Les identifiants déjà attribués ne changent jamais (tables dim_commune / dim_station de data_clean/,
+# communes à toutes les partitions du pipeline : storage.shared_clean_dir())
+import os
+import time
+import hashlib
+import threading
+import contextlib
+import unicodedata
+import numpy as np
+import pandas as pd
+import storage
+import instrumentation
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+# Un verrou orphelin (processus tué pendant une mise à jour) est cassé au bout de lock_timeout secondes
+lock_timeout = 60
+
+# Plusieurs noms pour une même clé normalisée (homonymes) : le nom seul ne suffit plus
+AMBIGU = -2
+
+# Commune / station inconnue (ni code ni nom dans la source)
+INCONNU = -1
+
+# Marqueur interne de Dimension.resolve : couple à ajouter à la dimension
+A_CREER = -3
+
+
+#####################################################################################
+#                               CLÉS
+#####################################################################################
+
+# "Saint-Herblain", "SAINT HERBLAIN", "Saint Herblain " -> "saint herblain"
+def normalize_name(name):
+    if name is None or name != name:  # None ou NaN
+        return None
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split()) or None
+
+
+# Code INSEE ou code station : texte sans espaces, codes INSEE numériques sur 5 caractères
+def normalize_code(code, width=None):
+    if code is None or code != code:
+        return None
+    if isinstance(code, float) and code.is_integer():
+        code = int(code)
+    code = str(code).strip().upper()
+    if width and code.isdigit():
+        code = code.zfill(width)
+    return code or None
+
+
+#####################################################################################
+#                               VERROU
+#####################################################################################
+
+_thread_lock = threading.Lock()
+
+
+# Verrou inter-processus (fichier créé en O_EXCL) : les étapes process_* tournent en parallèle,
+# en threads ou en processus, et peuvent ajouter des communes / stations en même temps
+@contextlib.contextmanager
+def dimension_lock():
+    os.makedirs(storage.shared_clean_dir(), exist_ok=True)
+    path = os.path.join(storage.shared_clean_dir(), "dimensions.lock")
+    with _thread_lock:
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > lock_timeout:
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+
+#####################################################################################
+#                               DIMENSIONS
+#####################################################################################
+
+# Une dimension chargée en mémoire : lignes dans l'ordre des identifiants, index par code et par nom
+class Dimension:
+    def __init__(self, table, id_col, code_col, label_col, extra_cols=(), code_width=None):
+        self.table = table
+        self.id_col = id_col
+        self.code_col = code_col
+        self.label_col = label_col
+        self.extra_cols = list(extra_cols)
+        self.code_width = code_width
+        self.path = None
+        self.reset()
+
+    def reset(self):
+        self.codes = []
+        self.labels = []
+        self.extras = {col: [] for col in self.extra_cols}
+        self.by_code = {}
+        self.by_name = {}
+
+    def index(self, i):
+        if self.codes[i] is not None:
+            self.by_code[self.codes[i]] = i
+        key = normalize_name(self.labels[i])
+        if key is not None:
+            self.by_name[key] = i if self.by_name.get(key, i) == i else AMBIGU
+
+    # Recharger depuis data_clean/ (à faire sous dimension_lock)
+    # Tout est reconstruit à part puis remplacé d'un coup : les autres threads lisent sans verrou
+    def load(self):
+        loaded = Dimension(self.table, self.id_col, self.code_col, self.label_col, self.extra_cols, self.code_width)
+        directory = storage.shared_clean_dir()
+        if storage.table_exists(self.table, directory=directory):
+            with instrumentation.rows_uncounted():
+                df = storage.load_table(self.table, directory=directory).sort_values(self.id_col)
+            if not np.array_equal(df[self.id_col].to_numpy(), np.arange(len(df))):
+                raise ValueError(f"{self.table} : identifiants non contigus, table corrompue ?")
+            loaded.codes = [normalize_code(c) for c in df[self.code_col].tolist()]
+            loaded.labels = [None if label != label else label for label in df[self.label_col].astype(object).tolist()]
+            for col in self.extra_cols:
+                loaded.extras[col] = df[col].tolist()
+            for i in range(len(loaded.codes)):
+                loaded.index(i)
+        self.codes, self.labels, self.extras = loaded.codes, loaded.labels, loaded.extras
+        self.by_code, self.by_name = loaded.by_code, loaded.by_name
+        self.path = storage.table_path(self.table, directory=directory)
+
+    def save(self):
+        df = pd.DataFrame({
+            self.id_col: np.arange(len(self.codes), dtype=np.int32),
+            self.code_col: pd.Series(self.codes, dtype=object),
+            self.label_col: pd.Series(self.labels, dtype=object),
+            **{col: values for col, values in self.extras.items()},
+        })
+        with instrumentation.rows_uncounted():
+            storage.save_table(df, self.table, directory=storage.shared_clean_dir(), names=False)
+
+    # Identifiant de (code, nom), None si inconnu
+    # update=True (sous verrou) : une ligne connue seulement par son nom reçoit le code
+    def find(self, code, name, update=False):
+        key = normalize_name(name)
+        if code is not None:
+            if code in self.by_code:
+                return self.by_code[code]
+            # connue seulement par son nom (source sans code) : c'est la même si le nom n'est pas ambigu
+            i = self.by_name.get(key)
+            if update and i is not None and i != AMBIGU and self.codes[i] is None:
+                self.codes[i] = code
+                self.by_code[code] = i
+                return i
+            return None
+        i = self.by_name.get(key)
+        return None if i is None or i == AMBIGU else i
+
+    def add(self, code, name, **extras):
+        i = len(self.codes)
+        self.codes.append(code)
+        self.labels.append(name)
+        for col in self.extra_cols:
+            self.extras[col].append(extras.get(col))
+        self.index(i)
+        return i
+
+    # Identifiants de tous les couples (code, nom) ; les nouveaux sont ajoutés et la table sauvegardée
+    # Sans verrou tant que tout est déjà connu (cas de tous les paquets après le premier)
+    def resolve(self, pairs, extras=None):
+        if self.path != storage.table_path(self.table, directory=storage.shared_clean_dir()):
+            with dimension_lock():
+                self.load()
+        ids = self.lookup(pairs)
+        if A_CREER not in ids:
+            return ids
+
+        with dimension_lock():
+            self.load()  # une autre étape a pu ajouter des lignes entre-temps
+            ids = self.lookup(pairs)
+            for n, (code, name) in enumerate(pairs):
+                if ids[n] == A_CREER:
+                    # (un couple précédent de la liste a pu créer la même ligne)
+                    i = self.find(code, name, update=True)
+                    ids[n] = self.add(code, name, **(extras[n] if extras else {})) if i is None else i
+            self.save()
+        return ids
+
+    def lookup(self, pairs):
+        ids = []
+        for code, name in pairs:
+            if code is None and normalize_name(name) is None:
+                ids.append(INCONNU)
+            else:
+                i = self.find(code, name)
+                ids.append(A_CREER if i is None else i)
+        return ids
+
+
+communes = Dimension("dim_commune", "commune_id", "code_insee", "commune", code_width=5)
+stations = Dimension("dim_station", "station_id", "code_station", "station", extra_cols=["commune_id"])
+
+
+#####################################################################################
+#                               AFFECTATION DES IDENTIFIANTS
+#####################################################################################
+
+# Identifiant de chaque ligne (int32) à partir des colonnes code / nom d'une source
+# Les couples distincts sont résolus une fois, puis redistribués par indexation
+def assign_ids(dimension, codes, names, extras=None):
+    codes = pd.Series(codes, dtype=object).reset_index(drop=True)
+    names = pd.Series(names, dtype=object).reset_index(drop=True)
+    if len(codes) == 0:
+        return np.empty(0, dtype=np.int32), []
+
+    keys = codes.where(codes.notna(), names)
+    inverse, _ = pd.factorize(keys, use_na_sentinel=False)
+    _, first_rows = np.unique(inverse, return_index=True)
+
+    pairs = [(normalize_code(codes[row], dimension.code_width), names[row]) for row in first_rows]
+    pair_extras = None
+    if extras is not None:
+        pair_extras = [{col: values[row] for col, values in extras.items()} for row in first_rows]
+    ids = np.asarray(dimension.resolve(pairs, pair_extras), dtype=np.int32)
+    return ids[inverse], first_rows
+
+
+def commune_ids(codes, names):
+    return assign_ids(communes, codes, names)[0]
+
+
+# commune_ids_of_rows : commune de chaque ligne (la commune de la station est celle de sa 1re mesure)
+def station_ids(codes, names, commune_ids_of_rows):
+    commune_ids_of_rows = np.asarray(commune_ids_of_rows)
+    return assign_ids(stations, codes, names, extras={"commune_id": commune_ids_of_rows})[0]
+
+
+#####################################################################################
+#                               LIBELLÉS
+#####################################################################################
+
+# Libellés d'une dimension, dans l'ordre des identifiants (relus : une autre étape a pu en ajouter)
+def labels(dimension):
+    with dimension_lock():
+        dimension.load()
+    return dimension.labels
+
+
+# Commune de chaque station_id (tableau indexé par l'identifiant)
+def station_communes():
+    with dimension_lock():
+        stations.load()
+    return np.asarray(stations.extras["commune_id"], dtype=np.int32)
+
+
+# Empreinte des n premières lignes d'une dimension
+def prefix_digest(dimension, n):
+    h = hashlib.blake2b(digest_size=16)
+    for i in range(n):
+        h.update(repr((dimension.codes[i], dimension.labels[i],
+                       *(dimension.extras[col][i] for col in dimension.extra_cols))).encode())
+    return h.hexdigest()
+
+
+# {table: [nombre de lignes, empreinte]} des deux dimensions (cache.py)
+def signature():
+    with dimension_lock():
+        communes.load()
+        stations.load()
+    return {dimension.table: [len(dimension.codes), prefix_digest(dimension, len(dimension.codes))]
+            for dimension in (communes, stations)}
+
+
+# Les dimensions actuelles contiennent-elles encore toutes les lignes de `sig` ?
+# (les identifiants ne changent jamais : une table en cache reste valable tant que ses lignes sont là)
+def extends(sig):
+    with dimension_lock():
+        communes.load()
+        stations.load()
+    for dimension in (communes, stations):
+        n, digest = sig.get(dimension.table, [0, None])
+        if len(dimension.codes) < n or (n and prefix_digest(dimension, n) != digest):
+            return False
+    return True
+
+
+# Ajouter les colonnes "commune" / "station" (catégories) à partir de commune_id / station_id
+# (indexation directe : les identifiants sont les positions dans la dimension, pas de merge)
+def with_names(df):
+    df = df.copy(deep=False)
+    for id_col, label_col, dimension in [("commune_id", "commune", communes), ("station_id", "station", stations)]:
+        if id_col not in df.columns or label_col in df.columns:
+            continue
+        names = labels(dimension)
+        # code de catégorie de chaque identifiant (homonymes = même catégorie), -1 en dernière position
+        name_codes, categories = pd.factorize(pd.Series(names, dtype=object))
+        id_to_code = np.append(name_codes, -1)
+        ids = df[id_col].to_numpy().astype(np.int64)
+        ids = np.where((ids >= 0) & (ids < len(names)), ids, len(names))
+        df.insert(df.columns.get_loc(id_col) + 1, label_col,
+                  pd.Categorical.from_codes(id_to_code[ids], categories=categories))
+    return df
+
+
+#####################################################################################
+#                               INDEX DES COMMUNES
+#####################################################################################
+
+# Table "communes" : une ligne par commune_id avec les jointures déjà faites
+# (population, nombre d'établissements, nombre de stations de mesure)
+def build_commune_index():
+    with dimension_lock():
+        communes.load()
+        stations.load()
+    n = len(communes.codes)
+    index = pd.DataFrame({
+        "commune_id": np.arange(n, dtype=np.int32),
+        "code_insee": pd.Series(communes.codes, dtype=object),
+        "commune": pd.Series(communes.labels, dtype=object),
+    })
+
+    if storage.table_exists("population_data"):
+        population = storage.load_table("population_data", columns=["commune_id", "population_totale", "tranche_population"])
+        population = population[population["commune_id"] >= 0].drop_duplicates("commune_id").set_index("commune_id")
+        population = population.reindex(index["commune_id"])
+        index["population_totale"] = population["population_totale"].to_numpy()
+        index["tranche_population"] = population["tranche_population"].astype(object).to_numpy()
+
+    if storage.table_exists("enterprise_data"):
+        enterprises = storage.load_table("enterprise_data", columns=["commune_id", "etat"])
+        ids = enterprises["commune_id"].to_numpy()
+        known = ids >= 0
+        index["nb_etablissements"] = np.bincount(ids[known], minlength=n)[:n].astype(np.int32)
+        actives = known & (enterprises["etat"].astype(object).to_numpy() == "A")
+        index["nb_etablissements_actifs"] = np.bincount(ids[actives], minlength=n)[:n].astype(np.int32)
+
+    station_communes = np.asarray(stations.extras["commune_id"], dtype=np.int64)
+    station_communes = station_communes[station_communes >= 0]
+    index["nb_stations"] = np.bincount(station_communes, minlength=n)[:n].astype(np.int32)
+
+    storage.save_table(index, "communes")
@@ -0,0 +1,202 @@
+# entreprises.py
+# Activité des établissements SIRENE : créations et fermetures par section / sous-section, commune et mois
+# (cube_entreprises, mis à jour à partir du dernier mois connu comme les cubes de rollup.py),
+# puis rapprochées des jours de dépassement de chaque commune (exposition_journaliere)
+# Les colonnes restent typées (commune_id int32, section / sous-section catégorielles, dates date32) :
+# seules les dates utiles sont lues, filtrées à la lecture, et la jointure avec les communes se fait par
+# indexation de tableaux numpy sur commune_id (aucune jointure sur des noms)
+import logging
+import numpy as np
+import pandas as pd
+import storage
+import exposition
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+cube_keys = ['commune_id', 'section', 'soussection']
+
+# Tables produites dans data_clean/
+table_cube = "cube_entreprises"
+table_communes = "entreprises_pollution"
+table_correlations = "correlation_entreprises"
+
+# Jours de dépassement d'une commune : au moins une station au-dessus d'une valeur limite (moyenne journalière)
+categorie = "limite"
+
+# Ligne de correlation_entreprises pour l'ensemble des sections, et section des établissements qui n'en ont pas
+toutes_sections = "Toutes"
+section_inconnue = "inconnue"
+
+
+#####################################################################################
+#                               CUBE CRÉATIONS / FERMETURES
+#####################################################################################
+
+# Nombre d'établissements par (commune, section, sous-section, mois de date_col)
+# dropna=False : les établissements sans section restent comptés (mêmes totaux que la table)
+def monthly_counts(df, date_col, count_col):
+    df = df[df[date_col].notna()]
+    months = df[date_col].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    counts = (
+        df[cube_keys].assign(mois=months)
+        .groupby(cube_keys + ['mois'], observed=True, dropna=False)
+        .size()
+        .rename(count_col)
+        .reset_index()
+    )
+    return counts
+
+
+def activity_counts(since=None):
+    date_range = (since, None) if since is not None else None
+    creations = storage.load_table("enterprise_data", columns=cube_keys + ['date_creation'],
+                                   date_range=date_range, date_column='date_creation')
+    fermetures = storage.load_table("enterprise_data", columns=cube_keys + ['date_fermeture'],
+                                    date_range=date_range, date_column='date_fermeture')
+    counts = pd.concat([
+        monthly_counts(creations, 'date_creation', 'nb_creations'),
+        monthly_counts(fermetures, 'date_fermeture', 'nb_fermetures'),
+    ], ignore_index=True)
+    counts[cube_keys[1:]] = counts[cube_keys[1:]].astype(object)
+    cube = (
+        counts.groupby(cube_keys + ['mois'], dropna=False)[['nb_creations', 'nb_fermetures']]
+        .sum()
+        .astype('int32')
+        .reset_index()
+    )
+    return cube, len(creations) + len(fermetures)
+
+
+# Nombre d'établissements par mois de `dates` antérieur à since : {mois (datetime64[M]): n}
+def month_totals(dates, since):
+    months = dates[dates < since].to_numpy().astype('datetime64[M]')
+    values, counts = np.unique(months[~np.isnat(months)], return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+
+# Le cube d'avant `since` correspond-il encore à la table, mois par mois ? (SIRENE retéléchargé, dates corrigées...)
+# Seules les deux colonnes de dates sont relues
+def matches_before(existing, since):
+    dates = storage.load_table("enterprise_data", columns=['date_creation', 'date_fermeture'])
+    before = existing[existing['mois'] < since]
+    months = before['mois'].to_numpy().astype('datetime64[M]')
+    for date_col, count_col in [('date_creation', 'nb_creations'), ('date_fermeture', 'nb_fermetures')]:
+        known = pd.Series(before[count_col].to_numpy()).groupby(months).sum()
+        known = {month: int(n) for month, n in zip(known.index.to_numpy().astype('datetime64[M]').tolist(), known) if n}
+        if known != month_totals(dates[date_col], since):
+            return False
+    return True
+
+
+# Étape "rollup_entreprises" : seuls les mois à partir du dernier mois connu sont recalculés
+# (toujours recalculé, comme le dernier jour des cubes de rollup.py : établissements ajoutés dans le mois)
+def build_activity_cube(incremental=True):
+    logger.info("Building enterprise activity cube...")
+    if not storage.table_exists("enterprise_data"):
+        logger.warning("Pas de table enterprise_data, cube des entreprises non construit.")
+        return
+
+    existing, since = None, None
+    if incremental and storage.table_exists(table_cube):
+        existing = storage.load_table(table_cube)
+        if not existing.empty:
+            # dernier mois connu de chaque compteur (créations, fermetures), le plus ancien des deux
+            since = pd.Timestamp(min(existing.loc[existing[col] > 0, 'mois'].max()
+                                     for col in ['nb_creations', 'nb_fermetures']
+                                     if (existing[col] > 0).any()))
+            if not matches_before(existing, since):
+                logger.info("Établissements modifiés avant %s : cube des entreprises reconstruit", f"{since:%Y-%m}")
+                existing, since = None, None
+
+    cube, nb_lues = activity_counts(since)
+    if existing is not None:
+        existing = existing[existing['mois'] < since].astype({key: object for key in cube_keys[1:]})
+        cube = pd.concat([existing, cube], ignore_index=True)
+    cube = cube.sort_values(cube_keys + ['mois'], na_position='first').reset_index(drop=True)
+    storage.save_table(cube, table_cube)
+    logger.info("Cube des entreprises : %d lignes (%d dates lues%s)", len(cube), nb_lues,
+                f" depuis {since:%Y-%m}" if since is not None else "")
+
+
+#####################################################################################
+#                               RAPPROCHEMENT AVEC LA POLLUTION
+#####################################################################################
+
+# (communes, années, jours de dépassement) des communes mesurées, depuis exposition_journaliere
+def pollution_days():
+    days = storage.load_table(exposition.table_journaliere, columns=['commune_id', 'date_local', f"jours_{categorie}"])
+    years = days['date_local'].dt.year.to_numpy().astype(np.int32)
+    communes = days['commune_id'].to_numpy().astype(np.int64)
+    over = days[f"jours_{categorie}"].to_numpy() > 0
+    measured = pd.DataFrame({'commune_id': communes, 'annee': years}).drop_duplicates()
+    # une commune x jour peut apparaître une fois par polluant : jours distincts
+    exceeded = (pd.DataFrame({'commune_id': communes[over], 'annee': years[over],
+                              'date_local': days['date_local'].to_numpy()[over]})
+                .drop_duplicates()
+                .groupby(['commune_id', 'annee']).size())
+    measured['jours_depassement'] = exceeded.reindex(pd.MultiIndex.from_frame(measured), fill_value=0).to_numpy()
+    return measured.sort_values(['commune_id', 'annee']).reset_index(drop=True)
+
+
+# Position de chaque (commune_id, annee) dans `measured`, -1 si la commune n'est pas mesurée cette année-là
+# (tableau dense communes x années : la jointure est une simple indexation)
+def commune_year_index(measured):
+    first_year = int(measured['annee'].min())
+    shape = (int(measured['commune_id'].max()) + 1, int(measured['annee'].max()) - first_year + 1)
+    index = np.full(shape, -1, dtype=np.int64)
+    index[measured['commune_id'].to_numpy(), measured['annee'].to_numpy() - first_year] = np.arange(len(measured))
+    return index, first_year
+
+
+def lookup(index, first_year, commune_ids, years):
+    commune_ids = np.asarray(commune_ids, dtype=np.int64)
+    offsets = np.asarray(years, dtype=np.int64) - first_year
+    valid = (commune_ids >= 0) & (commune_ids < index.shape[0]) & (offsets >= 0) & (offsets < index.shape[1])
+    positions = np.full(len(commune_ids), -1, dtype=np.int64)
+    positions[valid] = index[commune_ids[valid], offsets[valid]]
+    return positions
+
+
+def correlation(x, y):
+    if len(x) < 3 or np.std(x) == 0 or np.std(y) == 0:
+        return np.nan
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+# Créations / fermetures par commune mesurée et par année + corrélation avec les jours de dépassement, par section
+# (une commune x année sans création compte pour 0)
+def correlate_pollution():
+    measured = pollution_days()
+    cube = storage.load_table(table_cube)
+    if measured.empty or cube.empty:
+        return measured.assign(nb_creations=0, nb_fermetures=0), pd.DataFrame(
+            columns=['section', 'nb_communes_annees', 'nb_creations', 'nb_fermetures', 'corr_creations', 'corr_fermetures'])
+
+    index, first_year = commune_year_index(measured)
+    positions = lookup(index, first_year, cube['commune_id'].to_numpy(), pd.DatetimeIndex(cube['mois']).year)
+    cube = cube[positions >= 0].assign(position=positions[positions >= 0])
+    n = len(measured)
+    days = measured['jours_depassement'].to_numpy().astype(np.float64)
+
+    sections = cube['section'].astype(object).fillna(section_inconnue)
+    rows = []
+    for section, group in [(toutes_sections, cube)] + list(cube.groupby(sections, sort=True)):
+        creations = np.bincount(group['position'], weights=group['nb_creations'], minlength=n)
+        fermetures = np.bincount(group['position'], weights=group['nb_fermetures'], minlength=n)
+        rows.append({
+            'section': section,
+            'nb_communes_annees': n,
+            'nb_creations': int(creations.sum()),
+            'nb_fermetures': int(fermetures.sum()),
+            'corr_creations': correlation(creations, days),
+            'corr_fermetures': correlation(fermetures, days),
+        })
+        if section == toutes_sections:
+            measured['nb_creations'] = creations.astype(np.int32)
+            measured['nb_fermetures'] = fermetures.astype(np.int32)
+    return measured, pd.DataFrame(rows)
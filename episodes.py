@@ -0,0 +1,141 @@
+# episodes.py
+# Détection vectorisée (NumPy) des épisodes de dépassement :
+# "N jours calendaires consécutifs au-dessus d'un seuil", pour n'importe quel polluant
+# find_runs sert au moteur de normes (normes.py), find_runs_matrix aux heures consécutives (hourly.py) ;
+# detect_episodes est le calcul de référence des requêtes SQL de database.py (tests/test_database.py)
+import numpy as np
+import pandas as pd
+
+
+#####################################################################################
+#                               MOTEUR (TABLEAUX NUMPY)
+#####################################################################################
+
+# station_ids, days, values : tableaux triés par (station, jour), un jour par station au plus
+#   days = numéros de jour entiers (datetime64[D] -> int64), les trous de calendrier cassent les séries
+# Retourne les indices de début / fin de chaque épisode d'au moins min_days jours, et le pic
+def find_runs(station_ids, days, values, threshold, min_days=1):
+    station_ids = np.asarray(station_ids)
+    days = np.asarray(days, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    above = values > threshold
+
+    # Un jour prolonge l'épisode précédent si : même station, jour suivant, et veille aussi au-dessus
+    continues = np.zeros(len(values), dtype=bool)
+    continues[1:] = (
+        above[1:]
+        & above[:-1]
+        & (station_ids[1:] == station_ids[:-1])
+        & (days[1:] - days[:-1] == 1)
+    )
+    starts = above & ~continues
+    ends = np.zeros(len(values), dtype=bool)
+    ends[:-1] = above[:-1] & ~continues[1:]
+    if len(values):
+        ends[-1] = above[-1]
+
+    start_idx = np.flatnonzero(starts)
+    end_idx = np.flatnonzero(ends)
+    lengths = days[end_idx] - days[start_idx] + 1
+
+    # Pic de chaque épisode : max par segment sur les seules valeurs au-dessus du seuil
+    if len(start_idx):
+        above_values = values[above]
+        segment_starts = np.flatnonzero(starts[above])
+        peaks = np.maximum.reduceat(above_values, segment_starts)
+    else:
+        peaks = np.empty(0, dtype=np.float64)
+
+    keep = lengths >= min_days
+    return start_idx[keep], end_idx[keep], lengths[keep], peaks[keep]
+
+
+# Même calcul sur une matrice stations x pas de temps (calendrier continu, NaN = pas de mesure), ex : hourly.py
+# Retourne la ligne, les colonnes de début / fin (incluses), la longueur et le pic de chaque épisode
+def find_runs_matrix(values, threshold, min_days=1):
+    values = np.asarray(values)
+    above = np.zeros((values.shape[0], values.shape[1] + 2), dtype=np.int8)
+    above[:, 1:-1] = values > threshold  # False pour les NaN : un jour sans mesure casse l'épisode
+
+    # +1 au premier jour d'un épisode, -1 au lendemain du dernier (parcours ligne par ligne)
+    edges = np.diff(above, axis=1)
+    rows, start_idx = np.nonzero(edges == 1)
+    _, end_idx = np.nonzero(edges == -1)
+    end_idx -= 1
+    lengths = end_idx - start_idx + 1
+
+    keep = lengths >= min_days
+    rows, start_idx, end_idx, lengths = rows[keep], start_idx[keep], end_idx[keep], lengths[keep]
+
+    # Pic : max par segment [début, fin] des lignes, sans copier la matrice si ses lignes sont contiguës
+    if len(rows):
+        if values.strides[1] == values.itemsize:
+            row_stride = values.strides[0] // values.itemsize
+            flat = np.lib.stride_tricks.as_strided(
+                values, shape=((values.shape[0] - 1) * row_stride + values.shape[1],), strides=(values.itemsize,))
+        else:
+            row_stride = values.shape[1]
+            flat = np.ascontiguousarray(values).reshape(-1)
+        bounds = np.empty(2 * len(rows), dtype=np.int64)
+        bounds[0::2] = rows * row_stride + start_idx
+        bounds[1::2] = rows * row_stride + end_idx + 1
+        if bounds[-1] == len(flat):
+            bounds = bounds[:-1]
+        peaks = np.maximum.reduceat(flat, bounds)[0::2].astype(np.float64)
+    else:
+        peaks = np.empty(0, dtype=np.float64)
+    return rows, start_idx, end_idx, lengths, peaks
+
+
+#####################################################################################
+#                               DATAFRAME
+#####################################################################################
+
+# Moyenne journalière par station, triée par (station, date) : une ligne par station et par jour
+# (clé entière station x jour + bincount : évite un groupby pandas sur les colonnes de la clé)
+def daily_means(df, value_col, group_cols=('commune_id', 'station_id'), date_col='date_local'):
+    group_cols = list(group_cols)
+    if df.empty:
+        return df[group_cols + [date_col, value_col]].copy()
+
+    station_ids = df.groupby(group_cols, observed=True, sort=True).ngroup().to_numpy().astype(np.int64)
+    days = pd.to_datetime(df[date_col]).to_numpy().astype('datetime64[D]').astype(np.int64)
+    values = df[value_col].to_numpy(dtype=np.float64)
+
+    first_day = days.min()
+    span = days.max() - first_day + 1
+    keys, inverse = np.unique(station_ids * span + (days - first_day), return_inverse=True)
+
+    valid = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(valid, values, 0.0))
+    counts = np.bincount(inverse, weights=valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+
+    # Libellés de chaque station : première ligne du groupe
+    _, first_rows = np.unique(station_ids, return_index=True)
+    daily = df[group_cols].iloc[first_rows].reset_index(drop=True).iloc[keys // span].reset_index(drop=True)
+    daily[date_col] = (keys % span + first_day).astype('datetime64[D]').astype('datetime64[ns]')
+    daily[value_col] = means.astype(df[value_col].dtype)
+    return daily
+
+
+# Épisodes de dépassement (valeur > threshold) d'au moins min_days jours calendaires consécutifs
+# Une ligne par épisode : stations, date_debut, date_fin, nb_jours, valeur_max
+def detect_episodes(df, value_col, threshold, min_days=1, group_cols=('commune_id', 'station_id'), date_col='date_local'):
+    group_cols = list(group_cols)
+    daily = daily_means(df, value_col, group_cols, date_col)
+
+    station_ids = daily.groupby(group_cols, observed=True, sort=False).ngroup().to_numpy()
+    days = daily[date_col].to_numpy().astype('datetime64[D]').astype(np.int64)
+    values = daily[value_col].to_numpy(dtype=np.float64)
+
+    start_idx, end_idx, lengths, peaks = find_runs(station_ids, days, values, threshold, min_days)
+
+    episodes = daily.iloc[start_idx][group_cols].reset_index(drop=True)
+    episodes['date_debut'] = daily[date_col].to_numpy()[start_idx]
+    episodes['date_fin'] = daily[date_col].to_numpy()[end_idx]
+    episodes['nb_jours'] = lengths.astype(np.int32)
+    episodes['valeur_max'] = peaks.astype(np.float32)
+    return episodes
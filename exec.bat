@@ -2,5 +2,7 @@ pip install pandas
 pip install datetime
 pip install openpyxl
 pip install matplotlib
+pip install pyarrow
+pip install lxml
 
 python Main.py
\ No newline at end of file
@@ -1,104 +1,103 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+# export_excel.py
+# Rapport Excel ; pandas, openpyxl et les modules d'analyse ne sont importés qu'à l'export
+# (le pipeline importe ce module pour connaître export_path() sans payer ces imports)
 import os
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image
-
-def create_chart(df, x, y, title, filename):
-    plt.figure(figsize=(8, 5))
-    if x not in df.columns or y not in df.columns:
-        print(f"Colonnes '{x}' ou '{y}' non trouvées. Ignoré.")
-        return
-    df = df.sort_values(by=x)
-    df.groupby(x)[y].mean().plot(kind="line", marker="o")
-    plt.title(title)
-    plt.ylabel(y)
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
-
-def create_threshold_plot(df, x, y, title, filename, seuils):
-    if x not in df.columns or y not in df.columns:
-        print(f"Données invalides pour {title}")
-        return
-
-    df[x] = pd.to_datetime(df[x])
-    df = df.sort_values(by=x)
-    df = df.groupby(x)[y].mean().reset_index()
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(df[x], df[y], marker="o", label="Moyenne réelle", color="black")
-
-    for val, label, color in seuils:
-        plt.axhline(y=val, color=color, linestyle="--", label=label)
-
-    plt.title(title)
-    plt.xlabel("Date")
-    plt.ylabel(y)
-    plt.xticks(rotation=45)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
-
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import storage
+import charts
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Rapport généré
+export_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_auto")
+export_filename = "export_analyse_air.xlsx"
+
+# Nombre max de lignes d'une feuille Excel : au-delà, suite dans "NO2 (2)", "NO2 (3)"...
+excel_max_rows = 1048576
+
+# Nombre de lignes converties à la fois en mode streaming (write-only)
+export_chunk_size = 50000
+
+
+#####################################################################################
+#                               ÉCRITURE DES DONNÉES
+#####################################################################################
+
+# Lignes d'un DataFrame par paquets : NaN/NaT -> cellule vide, catégories -> texte
+def dataframe_chunk_rows(df, chunk_size=None):
+    chunk_size = chunk_size or export_chunk_size
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        yield from chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+# Écrire tout le DataFrame dans une (ou plusieurs) feuilles, retourne la première
+# Workbook(write_only=True) : les lignes sont écrites sur disque au fur et à mesure (mémoire constante)
+# Workbook() : ancien mode, tout le classeur reste en mémoire
+# ws : première feuille déjà créée (sinon elle est créée ici)
+def write_sheet(wb, title, df, ws=None):
+    per_sheet = excel_max_rows - 1  # une ligne d'en-tête par feuille
+    sheets = []
+    for part, start in enumerate(range(0, max(len(df), 1), per_sheet)):
+        if part > 0 or ws is None:
+            ws = wb.create_sheet(title if part == 0 else f"{title} ({part + 1})")
+        part_df = df.iloc[start:start + per_sheet]
+        if wb.write_only:
+            ws.append(list(df.columns))
+            for row in dataframe_chunk_rows(part_df):
+                ws.append(row)
+        else:
+            from openpyxl.utils.dataframe import dataframe_to_rows
+
+            for r in dataframe_to_rows(part_df, index=False, header=True):
+                ws.append(r)
+        sheets.append(ws)
+    instrumentation.count("rows_out", len(df))
+    return sheets[0]
+
+
+# Feuille Dashboard : nombre d'alertes par commune
+# Retourne les graphiques à insérer [(feuille, cellule, spec)]
 def create_dashboard_with_alerts(wb):
+    from openpyxl.utils.dataframe import dataframe_to_rows
+    import database
+
     ws = wb.create_sheet("Dashboard")
 
+    # Épisodes comptés par commune dans la base SQLite (database.py) : une requête, libellés joints dans la base
     try:
-        df_no2 = pd.read_csv("data_clean/NO2_alert_200_3days.csv")
-        df_pm10 = pd.read_csv("data_clean/PM10_alerts.csv")
+        summary = database.alert_counts().drop(columns="commune_id")
     except FileNotFoundError as e:
-        ws["A1"] = f"Fichiers d'alerte non trouvés : {e.filename}"
-        return
-
-    no2_counts = df_no2["commune"].value_counts().reset_index()
-    no2_counts.columns = ["commune", "nb_alertes_no2"]
+        ws.append([f"Base de données non trouvée : {e}"])
+        return []
+    summary["commune"] = summary["commune"].astype(object)
 
-    pm10_counts = df_pm10["commune"].value_counts().reset_index()
-    pm10_counts.columns = ["commune", "nb_alertes_pm10"]
-
-    summary = pd.merge(no2_counts, pm10_counts, on="commune", how="outer").fillna(0)
+    no2_counts = summary.loc[summary["nb_alertes_no2"] > 0, ["commune", "nb_alertes_no2"]]
+    no2_counts = no2_counts.sort_values("nb_alertes_no2", ascending=False, kind="stable")
+    pm10_counts = summary.loc[summary["nb_alertes_pm10"] > 0, ["commune", "nb_alertes_pm10"]]
+    pm10_counts = pm10_counts.sort_values("nb_alertes_pm10", ascending=False, kind="stable")
 
     for r in dataframe_to_rows(summary, index=False, header=True):
         ws.append(r)
 
-    def make_plot(data, col_x, col_y, title, filename):
-        if data.empty:
-            print(f"Données vides pour : {title}")
-            return
-        plt.figure(figsize=(10, 5))
-        plt.bar(data[col_x], data[col_y])
-        plt.title(title)
-        plt.xticks(rotation=45, ha="right")
-        plt.tight_layout()
-        plt.savefig(filename)
-        plt.close()
-
-    make_plot(no2_counts, "commune", "nb_alertes_no2", "Alertes NO2", "no2_alerts.png")
-    make_plot(pm10_counts, "commune", "nb_alertes_pm10", "Alertes PM10", "pm10_alerts.png")
-
-    if os.path.exists("no2_alerts.png"):
-        ws.add_image(Image("no2_alerts.png"), "G2")
-    if os.path.exists("pm10_alerts.png"):
-        ws.add_image(Image("pm10_alerts.png"), "G30")
+    return [
+        (ws, "G2", charts.bar_chart(no2_counts, "commune", "nb_alertes_no2", "Alertes NO2")),
+        (ws, "G30", charts.bar_chart(pm10_counts, "commune", "nb_alertes_pm10", "Alertes PM10")),
+    ]
 
 def add_normes_sheet(wb):
+    import normes
+
     ws = wb.create_sheet("Normes")
-    normes_data = [
-        ["Polluant", "Type de norme", "Valeur", "Unité", "Origine"],
-        ["NO2", "Objectif de qualité (annuel)", "40", "μg/m³", "FR"],
-        ["NO2", "Valeur limite horaire (18h/an)", "200", "μg/m³", "UE"],
-        ["NO2", "Seuil d’information", "200", "μg/m³", "FR"],
-        ["NO2", "Seuil d’alerte", "400", "μg/m³", "UE/FR"],
-        ["PM10", "Objectif de qualité (annuel)", "30", "μg/m³", "FR"],
-        ["PM10", "Valeur limite journalière (35j/an)", "50", "μg/m³", "UE"],
-        ["PM10", "Seuil d’information", "50", "μg/m³", "FR"],
-        ["PM10", "Seuil d’alerte", "80", "μg/m³", "FR"],
-        ["O3", "Seuil d’alerte", "240", "μg/m³", "FR"],
-        ["SO2", "Seuil d’alerte", "500", "μg/m³", "FR"],
-    ]
+    normes_data = [["Polluant", "Type de norme", "Valeur", "Unité", "Origine", "Moyenne", "Dépassements autorisés / an"]]
+    for norme in normes.NORMES:
+        normes_data.append([
+            norme["polluant"], norme["norme"], str(norme["valeur"]), normes.UNITE, norme["origine"],
+            norme["fenetre"], norme["depassements_autorises"] or 0,
+        ])
     for row in normes_data:
         ws.append(row)
     ws.append([])
@@ -112,67 +111,93 @@ def add_normes_sheet(wb):
     for defi in defs:
         ws.append([defi])
 
-def run_export():
-    data_dir = "data_clean"
-    export_dir = os.path.join(os.path.dirname(__file__), "export_auto")
+def export_path():
+    return os.path.join(export_dir, export_filename)
+
+
+# streaming=True : classeur write-only, données complètes écrites par paquets
+# streaming=False : ancien mode (classeur entièrement en mémoire)
+def run_export(streaming=True):
+    import normes
+    import timeseries
+    import dimensions
+    from openpyxl import Workbook
+
     os.makedirs(export_dir, exist_ok=True)
-    output_file = os.path.join(export_dir, "export_analyse_air.xlsx")
-
-
-    df_no2 = pd.read_csv(os.path.join(data_dir, "NO2_data.csv"))
-    df_pm10 = pd.read_csv(os.path.join(data_dir, "PM10_data.csv"))
-    df_pop = pd.read_csv(os.path.join(data_dir, "population_data.csv"))
-    df_ent = pd.read_csv(os.path.join(data_dir, "enterprise_data.csv"))
-
-    wb = Workbook()
-    ws_no2 = wb.active
-    ws_no2.title = "NO2"
-    for r in dataframe_to_rows(df_no2.head(100), index=False, header=True):
-        ws_no2.append(r)
-
-    create_chart(df_no2, "date_local", "no2_value", "Évolution NO2", "no2_plot.png")
-    create_threshold_plot(df_no2, "date_local", "no2_value", "NO2 avec seuils", "no2_seuils.png", [
-        (40, "Valeur limite annuelle (40)", "blue"),
-        (200, "Seuil info (200)", "orange"),
-        (400, "Seuil alerte (400)", "red")
-    ])
-    if os.path.exists("no2_plot.png"):
-        ws_no2.add_image(Image("no2_plot.png"), "H2")
-    if os.path.exists("no2_seuils.png"):
-        ws_no2.add_image(Image("no2_seuils.png"), "H20")
+    output_file = export_path()
 
-    ws_pm10 = wb.create_sheet("PM10")
-    for r in dataframe_to_rows(df_pm10.head(100), index=False, header=True):
-        ws_pm10.append(r)
-
-    create_chart(df_pm10, "date_local", "pm10_value", "Évolution PM10", "pm10_plot.png")
-    create_threshold_plot(df_pm10, "date_local", "pm10_value", "PM10 avec seuils", "pm10_seuils.png", [
-        (50, "Seuil info (50)", "orange"),
-        (80, "Seuil alerte (80)", "red")
-    ])
-    if os.path.exists("pm10_plot.png"):
-        ws_pm10.add_image(Image("pm10_plot.png"), "H2")
-    if os.path.exists("pm10_seuils.png"):
-        ws_pm10.add_image(Image("pm10_seuils.png"), "H20")
 
-    ws_pop = wb.create_sheet("Population")
-    for r in dataframe_to_rows(df_pop, index=False, header=True):
-        ws_pop.append(r)
+    # Noms de commune / station à côté des identifiants pour la lecture du rapport
+    df_no2 = dimensions.with_names(storage.load_table("NO2_data"))
+    df_pm10 = dimensions.with_names(storage.load_table("PM10_data"))
+    df_pop = dimensions.with_names(storage.load_table("population_data"))
+    df_ent = storage.load_table("enterprise_data", columns=["activite_principale"])
+
+    # Personnes-jours d'exposition par tranche de population (analyse.analyse_exposition)
+    df_expo = storage.load_table("exposition_tranches") if storage.table_exists("exposition_tranches") else None
+    # Créations / fermetures par section et corrélation avec les jours de dépassement (analyse.analyse_entreprises)
+    df_activite = storage.load_table("correlation_entreprises") if storage.table_exists("correlation_entreprises") else None
 
-    ws_ent = wb.create_sheet("Entreprises")
     top_activites = df_ent["activite_principale"].value_counts().head(10).reset_index()
     top_activites.columns = ["activite_principale", "count"]
-    for r in dataframe_to_rows(top_activites, index=False, header=True):
-        ws_ent.append(r)
 
-    create_chart(top_activites, "activite_principale", "count", "Top activités entreprises", "ent_plot.png")
-    if os.path.exists("ent_plot.png"):
-        ws_ent.add_image(Image("ent_plot.png"), "E2")
+    wb = Workbook(write_only=streaming)
+    if not streaming:
+        wb.remove(wb.active)  # feuille vide par défaut
 
-    create_dashboard_with_alerts(wb)
+    ws_no2 = wb.create_sheet("NO2")
+    ws_pm10 = wb.create_sheet("PM10")
+    ws_pop = wb.create_sheet("Population")
+    ws_ent = wb.create_sheet("Entreprises")
+    ws_expo = wb.create_sheet("Exposition") if df_expo is not None else None
+    ws_activite = wb.create_sheet("Activité entreprises") if df_activite is not None else None
+
+    # Graphiques : (feuille, cellule, spec), moyennes régionales calculées sur les séries par station
+    no2_daily = timeseries.regional_daily_mean("NO2")
+    pm10_daily = timeseries.regional_daily_mean("PM10")
+    chart_specs = [
+        (ws_no2, "H2", charts.line_chart(no2_daily, "date_local", "no2_value", "Évolution NO2")),
+        (ws_no2, "H20", charts.threshold_chart(no2_daily, "date_local", "no2_value", "NO2 avec seuils",
+                                               normes.seuils_graphique("NO2"))),
+        (ws_pm10, "H2", charts.line_chart(pm10_daily, "date_local", "pm10_value", "Évolution PM10")),
+        (ws_pm10, "H20", charts.threshold_chart(pm10_daily, "date_local", "pm10_value", "PM10 avec seuils",
+                                                normes.seuils_graphique("PM10"))),
+        (ws_ent, "E2", charts.line_chart(top_activites, "activite_principale", "count", "Top activités entreprises")),
+    ]
+    chart_specs += create_dashboard_with_alerts(wb)
     add_normes_sheet(wb)
-    wb.save(output_file)
-    print(f"Rapport Excel généré : {output_file}")
+
+    # Rendu des graphiques en parallèle pendant l'écriture des lignes
+    with ThreadPoolExecutor(max_workers=1) as background:
+        rendering = background.submit(instrumentation.bind(charts.render_charts), [spec for _, _, spec in chart_specs])
+
+        write_sheet(wb, "NO2", df_no2, ws_no2)
+        write_sheet(wb, "PM10", df_pm10, ws_pm10)
+        write_sheet(wb, "Population", df_pop, ws_pop)
+        write_sheet(wb, "Entreprises", top_activites, ws_ent)
+        if df_expo is not None:
+            write_sheet(wb, "Exposition", df_expo, ws_expo)
+        if df_activite is not None:
+            write_sheet(wb, "Activité entreprises", df_activite, ws_activite)
+
+        for (ws, anchor, _), png in zip(chart_specs, rendering.result()):
+            if png is not None:
+                ws.add_image(charts.png_image(png), anchor)
+
+    # Écrire dans un fichier temporaire puis renommer : deux exports simultanés
+    # ne produisent jamais un classeur à moitié écrit
+    fd, tmp_file = tempfile.mkstemp(suffix=".xlsx", dir=export_dir)
+    os.close(fd)
+    try:
+        wb.save(tmp_file)
+        os.chmod(tmp_file, 0o644)  # mkstemp crée en 0600 : le rapport doit rester lisible par les autres utilisateurs
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    instrumentation.count_file("bytes_written", output_file)
+    logger.info("Rapport Excel généré : %s", output_file)
 
 if __name__ == "__main__":
+    instrumentation.setup_logging()
     run_export()
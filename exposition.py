@@ -0,0 +1,152 @@
+# exposition.py
+# Exposition de la population : personnes-jours au-dessus de chaque seuil, par commune et par tranche de population
+# Une commune est exposée un jour donné si au moins une de ses stations dépasse le seuil en moyenne journalière
+# (seules les communes équipées d'une station sont donc couvertes)
+import logging
+import numpy as np
+import pandas as pd
+import storage
+import normes
+import rollup
+import dimensions
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+categories = rollup.categories_journalieres
+jours_cols = [f"jours_{categorie}" for categorie in categories]
+
+# Cache : jours de dépassement par commune et par jour (une ligne par commune x jour mesuré)
+# Le cube journalier n'est relu qu'à partir du dernier jour connu de chaque polluant
+table_journaliere = "exposition_journaliere"
+
+# Résultats (la population est jointe à chaque calcul : une mise à jour de population_data suffit)
+table_communes = "exposition_communes"
+table_tranches = "exposition_tranches"
+
+# Tranche des communes absentes de population_data
+tranche_inconnue = "inconnue"
+
+
+#####################################################################################
+#                               DÉPASSEMENTS PAR COMMUNE ET PAR JOUR
+#####################################################################################
+
+# Cube journalier (polluant x station x jour) -> commune x jour : max des indicateurs des stations
+def commune_days(cube):
+    cube = cube[cube['commune_id'] >= 0]
+    days = (
+        cube.groupby(['polluant', 'commune_id', 'date_local'], observed=True)
+        .agg(nb_stations=('station_id', 'size'), **{col: (col, 'max') for col in jours_cols})
+        .reset_index()
+    )
+    days['polluant'] = days['polluant'].astype(str)
+    return days.astype({'nb_stations': 'int16', **{col: 'int8' for col in jours_cols}})
+
+
+def build_daily_exposure(incremental=True):
+    existing = None
+    if incremental and storage.table_exists(table_journaliere):
+        existing = storage.load_table(table_journaliere)
+
+    # Comme rollup.build_rollups : le dernier jour connu est toujours recalculé,
+    # les jours antérieurs au premier jour du cube (sortis de la fenêtre) sont retirés
+    since = {}
+    firsts = rollup.first_days() if existing is not None else {}
+    for polluant in rollup.polluants:
+        since[polluant] = None
+        if existing is not None and polluant in firsts:
+            known = existing.loc[existing['polluant'] == polluant, 'date_local']
+            if not known.empty:
+                since[polluant] = known.max()
+
+    new_days = []
+    for polluant, start in since.items():
+        cube = rollup.load_cube("journalier", polluant, ['polluant', 'commune_id', 'station_id', 'date_local'] + jours_cols,
+                                date_range=(start, None) if start is not None else None)
+        if not cube.empty:
+            new_days.append(commune_days(cube))
+
+    frames = ([rollup.drop_since(existing, since, "journalier", firsts)] if existing is not None else []) + new_days
+    if not frames:
+        return pd.DataFrame(columns=['polluant', 'commune_id', 'date_local', 'nb_stations'] + jours_cols)
+    daily = pd.concat(frames, ignore_index=True)
+    daily['polluant'] = daily['polluant'].astype(str)
+    daily = daily.sort_values(['polluant', 'commune_id', 'date_local']).reset_index(drop=True)
+    storage.save_table(daily, table_journaliere)
+    logger.info("%d jours x commune recalculés (%d au total)", sum(len(df) for df in new_days), len(daily))
+    return daily
+
+
+#####################################################################################
+#                               JOINTURE AVEC LA POPULATION
+#####################################################################################
+
+# Population et tranche de chaque commune_id, en tableaux indexés par l'identifiant
+def population_by_commune(size):
+    population = np.full(size, np.nan)
+    tranches = np.full(size, tranche_inconnue, dtype=object)
+    if storage.table_exists("population_data"):
+        df = storage.load_table("population_data", columns=['commune_id', 'population_totale', 'tranche_population'])
+        df = df[(df['commune_id'] >= 0) & (df['commune_id'] < size)].drop_duplicates('commune_id')
+        ids = df['commune_id'].to_numpy()
+        population[ids] = df['population_totale'].to_numpy(dtype=np.float64)
+        tranches[ids] = df['tranche_population'].astype(object).fillna(tranche_inconnue).to_numpy()
+    return population, tranches
+
+
+# Seuil de chaque (polluant, catégorie) journalière, comme dans rollup.daily_cube
+def seuils():
+    rows = []
+    for polluant in rollup.polluants:
+        for norme in normes.normes_polluant(polluant):
+            if norme["fenetre"] != "annuelle" and norme["categorie"] in categories:
+                rows.append({'polluant': polluant, 'categorie': norme["categorie"], 'seuil': norme["valeur"]})
+    return pd.DataFrame(rows).drop_duplicates(['polluant', 'categorie'], keep='last')
+
+
+def build_exposition(incremental=True):
+    logger.info("Calcul de l'exposition de la population aux dépassements...")
+    daily = build_daily_exposure(incremental)
+
+    # Jours de dépassement par commune et par année, une ligne par catégorie de seuil
+    daily = daily.assign(annee=daily['date_local'].dt.year.astype('int16'))
+    daily = daily.astype({col: 'int32' for col in jours_cols})  # int8 : déborderait sur une année
+    yearly = daily.groupby(['polluant', 'commune_id', 'annee'], sort=False)[jours_cols].sum().reset_index()
+    yearly = yearly.melt(id_vars=['polluant', 'commune_id', 'annee'], value_vars=jours_cols,
+                         var_name='categorie', value_name='jours_depassement')
+    yearly['categorie'] = yearly['categorie'].str.removeprefix("jours_")
+    yearly = yearly.merge(seuils(), on=['polluant', 'categorie'], how='inner')
+    yearly = yearly[yearly['jours_depassement'] > 0].reset_index(drop=True)
+
+    # Population de chaque ligne par indexation sur commune_id (pas de recherche ligne à ligne)
+    size = int(daily['commune_id'].max()) + 1 if len(daily) else 0
+    population, tranches = population_by_commune(size)
+    ids = yearly['commune_id'].to_numpy()
+    yearly['population_totale'] = population[ids]
+    yearly['tranche_population'] = pd.Categorical(tranches[ids])
+    yearly['personnes_jours'] = yearly['jours_depassement'] * yearly['population_totale']
+
+    communes = yearly[['polluant', 'categorie', 'seuil', 'commune_id', 'annee', 'jours_depassement',
+                       'population_totale', 'tranche_population', 'personnes_jours']]
+    communes = communes.sort_values(['polluant', 'categorie', 'annee', 'personnes_jours'],
+                                    ascending=[True, True, True, False]).reset_index(drop=True)
+    communes = dimensions.with_names(communes)
+    storage.save_table(communes, table_communes)
+
+    tranches_df = (
+        communes.groupby(['polluant', 'categorie', 'seuil', 'tranche_population', 'annee'], observed=True)
+        .agg(nb_communes=('commune_id', 'size'), population_exposee=('population_totale', 'sum'),
+             jours_depassement=('jours_depassement', 'sum'), personnes_jours=('personnes_jours', 'sum'))
+        .reset_index()
+    )
+    storage.save_table(tranches_df, table_tranches)
+
+    nb_sans_population = int(communes.loc[communes['population_totale'].isna(), 'commune_id'].nunique())
+    if nb_sans_population:
+        logger.warning("%d communes exposées absentes de population_data (comptées sans population)", nb_sans_population)
+    return communes, tranches_df
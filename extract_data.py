@@ -1,19 +1,70 @@
 # extract_data.py
 import os
+import time
+import logging
+import threading
 import requests
 import json
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import raw_store
+import instrumentation
+
+logger = logging.getLogger(__name__)
 
 
 #####################################################################################
 #                               GLOBAL VARIABLE
 #####################################################################################
 
-# define datas directory
-script_dir = os.path.dirname(os.path.abspath(__file__))
-datas_dir = os.path.join(script_dir, "datas")
+# Les données brutes sont écrites dans datas/ par raw_store (JSON lines compressé)
+
+# API airpl.org (modifiable pour pointer vers un serveur local de test)
+pollution_url = "https://data.airpl.org/api/v1/mesure/journaliere/"
+
+# Mesures horaires (normes horaires : NO2 200 µg/m³ 18 h/an, seuils d'alerte), ~24x le volume journalier
+hourly_url = "https://data.airpl.org/api/v1/mesure/horaire/"
+hourly_polluants = ["NO2", "O3", "SO2"]
+hourly_chunk_days = 7  # requêtes plus courtes qu'en journalier (moins de pages par requête)
+
+# Départements de la région et codes polluant airpl
+# (remplacés dans chaque worker par partitions.activate quand le pipeline est partitionné)
+departements = ["44", "49", "53", "72", "85"]
+
+# Codes des stations gardées (None = toutes les stations des départements), ex : une partition "groupe de stations"
+stations = None
+polluants = {
+    "PM10": "24",
+    "NO2": "03",
+    "O3": "08",
+    "SO2": "01",
+    "PM2.5": "39",
+}
+
+
+#####################################################################################
+#
+#                               HTTP SESSION
+#
+#####################################################################################
 
-# create it if it does not exist
-os.makedirs(datas_dir, exist_ok=True)
+# Une seule session pour réutiliser les connexions (keep-alive) avec retry + backoff
+def create_session(pool_size=8, retries=3, backoff=0.5):
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # latence de chaque requête dans les mesures de l'étape en cours
+    session.hooks.update(instrumentation.http_hooks())
+    return session
 
 
 #####################################################################################
@@ -23,48 +74,314 @@ os.makedirs(datas_dir, exist_ok=True)
 #####################################################################################
 def fetch_pollution_data(start_date, end_date):
     date_range = f"{start_date},{end_date}"
-    url = "https://data.airpl.org/api/v1/mesure/journaliere/"
+    url = pollution_url
+
+    try:
+        # Fetch chaque polluant (une requête par polluant, tous les départements)
+        datas = {}
+        for name, code in polluants.items():
+            params = {
+                "code_configuration_de_mesure__code_point_de_prelevement__code_polluant": code,
+                "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in": ",".join(departements) + ",",
+                "date_heure_tu__range": date_range,
+                "export": "json",
+                "format": "json",
+            }
+            response = requests.get(url, params=params, hooks=instrumentation.http_hooks())
+            response.raise_for_status()
+            datas[name] = keep_stations(response_records(response.json()))
+
+        # Save to compressed JSON lines (un record par ligne)
+        for name, data in datas.items():
+            raw_store.write_records(f"{name}_Data", data)
+            logger.info("%s data saved successfully.", name)
+
+    except requests.exceptions.RequestException as e:
+        logger.error("An error occurred while fetching pollution data: %s", e)
+        raise
+    except ValueError as e:
+        logger.error("Error decoding JSON: %s", e)
+        raise
+
+
+# L'API renvoie soit {"results": [...]} soit directement une liste
+def response_records(data):
+    return data if isinstance(data, list) else data.get("results", [])
 
-    params_PM10 = {
-        "code_configuration_de_mesure__code_point_de_prelevement__code_polluant": "24",
-        "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in": "44,49,53,72,85,",
-        "date_heure_tu__range": date_range,
-        "export": "json",
-        "format": "json",
-    }
 
-    params_NO2 = {
-        "code_configuration_de_mesure__code_point_de_prelevement__code_polluant": "03",
-        "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in": "44,49,53,72,85,",
-        "date_heure_tu__range": date_range,
+# Records des seules stations demandées (toutes si stations est None)
+def keep_stations(records):
+    if stations is None:
+        return records
+    wanted = set(stations)
+    return [record for record in records if record.get("code_station") in wanted]
+
+
+#####################################################################################
+#
+#                               EXTRACT POLLUTION (CONCURRENT)
+#
+#####################################################################################
+
+# Découper [start_date, end_date] en morceaux de chunk_days jours (bornes incluses, sans recouvrement)
+def split_date_range(start_date, end_date, chunk_days):
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days) - timedelta(seconds=1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(seconds=1)
+    return chunks
+
+
+# Récupérer un morceau (polluant x département x période), en suivant la pagination "next"
+def fetch_pollution_chunk(session, code_polluant, departement, chunk_start, chunk_end, timeout=60, url=None):
+    params = {
+        "code_configuration_de_mesure__code_point_de_prelevement__code_polluant": code_polluant,
+        "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in": departement,
+        "date_heure_tu__range": f"{chunk_start},{chunk_end}",
         "export": "json",
         "format": "json",
     }
 
+    records = []
+    url = url or pollution_url
+    while url:
+        response = session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        # L'API renvoie soit {"results": [...], "next": ...} soit directement une liste
+        if isinstance(data, list):
+            records.extend(data)
+            break
+        records.extend(data.get("results", []))
+        url = data.get("next")
+        params = None  # l'url "next" contient déjà les paramètres
+    return records
+
+
+def fetch_pollution_data_concurrent(start_date, end_date, chunk_days=90, max_workers=8, session=None, incremental=False):
+    # En mode incrémental, chaque polluant ne repart que de son dernier jour connu
+    starts = {name: start_date for name in polluants}
+    if incremental:
+        watermarks = load_watermarks()
+        for name in polluants:
+            if name in watermarks and raw_store.raw_exists(f"{name}_Data"):
+                starts[name] = max(start_date, watermark_to_datetime(watermarks[name]))
+                logger.info("%s : reprise à partir de %s", name, f"{starts[name]:%Y-%m-%d}")
+
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=max_workers)
+
+    # Une tâche par (polluant, département, période)
+    tasks = [
+        (name, code, dep, chunk_start, chunk_end)
+        for name, code in polluants.items()
+        for dep in departements
+        for chunk_start, chunk_end in split_date_range(starts[name], end_date, chunk_days)
+    ]
+    logger.info("%d requêtes pollution (%d départements x %d polluants)", len(tasks), len(departements), len(polluants))
+
+    start = time.perf_counter()
     try:
-        # Fetch PM10
-        response_PM10 = requests.get(url, params=params_PM10)
-        response_PM10.raise_for_status()
-        data_PM10 = response_PM10.json()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (name, executor.submit(fetch_pollution_chunk, session, code, dep, chunk_start, chunk_end))
+                for name, code, dep, chunk_start, chunk_end in tasks
+            ]
+
+            # Fusionner dans l'ordre des tâches (résultat déterministe)
+            merged = {name: [] for name in polluants}
+            failed = set()
+            for name, future in futures:
+                try:
+                    merged[name].extend(keep_stations(future.result()))
+                except requests.exceptions.RequestException as e:
+                    logger.error("An error occurred while fetching %s data: %s", name, e)
+                    failed.add(name)
+                except ValueError as e:
+                    logger.error("Error decoding %s JSON: %s", name, e)
+                    failed.add(name)
+    finally:
+        if own_session:
+            session.close()
+
+    # Sauvegarder dans les mêmes fichiers que fetch_pollution_data
+    # (on ne remplace pas un fichier existant par des données incomplètes)
+    for name, records in merged.items():
+        if name in failed:
+            logger.warning("%s data not saved (some chunks failed).", name)
+            continue
+
+        dataset = f"{name}_Data"
+        if incremental:
+            logger.info("%s : %d nouveaux records", name, len(records))
+            # on garde la même fenêtre que le mode complet (start_date -> end_date)
+            oldest = start_date.strftime("%Y-%m-%d")
+            count = raw_store.merge_records(
+                dataset, records, pollution_record_key,
+                keep=lambda r: str(r.get("date_heure_local", ""))[:10] >= oldest,
+            )
+        else:
+            count = raw_store.write_records(dataset, records)
+        logger.info("%s data saved successfully (%d records).", name, count)
+
+        # (en incrémental les nouveaux records sont tous après l'ancien watermark)
+        if records:
+            save_watermark(name, max(str(r.get("date_heure_local", "")) for r in records))
+
+    logger.info("Pollution data fetched in %.1fs", time.perf_counter() - start)
+    # étape en échec : les polluants complets sont sauvegardés, les étapes suivantes ne tournent pas sur l'ancien brut
+    if failed:
+        raise RuntimeError(f"Pollution data not fetched for {', '.join(sorted(failed))}")
+
+
+#####################################################################################
+#
+#                               EXTRACT POLLUTION (HORAIRE)
+#
+#####################################################################################
 
-        # Fetch NO2
-        response_NO2 = requests.get(url, params=params_NO2)
-        response_NO2.raise_for_status()
-        data_NO2 = response_NO2.json()
+# Un fichier par polluant et par mois : datas/horaire/<polluant>/<AAAA-MM>.ndjson.gz
+# (un mois se retélécharge et se retraite sans toucher aux autres)
+def hourly_dataset(polluant, month):
+    return f"horaire/{polluant}/{month}"
 
-        # Save to JSON      
-        with open(os.path.join(datas_dir, "PM10_Data.json"), "w", encoding="utf-8") as f:
-            json.dump(data_PM10, f, ensure_ascii=False, indent=4)
-        print("PM10 data saved successfully.")
 
-        with open(os.path.join(datas_dir, "NO2_Data.json"), "w", encoding="utf-8") as f:
-            json.dump(data_NO2, f, ensure_ascii=False, indent=4)
-        print("NO2 data saved successfully.")
+# Index des mois téléchargés : {polluant: {mois: {"records": n, "complete": bool}}}
+# (écrit après chaque mois : c'est aussi la sortie de l'étape fetch_hourly du pipeline)
+def hourly_index_path():
+    return os.path.join(raw_store.raw_dir, "horaire", "index.json")
 
-    except requests.exceptions.RequestException as e:
-        print("An error occurred while fetching pollution data:", e)
-    except ValueError as e:
-        print("Error decoding JSON:", e)
+
+def load_hourly_index():
+    if not os.path.exists(hourly_index_path()):
+        return {}
+    with open(hourly_index_path(), encoding="utf-8") as f:
+        return json.load(f)
+
+
+# [(mois "AAAA-MM", début, fin)] couvrant [start_date, end_date], bornes des mois coupées à la fenêtre
+def month_ranges(start_date, end_date):
+    months = []
+    month_start = datetime(start_date.year, start_date.month, 1)
+    while month_start <= end_date:
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        months.append((f"{month_start:%Y-%m}", max(month_start, start_date),
+                       min(next_month - timedelta(seconds=1), end_date)))
+        month_start = next_month
+    return months
+
+
+# Mesures horaires des polluants à normes horaires, mois par mois (un seul mois en mémoire)
+# En incrémental, les mois complets déjà téléchargés sont sautés ; le mois en cours est refait
+def fetch_pollution_hourly(start_date, end_date, max_workers=8, session=None, incremental=False):
+    index = load_hourly_index() if incremental else {}
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=max_workers)
+
+    months = month_ranges(start_date, end_date)
+    failed_months = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for month, month_start, month_end in months:
+                todo = [name for name in hourly_polluants
+                        if not index.get(name, {}).get(month, {}).get("complete")]
+                if not todo:
+                    continue
+                futures = [
+                    (name, executor.submit(fetch_pollution_chunk, session, polluants[name], dep,
+                                           chunk_start, chunk_end, url=hourly_url))
+                    for name in todo
+                    for dep in departements
+                    for chunk_start, chunk_end in split_date_range(month_start, month_end, hourly_chunk_days)
+                ]
+                merged = {name: [] for name in todo}
+                failed = set()
+                for name, future in futures:
+                    try:
+                        merged[name].extend(keep_stations(future.result()))
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        logger.error("An error occurred while fetching %s hourly data (%s): %s", name, month, e)
+                        failed.add(name)
+
+                for name, records in merged.items():
+                    if name in failed:
+                        logger.warning("%s %s : mois horaire non sauvegardé (requêtes en échec)", name, month)
+                        continue
+                    os.makedirs(os.path.dirname(raw_store.raw_path(hourly_dataset(name, month))), exist_ok=True)
+                    count = raw_store.write_records(hourly_dataset(name, month), records)
+                    # (mesures publiées avec retard : un mois n'est complet que 2 jours après sa fin)
+                    complete = month_end < end_date - timedelta(days=2)
+                    index.setdefault(name, {})[month] = {"records": count, "complete": complete}
+                    logger.info("%s %s : %d mesures horaires", name, month, count)
+                instrumentation.write_atomic(hourly_index_path(), json.dumps(index, indent=4))
+                failed_months += [f"{name} {month}" for name in sorted(failed)]
+    finally:
+        if own_session:
+            session.close()
+
+    # Mois sortis de la fenêtre
+    first_month = months[0][0] if months else None
+    for name, entries in index.items():
+        for month in [m for m in entries if first_month and m < first_month]:
+            raw_store.remove_raw(hourly_dataset(name, month))
+            del entries[month]
+    instrumentation.write_atomic(hourly_index_path(), json.dumps(index, indent=4))
+    logger.info("Hourly pollution data fetched in %.1fs", time.perf_counter() - start)
+    # les autres mois sont sauvegardés, l'étape est en échec (mois refaits au prochain run)
+    if failed_months:
+        raise RuntimeError(f"Hourly data not fetched for {', '.join(failed_months)}")
+
+
+#####################################################################################
+#
+#                               INCREMENTAL (WATERMARKS)
+#
+#####################################################################################
+
+_watermarks_lock = threading.Lock()
+
+
+# Dernière valeur vue par dataset (date_heure_local pour la pollution,
+# datecreationetablissement pour SIRENE), pour ne télécharger que le delta
+def watermarks_path():
+    return os.path.join(raw_store.raw_dir, "watermarks.json")
+
+
+def load_watermarks():
+    if not os.path.exists(watermarks_path()):
+        return {}
+    with open(watermarks_path(), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# fetch_pollution et fetch_enterprise tournent en parallèle (pipeline) : lecture / mise à jour / écriture
+# sous verrou, écriture atomique (jamais de fichier à moitié écrit lu par l'autre étape)
+def save_watermark(dataset, value):
+    with _watermarks_lock:
+        watermarks = load_watermarks()
+        watermarks[dataset] = value
+        instrumentation.write_atomic(watermarks_path(), json.dumps(watermarks, ensure_ascii=False, indent=4))
+
+
+# "2024-05-03T00:00:00+02:00" -> datetime(2024, 5, 3) : on refait toujours le dernier jour
+# (mesures corrigées a posteriori), les doublons sont supprimés au merge
+def watermark_to_datetime(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+def pollution_record_key(record):
+    return (record.get("nom_station"), record.get("date_heure_local"))
+
+
+def enterprise_record_key(record):
+    fields = record.get("fields", record)  # v1 : {"fields": {...}}, v2.1 : record à plat
+    return fields.get("siret") or record.get("recordid")
 
 
 
@@ -75,7 +392,12 @@ def fetch_pollution_data(start_date, end_date):
 #####################################################################################
 
 
-def fetch_population_data():
+def fetch_population_data(incremental=False):
+    # Recensement figé (2019) : en incrémental on ne le retélécharge pas
+    if incremental and raw_store.raw_exists("population_data"):
+        logger.info("Population data already present, skipped.")
+        return
+
     url = "https://data.paysdelaloire.fr/api/records/1.0/search/"
     params = {
         "dataset": "12002701600563_population_pays_de_la_loire_2019_communes_epci",
@@ -84,19 +406,20 @@ def fetch_population_data():
     }
 
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, hooks=instrumentation.http_hooks())
         response.raise_for_status()
         data_population = response.json()
 
-        # Save to JSON        
-        with open(os.path.join(datas_dir, "population_data.json"), "w", encoding="utf-8") as f:
-            json.dump(data_population, f, ensure_ascii=False, indent=4)
-        print("Population data saved successfully.")
+        # Save to compressed JSON lines ({"recordid", "fields"} par ligne)
+        count = raw_store.write_records("population_data", data_population.get("records", []))
+        logger.info("Population data saved successfully (%d records).", count)
 
     except requests.exceptions.RequestException as e:
-        print("An error occurred while fetching population data:", e)
+        logger.error("An error occurred while fetching population data: %s", e)
+        raise
     except ValueError as e:
-        print("Error decoding JSON:", e)
+        logger.error("Error decoding JSON: %s", e)
+        raise
 
 
 
@@ -108,28 +431,151 @@ def fetch_population_data():
 
 
 
-def fetch_enterprise_data():
-    url = "https://data.paysdelaloire.fr/api/records/1.0/search/"
-    params = {
-        "dataset": "120027016_base-sirene-v3-ss",
-        "rows": 10000,  # limité à max 10000 par le site
-        "format": "json",
-        "where": 'datecreationetablissement > "2024-01-01"',
-        }
+# Opendatasoft (API explore v2.1) : l'API "records" est limitée à offset + limit <= 10000,
+# l'endpoint "exports" renvoie tout le dataset en streaming
+ods_base_url = "https://data.paysdelaloire.fr"
+enterprise_dataset = "120027016_base-sirene-v3-ss"
+ods_page_size = 100        # max autorisé par l'API records
+ods_max_offset = 10000     # offset + limit max de l'API records
+ods_rate_limit = 10        # requêtes par seconde max en mode pages
 
-    try:
-        response = requests.get(url, params=params)
+
+def ods_url(dataset, endpoint):
+    return f"{ods_base_url}/api/explore/v2.1/catalog/datasets/{dataset}/{endpoint}"
+
+
+# Limiteur de débit partagé entre threads : au plus `rate` requêtes par seconde
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Mode export : tout le dataset en JSON lines, recopié ligne par ligne dans `writer`
+def stream_ods_export(session, dataset, where, writer):
+    params = {"where": where} if where else {}
+    with session.get(ods_url(dataset, "exports/jsonl"), params=params, stream=True, timeout=300) as response:
         response.raise_for_status()
-        data_enterprises = response.json()
+        size = 0
+        for line in response.iter_lines():
+            if line:
+                size += len(line) + 1
+                writer.write_line(line)
+    instrumentation.count("bytes_read", size)
+    return writer.count
+
+
+# Tri explicite sur le siret : sans order_by, l'ordre n'est pas garanti d'une requête à l'autre
+# et des pages récupérées en parallèle pourraient se chevaucher ou sauter des records
+def ods_page(session, limiter, dataset, where, offset, limit):
+    limiter.wait()
+    params = {"limit": limit, "offset": offset, "order_by": "siret"}
+    if where:
+        params["where"] = where
+    response = session.get(ods_url(dataset, "records"), params=params, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+# Mode pages : découper la période de création en fenêtres de moins de 10000 records,
+# puis récupérer toutes les pages en parallèle (dans la limite de ods_rate_limit)
+def fetch_ods_pages(session, dataset, where, writer, since, until, max_workers=4):
+    limiter = RateLimiter(ods_rate_limit)
+
+    def window_where(start, end):
+        clause = f'datecreationetablissement >= "{start:%Y-%m-%d}" AND datecreationetablissement < "{end:%Y-%m-%d}"'
+        return f"({where}) AND {clause}" if where else clause
+
+    def window_count(window):
+        return ods_page(session, limiter, dataset, window_where(*window), 0, 0).get("total_count", 0)
+
+    # Fenêtres dont le total dépasse la limite : coupées en deux (jusqu'à un jour)
+    windows = []
+    to_check = [(since, until)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while to_check:
+            counts = list(executor.map(window_count, to_check))
+            next_check = []
+            for (start, end), total in zip(to_check, counts):
+                if total > ods_max_offset and (end - start).days > 1:
+                    middle = start + (end - start) / 2
+                    middle = datetime(middle.year, middle.month, middle.day)
+                    next_check += [(start, middle), (middle, end)]
+                else:
+                    if total > ods_max_offset:
+                        logger.warning("Attention : %d records le %s, seuls %d récupérables", total, f"{start:%Y-%m-%d}", ods_max_offset)
+                    windows.append((start, end, min(total, ods_max_offset)))
+            to_check = next_check
+
+        pages = [
+            (window_where(start, end), offset, min(ods_page_size, total - offset))
+            for start, end, total in windows
+            for offset in range(0, total, ods_page_size)
+        ]
+        logger.info("Enterprise : %d records, %d fenêtres, %d pages", sum(w[2] for w in windows), len(windows), len(pages))
+
+        futures = [executor.submit(ods_page, session, limiter, dataset, w, offset, limit) for w, offset, limit in pages]
+        for future in as_completed(futures):
+            for record in future.result().get("results", []):
+                writer.write(record)
+    return writer.count
+
+
+# mode "export" : endpoint d'export en streaming (défaut)
+# mode "pages" : API records paginée en parallèle, par fenêtres de dates de création
+def fetch_enterprise_data(incremental=False, mode="export", max_workers=4):
+    created_since = "2024-01-01"
+    where = f'datecreationetablissement > "{created_since}"'
+
+    # En incrémental : seulement les établissements mis à jour par l'INSEE depuis le dernier fetch
+    # (créations, mais aussi fermetures d'établissements plus anciens : date de dernier traitement,
+    # pas date de création). ">=" pour ne pas perdre ceux du même jour, dédupliqués sur le siret
+    incremental = incremental and raw_store.raw_exists("enterprise_data")
+    if incremental:
+        since = load_watermarks().get("enterprise", created_since)
+        where += f' AND datederniertraitementetablissement >= "{since[:10]}"'
+        logger.info("Enterprise : mises à jour depuis %s", since[:10])
+
+    # En incrémental le delta est écrit à part, puis fusionné
+    target = "enterprise_data_delta" if incremental else "enterprise_data"
+    session = create_session(pool_size=max_workers)
 
-        # Save to JSON
-        with open(os.path.join(datas_dir, "enterprise_data.json"), "w", encoding="utf-8") as f:
-            json.dump(data_enterprises, f, ensure_ascii=False, indent=4)
-        print("Enterprise data saved successfully.")
+    try:
+        # Les records sont écrits directement sur disque, un par ligne
+        with raw_store.RecordWriter(target) as writer:
+            if mode == "pages":
+                start = datetime.strptime(created_since, "%Y-%m-%d")
+                until = datetime.now() + timedelta(days=1)
+                count = fetch_ods_pages(session, enterprise_dataset, where, writer, start, until, max_workers)
+            else:
+                count = stream_ods_export(session, enterprise_dataset, where, writer)
+        logger.info("Enterprise : %d records téléchargés", count)
+
+        if incremental:
+            count = raw_store.merge_records("enterprise_data", raw_store.iter_records(target), enterprise_record_key)
+        logger.info("Enterprise data saved successfully (%d records).", count)
+
+        # (anciens caches sans date de traitement : la date de création, plus ancienne, reste une borne sûre)
+        last_date = (raw_store.max_value("enterprise_data", "datederniertraitementetablissement")
+                     or raw_store.max_value("enterprise_data", "datecreationetablissement"))
+        if last_date:
+            save_watermark("enterprise", last_date)
 
     except requests.exceptions.RequestException as e:
-        print("An error occurred while fetching enterprise data:", e)
+        logger.error("An error occurred while fetching enterprise data: %s", e)
+        raise
     except ValueError as e:
-        print("Error decoding JSON:", e)
-
-
+        logger.error("Error decoding JSON: %s", e)
+        raise
+    finally:
+        session.close()
+        raw_store.remove_raw("enterprise_data_delta")
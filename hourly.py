@@ -0,0 +1,221 @@
+# hourly.py
+# Mesures horaires : nettoyage mois par mois, tables partitionnées par mois, normes horaires par station et par année
+# datas/horaire/<polluant>/<AAAA-MM> (extract_data.fetch_pollution_hourly)
+#   -> data_clean/horaire/<polluant>/<AAAA-MM>.parquet : station_id, commune_id, heure (UTC), <polluant>_value
+# ~24x le volume journalier : jamais chargé en entier (un mois à la fois au nettoyage, une année à l'évaluation)
+# Les normes à fenêtre "horaire" de normes.py (NO2 200 µg/m³ 18 h/an, seuils d'information et d'alerte)
+# sont comptées sur les vraies valeurs horaires : matrice stations x heures de l'année (float32),
+# dépassements et heures consécutives (heures_consecutives) calculés en numpy
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+import storage
+import normes
+import episodes
+import raw_store
+import dimensions
+import extract_data
+import process_data
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+# Colonnes utiles des mesures horaires (heure UTC : pas d'heure en double au changement d'heure)
+hourly_columns = [
+    'code_commune',
+    'nom_commune',
+    'code_station',
+    'nom_station',
+    'valeur',
+    'date_heure_tu',
+]
+
+
+def hourly_dir():
+    return os.path.join(storage.clean_dir, "horaire")
+
+
+def polluant_dir(polluant):
+    return os.path.join(hourly_dir(), polluant)
+
+
+# Index des mois nettoyés : {polluant: {mois: nb_lignes}}
+# (écrit en dernier : c'est aussi la sortie de l'étape process_hourly du pipeline)
+def index_path():
+    return os.path.join(hourly_dir(), "index.json")
+
+
+def load_index():
+    if not os.path.exists(index_path()):
+        return {}
+    with open(index_path(), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index(index):
+    instrumentation.write_atomic(index_path(), json.dumps(index, indent=4))
+
+
+#####################################################################################
+#                               NETTOYAGE (UN MOIS À LA FOIS)
+#####################################################################################
+
+# Même masque que process_data.clean_pollution_chunk, mais l'heure est gardée ("2024-05-03T14:00:00Z")
+def clean_hourly_chunk(chunk, value_col):
+    values = pd.to_numeric(chunk['valeur'], errors='coerce').to_numpy(dtype='float64')
+    hours = pd.to_datetime(chunk['date_heure_tu'].str.slice(0, 13), format="%Y-%m-%dT%H", errors='coerce').to_numpy()
+    keep = (values >= process_data.valeur_min) & (values < process_data.valeur_max) & ~np.isnat(hours)
+
+    commune_id = dimensions.commune_ids(chunk['code_commune'].to_numpy()[keep], chunk['nom_commune'].to_numpy()[keep])
+    station_id = dimensions.station_ids(chunk['code_station'].to_numpy()[keep], chunk['nom_station'].to_numpy()[keep], commune_id)
+    return pd.DataFrame({
+        'station_id': station_id,
+        'commune_id': commune_id,
+        'heure': hours[keep],
+        value_col: values[keep].astype(np.float32),
+    })
+
+
+# Un mois brut -> sa table, lue par paquets de process_data.chunk_size records
+def process_month(polluant, month):
+    value_col = storage.value_column(polluant)
+    chunks = [clean_hourly_chunk(chunk, value_col)
+              for chunk in process_data.iter_raw_chunks(extract_data.hourly_dataset(polluant, month), hourly_columns)]
+    df = pd.concat(chunks, ignore_index=True)
+    df = (df.sort_values(['station_id', 'heure'], kind='stable')
+            .drop_duplicates(['station_id', 'heure'], keep='last')
+            .reset_index(drop=True))
+    storage.save_table(df, month, directory=polluant_dir(polluant), csv=False)
+    return len(df)
+
+
+def remove_month(polluant, month):
+    for fmt in ("parquet", "csv"):
+        path = storage.table_path(month, fmt, polluant_dir(polluant))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Étape "process_hourly" : seuls les mois dont le fichier brut est plus récent que la table sont retraités
+def process_hourly(incremental=True):
+    logger.info("Processing hourly data...")
+    index = load_index() if incremental else {}
+    raw_index = extract_data.load_hourly_index()
+    for polluant, months in raw_index.items():
+        done = index.setdefault(polluant, {})
+        processed = 0
+        for month in sorted(months):
+            raw_path = raw_store.find_raw(extract_data.hourly_dataset(polluant, month))
+            if raw_path is None:
+                continue
+            table = storage.table_path(month, directory=polluant_dir(polluant))
+            if month in done and os.path.exists(table) and os.path.getmtime(table) >= os.path.getmtime(raw_path):
+                continue
+            done[month] = process_month(polluant, month)
+            processed += 1
+        for month in sorted(set(done) - set(months)):
+            remove_month(polluant, month)
+            del done[month]
+        logger.info("%s : %d mois horaires traités, %d mois, %d mesures au total", polluant, processed,
+                    len(done), sum(done.values()))
+    save_index(index)
+
+
+#####################################################################################
+#                               NORMES HORAIRES
+#####################################################################################
+
+def hourly_norms(polluant):
+    return [norme for norme in normes.normes_polluant(polluant) if norme["fenetre"] == "horaire"]
+
+
+def load_months(polluant, months):
+    frames = [storage.load_table(month, directory=polluant_dir(polluant)) for month in months]
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+# Matrice stations x heures d'une année, avec `margin` heures de l'année précédente et de la suivante
+# (un épisode de plusieurs heures à cheval sur deux années compte dans chacune pour ses heures)
+# Retourne (station_ids, matrice) ; NaN = heure sans mesure
+def year_matrix(polluant, year, months, margin=0):
+    wanted = [m for m in months if m.startswith(f"{year}-")]
+    if margin:
+        wanted = [m for m in [f"{year - 1}-12"] if m in months] + wanted + [m for m in [f"{year + 1}-01"] if m in months]
+    df = load_months(polluant, wanted)
+    start = np.datetime64(f"{year}-01-01T00", "h")
+    hours = int((np.datetime64(f"{year + 1}-01-01T00", "h") - start).astype(np.int64))
+    if df is None:
+        return np.empty(0, dtype=np.int32), np.empty((0, hours + 2 * margin), dtype=np.float32)
+
+    idx = (df['heure'].to_numpy().astype("datetime64[h]") - (start - margin)).astype(np.int64)
+    keep = (idx >= 0) & (idx < hours + 2 * margin)
+    station_ids, rows = np.unique(df['station_id'].to_numpy()[keep], return_inverse=True)
+    matrix = np.full((len(station_ids), hours + 2 * margin), np.nan, dtype=np.float32)
+    matrix[rows, idx[keep]] = df[storage.value_column(polluant)].to_numpy()[keep]
+    return station_ids.astype(np.int32), matrix
+
+
+# Heures de l'année (hors marge) au-dessus du seuil, dans des séries d'au moins min_hours heures consécutives
+def exceedance_hours(matrix, threshold, min_hours=1, margin=0):
+    last = matrix.shape[1] - margin - 1
+    if min_hours <= 1:
+        return (matrix[:, margin:last + 1] > threshold).sum(axis=1)
+    rows, start_idx, end_idx, _, _ = episodes.find_runs_matrix(matrix, threshold, min_hours)
+    overlap = np.minimum(end_idx, last) - np.maximum(start_idx, margin) + 1
+    return np.bincount(rows, weights=np.clip(overlap, 0, None), minlength=matrix.shape[0]).astype(np.int64)
+
+
+# Une ligne par (norme horaire, station, année) avec au moins un dépassement, colonnes de normes.evaluate_norms
+# + nb_heures_mesurees et valeur_max (maximum horaire de l'année)
+def evaluate_hourly_norms():
+    index = load_index()
+    station_communes = dimensions.station_communes()
+    results = []
+    for polluant, months in index.items():
+        norms = hourly_norms(polluant)
+        if not norms or not months:
+            continue
+        margin = max(norme.get("heures_consecutives", 1) for norme in norms) - 1
+        for year in sorted({int(month[:4]) for month in months}):
+            station_ids, matrix = year_matrix(polluant, year, months, margin)
+            core = matrix[:, margin:matrix.shape[1] - margin]
+            measured = (~np.isnan(core)).sum(axis=1)
+            present = measured > 0
+            if not present.any():
+                continue
+            peaks = np.full(len(station_ids), np.nan, dtype=np.float32)
+            peaks[present] = np.nanmax(core[present], axis=1)
+            for norme in norms:
+                counts = exceedance_hours(matrix, norme["valeur"], norme.get("heures_consecutives", 1), margin)
+                over = counts > 0
+                results.append(pd.DataFrame({
+                    'polluant': polluant,
+                    'commune_id': station_communes[station_ids[over]],
+                    'station_id': station_ids[over],
+                    'annee': np.int16(year),
+                    'norme_id': norme["id"],
+                    'nb_depassements': counts[over].astype(np.int32),
+                    'nb_heures_mesurees': measured[over].astype(np.int32),
+                    'valeur_max': peaks[over],
+                }))
+            del matrix, core
+
+    columns = list(normes.empty_alerts().columns) + ['nb_heures_mesurees', 'valeur_max']
+    if not results:
+        return pd.DataFrame(columns=columns)
+    alerts = pd.concat(results, ignore_index=True)
+    registry = pd.DataFrame(normes.NORMES)[['id', 'norme', 'valeur', 'fenetre', 'depassements_autorises']]
+    alerts = alerts.merge(registry, left_on='norme_id', right_on='id', how='left').drop(columns='id')
+    alerts['non_conforme'] = alerts['nb_depassements'] > alerts['depassements_autorises'].fillna(0)
+    return (alerts[columns].sort_values(['polluant', 'norme_id', 'commune_id', 'station_id', 'annee'])
+            .reset_index(drop=True))
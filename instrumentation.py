@@ -0,0 +1,374 @@
+# instrumentation.py
+# Mesures par étape du pipeline : temps mur / CPU, pic mémoire, lignes lues / écrites,
+# octets lus / écrits, latence de chaque requête HTTP.
+# Rapport JSON + fichier texte Prometheus (node_exporter textfile collector),
+# profilage optionnel de chaque étape (cProfile ou échantillonnage de la pile)
+import os
+import sys
+import json
+import time
+import pstats
+import logging
+import tempfile
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+try:
+    import resource  # absent sous Windows : pas de pic RSS
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+metrics_dir = os.path.join(script_dir, "metrics")
+
+# Période d'échantillonnage du profileur "sample" (secondes)
+sample_interval = 0.005
+
+# Nombre de fonctions affichées dans le log à la fin d'une étape profilée
+profile_top = 15
+
+# Compteurs connus (dans cet ordre dans les rapports)
+# rows_in / rows_out : lignes des tables de l'étape, sans les tables de dimensions (dimensions.py)
+# bytes_read / bytes_written : tous les fichiers lus / écrits, dimensions comprises
+counter_names = ["rows_in", "rows_out", "bytes_read", "bytes_written"]
+row_counters = {"rows_in", "rows_out"}
+
+# Mesures de l'étape en cours, par thread (les étapes tournent en parallèle)
+_current = threading.local()
+
+
+def setup_logging(level="INFO"):
+    logging.basicConfig(
+        level=getattr(logging, str(level).upper(), logging.INFO),
+        format="%(asctime)s %(levelname)-7s %(name)-15s %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+
+#####################################################################################
+#                               COMPTEURS
+#####################################################################################
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.counters = Counter()
+        self.http = []  # (secondes, code HTTP, octets)
+        self.lock = threading.Lock()  # les requêtes d'une étape partent de plusieurs threads
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_mb = None
+        self.profile_file = None
+
+    def add(self, key, value):
+        with self.lock:
+            self.counters[key] += value
+
+    def record_http(self, seconds, status, size):
+        with self.lock:
+            self.http.append((seconds, status, size))
+
+    def http_summary(self):
+        latencies = sorted(seconds for seconds, _, _ in self.http)
+        if not latencies:
+            return {"requests": 0}
+        return {
+            "requests": len(latencies),
+            "errors": sum(1 for _, status, _ in self.http if status >= 400),
+            "bytes": sum(size for _, _, size in self.http),
+            "seconds_sum": sum(latencies),
+            "p50": quantile(latencies, 0.5),
+            "p95": quantile(latencies, 0.95),
+            "max": latencies[-1],
+        }
+
+    def to_dict(self):
+        result = {"wall_s": self.wall_s, "cpu_s": self.cpu_s, "peak_mb": self.peak_mb}
+        result.update({key: self.counters.get(key, 0) for key in counter_names})
+        result["http"] = self.http_summary()
+        if self.profile_file:
+            result["profile"] = self.profile_file
+        return result
+
+
+def quantile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def current():
+    return getattr(_current, "metrics", None)
+
+
+# Ajouter `value` au compteur `key` de l'étape en cours (sans effet hors étape ou si désactivé)
+def count(key, value):
+    metrics = current()
+    if metrics is not None and not (key in row_counters and getattr(_current, "rows_uncounted", False)):
+        metrics.add(key, value)
+
+
+# Lectures / écritures annexes de l'étape (tables de dimensions) : hors rows_in / rows_out
+@contextlib.contextmanager
+def rows_uncounted():
+    previous = getattr(_current, "rows_uncounted", False)
+    _current.rows_uncounted = True
+    try:
+        yield
+    finally:
+        _current.rows_uncounted = previous
+
+
+def count_file(key, path):
+    if current() is not None and path and os.path.exists(path):
+        count(key, os.path.getsize(path))
+
+
+# Les mesures sont par thread : une fonction lancée dans un autre thread par l'étape
+# (ex : executor.submit(instrumentation.bind(func))) compte pour l'étape qui l'a créée
+def bind(func):
+    metrics = current()
+
+    def bound(*args, **kwargs):
+        previous = current()
+        _current.metrics = metrics
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.metrics = previous
+    return bound
+
+
+# Hook requests attaché à l'étape en cours : latence = temps jusqu'à la réception des en-têtes
+# Taille : corps lu ici (requests le lirait de toute façon juste après), sauf en streaming
+# où c'est l'appelant qui compte les octets lus (Content-Length, souvent absent, sinon 0)
+def http_hook():
+    metrics = current()
+    if metrics is None:
+        return None
+
+    def hook(response, *args, **kwargs):
+        if kwargs.get("stream"):
+            metrics.record_http(response.elapsed.total_seconds(), response.status_code,
+                                int(response.headers.get("Content-Length") or 0))
+            return
+        size = len(response.content)
+        metrics.record_http(response.elapsed.total_seconds(), response.status_code, size)
+        metrics.add("bytes_read", size)
+    return hook
+
+
+# Argument `hooks` de requests.get / Session.get
+def http_hooks():
+    hook = http_hook()
+    return {"response": [hook]} if hook is not None else {}
+
+
+#####################################################################################
+#                               PROFILAGE
+#####################################################################################
+
+# Profileur par échantillonnage : relève la pile du thread de l'étape toutes les `interval` s
+# (surcoût faible et constant, contrairement à cProfile) ; sortie en "collapsed stacks"
+# (une ligne "f1;f2;f3 n" par pile), lisible par speedscope ou flamegraph.pl
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            # on remonte jusqu'à run_stage (exclu) : seul le code de l'étape compte
+            while frame is not None and frame.f_code is not run_stage.__code__:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    # Fonctions les plus présentes dans les échantillons (temps inclusif)
+    def top(self, n):
+        inclusive = Counter()
+        for stack, hits in self.stacks.items():
+            for function in set(stack.split(";")):
+                inclusive[function] += hits
+        total = sum(self.stacks.values()) or 1
+        return [(function, hits / total) for function, hits in inclusive.most_common(n)]
+
+
+def start_profiler(profile):
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if profile == "sample":
+        sampler = StackSampler(threading.get_ident(), sample_interval)
+        sampler.start()
+        return sampler
+    return None
+
+
+def stop_profiler(profiler, name):
+    if profiler is None:
+        return None
+    profiles_dir = os.path.join(metrics_dir, "profiles")
+    os.makedirs(profiles_dir, exist_ok=True)
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = os.path.join(profiles_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+        if logger.isEnabledFor(logging.INFO):
+            stats = pstats.Stats(profiler).sort_stats("cumulative")
+            top = [(f"{func[2]} ({os.path.basename(func[0])}:{func[1]})", stat[3])
+                   for func, stat in stats.stats.items() if func[0] != __file__]
+            top.sort(key=lambda item: item[1], reverse=True)
+            lines = "\n".join(f"    {cumtime:8.3f}s  {function}" for function, cumtime in top[:profile_top])
+            logger.info("Profil %s (cProfile, temps cumulé) :\n%s", name, lines)
+    else:
+        profiler.stop()
+        path = os.path.join(profiles_dir, f"{name}.collapsed")
+        profiler.save(path)
+        lines = "\n".join(f"    {share:6.1%}  {function}" for function, share in profiler.top(profile_top))
+        logger.info("Profil %s (échantillonnage, part du temps) :\n%s", name, lines)
+    return path
+
+
+#####################################################################################
+#                               EXÉCUTION D'UNE ÉTAPE
+#####################################################################################
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # octets sous macOS, Ko ailleurs
+
+
+# Exécuter func() en mesurant l'étape ; retourne le dict des mesures
+# collect=False : aucune mesure (hooks inactifs), seulement la durée
+# memory : "rss" = plus haut niveau RSS du processus à la fin de l'étape (gratuit, mais cumulé
+#          sur les étapes du même processus) ; "tracemalloc" = pic des allocations de l'étape
+#          (exact en séquentiel, ralentit le code Python)
+# profile : None, "cprofile" ou "sample"
+def run_stage(name, func, collect=True, memory="rss", profile=None):
+    metrics = StageMetrics(name)
+    _current.metrics = metrics if collect else None
+
+    tracing = collect and memory == "tracemalloc"
+    if tracing:
+        tracemalloc.start()
+    profiler = start_profiler(profile) if collect else None
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        func()
+    finally:
+        metrics.wall_s = time.perf_counter() - wall
+        metrics.cpu_s = time.thread_time() - cpu
+        metrics.profile_file = stop_profiler(profiler, name)
+        if tracing:
+            metrics.peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        elif collect:
+            metrics.peak_mb = peak_rss_mb()
+        _current.metrics = None
+    return metrics.to_dict()
+
+
+#####################################################################################
+#                               RAPPORTS
+#####################################################################################
+
+# metrics/pipeline_metrics.json : un run complet (statut + mesures de chaque étape)
+def write_json_report(results, status, total, path=None):
+    path = path or os.path.join(metrics_dir, "pipeline_metrics.json")
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "total_wall_s": total,
+        "stages": {name: dict(results.get(name, {}), status=state) for name, state in status.items()},
+    }
+    write_atomic(path, json.dumps(report, ensure_ascii=False, indent=4))
+    return path
+
+
+# metrics/pipeline.prom : format texte Prometheus (une série par étape et par mesure)
+def write_prometheus_report(results, status, total, path=None):
+    path = path or os.path.join(metrics_dir, "pipeline.prom")
+    gauges = [
+        ("wall_seconds", "Durée murale de l'étape", lambda r: r.get("wall_s")),
+        ("cpu_seconds", "Temps CPU du thread de l'étape", lambda r: r.get("cpu_s")),
+        ("peak_memory_bytes", "Pic mémoire (RSS ou tracemalloc)",
+         lambda r: r["peak_mb"] * 1024 * 1024 if r.get("peak_mb") is not None else None),
+    ] + [(name, f"Compteur {name} de l'étape", lambda r, name=name: r.get(name)) for name in counter_names] + [
+        ("http_requests", "Requêtes HTTP de l'étape", lambda r: r.get("http", {}).get("requests")),
+        ("http_errors", "Réponses HTTP >= 400", lambda r: r.get("http", {}).get("errors")),
+        ("http_request_seconds_sum", "Somme des latences HTTP", lambda r: r.get("http", {}).get("seconds_sum")),
+    ]
+
+    lines = []
+    for metric, help_text, getter in gauges:
+        lines += [f"# HELP pipeline_stage_{metric} {help_text}", f"# TYPE pipeline_stage_{metric} gauge"]
+        for name, r in results.items():
+            value = getter(r)
+            if value is not None:
+                lines.append(f'pipeline_stage_{metric}{{stage="{name}"}} {value}')
+
+    lines += ["# HELP pipeline_stage_http_request_seconds Latence HTTP par quantile",
+              "# TYPE pipeline_stage_http_request_seconds gauge"]
+    for name, r in results.items():
+        http = r.get("http", {})
+        for q, key in [("0.5", "p50"), ("0.95", "p95"), ("1", "max")]:
+            if key in http:
+                lines.append(f'pipeline_stage_http_request_seconds{{stage="{name}",quantile="{q}"}} {http[key]}')
+
+    lines += ["# HELP pipeline_stage_success 1 si l'étape a réussi ou était à jour, 0 sinon",
+              "# TYPE pipeline_stage_success gauge"]
+    for name, state in status.items():
+        if state != "non sélectionné":
+            lines.append(f'pipeline_stage_success{{stage="{name}"}} {0 if state in ("échec", "bloqué") else 1}')
+
+    lines += ["# HELP pipeline_wall_seconds Durée murale du run", "# TYPE pipeline_wall_seconds gauge",
+              f"pipeline_wall_seconds {total}",
+              "# HELP pipeline_last_run_timestamp_seconds Fin du dernier run", "# TYPE pipeline_last_run_timestamp_seconds gauge",
+              f"pipeline_last_run_timestamp_seconds {time.time():.0f}"]
+    write_atomic(path, "\n".join(lines) + "\n")
+    return path
+
+
+# Le collecteur textfile peut lire le fichier à tout moment : écriture puis renommage
+# (fichier temporaire unique : deux runs simultanés n'écrivent jamais dans le même)
+# data : texte (UTF-8) ou octets ; utilisé aussi pour les index, l'état des alertes et le cache (cache.py)
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        os.chmod(tmp_path, 0o644)  # mkstemp crée en 0600 : le collecteur tourne sous un autre utilisateur
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
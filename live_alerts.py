@@ -0,0 +1,437 @@
+# live_alerts.py
+# Alertes en continu : chaque nouvelle moyenne journalière est évaluée dès sa publication par l'API airpl
+# (analyse.py recharge et reparcourt tout l'historique, ici seul le nouveau jour est traité)
+# Un service asyncio interroge extract_data.pollution_url toutes les `interval` secondes, un polluant par requête,
+# et ne garde qu'un état par (norme, station) : dernier jour vu, début / longueur / pic de l'épisode en cours.
+# Un jour de plus se traite en O(1) ; mêmes règles que episodes.detect_episodes (valeur > seuil,
+# un jour sans mesure casse l'épisode). L'alerte est émise dès que l'épisode atteint jours_consecutifs jours,
+# un événement "fin" quand il s'arrête.
+# État sauvegardé dans data_clean/live/state.json après chaque interrogation (reprise après un arrêt),
+# événements ajoutés à data_clean/live/alerts.ndjson.
+# Seuls les jours terminés (avant le jour courant de l'horloge) sont évalués : la moyenne d'un jour en cours
+# n'est pas encore la moyenne journalière. Un jour déjà évalué n'est pas réévalué (mesure corrigée après coup) :
+# le pipeline batch reste la référence.
+#
+#   python live_alerts.py run [--interval 300]
+#   python live_alerts.py record enregistrement.json [--days 30]
+#   python live_alerts.py replay enregistrement.json [--speed 1]   (serveur local qui rejoue l'enregistrement)
+import os
+import sys
+import json
+import time
+import signal
+import bisect
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import storage
+import normes
+import raw_store
+import extract_data
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+# Normes surveillées (celles des alertes de analyse.py)
+watched = ["no2_3jours", "pm10_alerte"]
+
+# Secondes entre deux interrogations de l'API
+interval = 300
+
+# Jours redemandés à chaque interrogation (stations qui publient en retard)
+lookback_days = 3
+
+# Historique lu au premier démarrage (épisodes déjà en cours)
+initial_days = 7
+
+# Paramètres de l'API airpl (voir extract_data.fetch_pollution_chunk)
+polluant_param = "code_configuration_de_mesure__code_point_de_prelevement__code_polluant"
+departement_param = "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in"
+range_param = "date_heure_tu__range"
+
+
+def live_dir():
+    return os.path.join(storage.clean_dir, "live")
+
+
+def state_path():
+    return os.path.join(live_dir(), "state.json")
+
+
+def events_path():
+    return os.path.join(live_dir(), "alerts.ndjson")
+
+
+#####################################################################################
+#                               ÉTAT PAR STATION
+#####################################################################################
+
+# État sur disque : {"watermarks": {polluant: jour}, "runs": {norme: {code_station: run}},
+#                    "stations": {code_station: {"nom_station", "code_commune", "nom_commune"}}}
+# Jours en ordinaux (date.toordinal()) ; run : {"last", "start", "length", "peak", "alerted"}
+def empty_state():
+    return {"watermarks": {}, "runs": {}, "stations": {}}
+
+
+def load_state():
+    try:
+        with open(state_path(), encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return empty_state()
+    except ValueError:
+        logger.warning("%s illisible, état des épisodes repris de zéro", state_path())
+        return empty_state()
+    return dict(empty_state(), **state)
+
+
+def save_state(state):
+    instrumentation.write_atomic(state_path(), json.dumps(state))
+
+
+def new_run():
+    return {"last": None, "start": None, "length": 0, "peak": None, "alerted": False}
+
+
+# Ajouter le jour `day` (postérieur à run["last"]) à l'épisode d'une station
+# Retourne les événements : ("fin", épisode terminé) puis ("alerte", épisode qui atteint min_days)
+def advance(run, day, value, threshold, min_days):
+    events = []
+    above = value > threshold
+    consecutive = run["last"] is not None and day == run["last"] + 1
+    if run["length"] and not (above and consecutive):
+        if run["alerted"]:
+            events.append(("fin", dict(run)))
+        run.update(start=None, length=0, peak=None, alerted=False)
+    if above:
+        if run["length"]:
+            run["length"] += 1
+            run["peak"] = max(run["peak"], value)
+        else:
+            run.update(start=day, length=1, peak=value)
+        if run["length"] >= min_days and not run["alerted"]:
+            run["alerted"] = True
+            events.append(("alerte", dict(run, last=day)))
+    run["last"] = day
+    return events
+
+
+#####################################################################################
+#                               MESURES
+#####################################################################################
+
+# Moyenne par (station, jour local) des records reçus, triée par jour
+# (mêmes valeurs rejetées que process_data.clean_pollution_chunk)
+def daily_values(records):
+    import process_data
+
+    sums = {}
+    for record in records:
+        try:
+            value = float(record.get("valeur"))
+            day = date.fromisoformat(record["date_heure_local"][:10]).toordinal()
+        except (TypeError, ValueError, KeyError):
+            continue
+        if not process_data.valeur_min <= value < process_data.valeur_max or not record.get("code_station"):
+            continue
+        key = (record["code_station"], day)
+        total, n = sums.get(key, (0.0, 0))
+        sums[key] = (total + value, n + 1)
+    return sorted(((day, station, total / n) for (station, day), (total, n) in sums.items()))
+
+
+def station_info(record):
+    return {field: record.get(field) for field in ("nom_station", "code_commune", "nom_commune")}
+
+
+# Événement publié (une ligne de alerts.ndjson)
+def make_event(kind, norme, code_station, run, station):
+    return {
+        "type": kind,
+        "norme": norme["id"],
+        "polluant": norme["polluant"],
+        "seuil": norme["valeur"],
+        "jours_consecutifs": norme["jours_consecutifs"],
+        "code_station": code_station,
+        **station,
+        "date_debut": date.fromordinal(run["start"]).isoformat(),
+        "date_fin": date.fromordinal(run["last"]).isoformat(),
+        "nb_jours": run["length"],
+        "valeur_max": run["peak"],
+        "emis_le": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def log_event(event):
+    if event["type"] == "alerte":
+        logger.warning("ALERTE %s %s : %s (%s), %d jour(s) > %s depuis le %s, max %.1f", event["polluant"],
+                       event["norme"], event["nom_station"], event["nom_commune"], event["nb_jours"],
+                       event["seuil"], event["date_debut"], event["valeur_max"])
+    else:
+        logger.info("Fin d'épisode %s %s : %s, %d jours du %s au %s", event["polluant"], event["norme"],
+                    event["nom_station"], event["nb_jours"], event["date_debut"], event["date_fin"])
+
+
+def append_event(event):
+    os.makedirs(live_dir(), exist_ok=True)
+    with open(events_path(), "a", encoding="utf-8") as f:
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+#####################################################################################
+#                               SERVICE
+#####################################################################################
+
+class AlertService:
+    # handlers : fonctions appelées pour chaque événement (coroutines acceptées)
+    # clock : heure courante (celle du serveur de rejeu en test)
+    def __init__(self, norms=None, handlers=None, clock=None, session=None):
+        self.norms = [normes.get_norme(norme_id) for norme_id in (norms or watched)]
+        self.handlers = [log_event, append_event] if handlers is None else handlers
+        self.clock = clock or datetime.now
+        self.session = session or extract_data.create_session(pool_size=len(self.norms))
+        self.state = load_state()
+        self.polls = 0
+
+    def polluants(self):
+        return sorted({norme["polluant"] for norme in self.norms})
+
+    # Fenêtre demandée : depuis le dernier jour reçu (moins lookback_days), ou initial_days au premier passage
+    def date_range(self, polluant):
+        end = self.clock()
+        watermark = self.state["watermarks"].get(polluant)
+        start = date.fromordinal(watermark) if watermark else end.date() - timedelta(days=initial_days)
+        start = datetime.combine(start - timedelta(days=lookback_days), datetime.min.time())
+        return start, end
+
+    def fetch(self, polluant):
+        start, end = self.date_range(polluant)
+        records = extract_data.fetch_pollution_chunk(self.session, extract_data.polluants[polluant],
+                                                     ",".join(extract_data.departements) + ",", start, end)
+        return extract_data.keep_stations(records)
+
+    # Nouvelles moyennes journalières d'un polluant -> événements (jours déjà vus par la station ignorés)
+    # Le jour courant est laissé de côté : ses mesures horaires sont redemandées à l'interrogation suivante
+    def evaluate(self, polluant, records):
+        events = []
+        norms = [norme for norme in self.norms if norme["polluant"] == polluant]
+        stations = self.state["stations"]
+        for record in records:
+            if record.get("code_station") and record["code_station"] not in stations:
+                stations[record["code_station"]] = station_info(record)
+        today = self.clock().date().toordinal()
+        values = [value for value in daily_values(records) if value[0] < today]
+        for norme in norms:
+            runs = self.state["runs"].setdefault(norme["id"], {})
+            for day, code_station, value in values:
+                run = runs.get(code_station)
+                if run is None:
+                    run = runs[code_station] = new_run()
+                elif day <= run["last"]:
+                    continue
+                for kind, snapshot in advance(run, day, value, norme["valeur"], norme["jours_consecutifs"]):
+                    events.append(make_event(kind, norme, code_station, snapshot, self.state["stations"][code_station]))
+        if values:
+            self.state["watermarks"][polluant] = max(self.state["watermarks"].get(polluant) or 0, values[-1][0])
+        return events
+
+    async def publish(self, event):
+        for handler in self.handlers:
+            try:
+                result = handler(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error("Événement %s %s non transmis par %s : %r", event["type"], event["norme"],
+                             getattr(handler, "__name__", handler), e)
+
+    # Une interrogation : tous les polluants en parallèle (requests dans des threads), puis point de reprise
+    async def poll(self):
+        polluants = self.polluants()
+        results = await asyncio.gather(*(asyncio.to_thread(self.fetch, p) for p in polluants), return_exceptions=True)
+        events = []
+        for polluant, records in zip(polluants, results):
+            if isinstance(records, Exception):
+                logger.warning("%s : interrogation de l'API en échec (%r), nouvel essai à la prochaine interrogation", polluant, records)
+                continue
+            events += self.evaluate(polluant, records)
+        for event in events:
+            await self.publish(event)
+        save_state(self.state)
+        self.polls += 1
+        logger.debug("Interrogation %d : %d événements", self.polls, len(events))
+        return events
+
+    # Boucle jusqu'à stop (asyncio.Event), max_polls interrogations ou until() vrai
+    async def run(self, every=None, stop=None, max_polls=None, until=None):
+        every = interval if every is None else every
+        stop = stop or asyncio.Event()
+        logger.info("Alertes en continu (%s), interrogation toutes les %ss",
+                    ", ".join(norme["id"] for norme in self.norms), every)
+        while not stop.is_set():
+            await self.poll()
+            if (max_polls is not None and self.polls >= max_polls) or (until is not None and until()):
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), every)
+            except asyncio.TimeoutError:
+                pass
+
+
+#####################################################################################
+#                               SERVEUR DE REJEU
+#####################################################################################
+
+# Records enregistrés (réponse JSON de l'API, ou fichier de datas/ en JSON lines)
+def load_recording(path):
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return extract_data.response_records(json.load(f))
+    with raw_store.open_raw(path, "rb") as f:
+        return [raw_store.loads(line) for line in f if line.strip()]
+
+
+# Horloge simulée : un jour de mesures publié toutes les `speed` secondes à partir du premier jour enregistré,
+# heure par heure (à midi, les mesures de la matinée sont publiées)
+# (speed None : l'horloge n'avance que par advance(), pour les tests pas à pas)
+class Replay:
+    def __init__(self, records, speed=1.0):
+        self.records, self.hours = {}, {}
+        for record in records:
+            if record.get("date_heure_tu"):
+                self.records.setdefault(record.get("code_polluant"), []).append(record)
+        for code, items in self.records.items():
+            items.sort(key=lambda record: record["date_heure_tu"])
+            self.hours[code] = [record["date_heure_tu"][:13] for record in items]
+        days = [hour[:10] for items in self.hours.values() for hour in (items[0], items[-1])]
+        self.first_day = date.fromisoformat(min(days)) if days else date.today()
+        self.last_day = date.fromisoformat(max(days)) if days else date.today()
+        self.speed = speed
+        self.offset = timedelta(0)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Heure courante : les mesures des heures précédentes sont publiées (minuit du lendemain du premier jour au départ)
+    def now(self):
+        with self.lock:
+            elapsed = timedelta(days=(time.monotonic() - self.started) / self.speed) if self.speed else timedelta(0)
+            return datetime.combine(self.first_day + timedelta(days=1), datetime.min.time()) + self.offset + elapsed
+
+    def today(self):
+        return self.now().date()
+
+    def advance(self, days=1, hours=0):
+        with self.lock:
+            self.offset += timedelta(days=days, hours=hours)
+
+    def finished(self):
+        return self.today() > self.last_day + timedelta(days=1)
+
+    # Réponse à une requête de fetch_pollution_chunk (bornes "AAAA-MM-JJ HH:MM:SS", fin incluse)
+    def select(self, code, departements, start, end):
+        hours = self.hours.get(code, [])
+        end_hour = f"{end[:10]}T{end[11:13] or '23'}"
+        first = bisect.bisect_left(hours, start[:10])
+        last = min(bisect.bisect_right(hours, end_hour), bisect.bisect_left(hours, f"{self.now():%Y-%m-%dT%H}"))
+        return [record for record in self.records.get(code, [])[first:last]
+                if not departements or str(record.get("code_commune", ""))[:2] in departements]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        code = query.get(polluant_param, [None])[0]
+        departements = {dep for dep in query.get(departement_param, [""])[0].split(",") if dep}
+        start, _, end = query.get(range_param, [","])[0].partition(",")
+        body = json.dumps({"results": self.server.replay.select(code, departements, start, end)}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serveur local (thread) ; retourne (server, url) à mettre dans extract_data.pollution_url
+def start_replay_server(replay):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    server.replay = replay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+#####################################################################################
+#                               LIGNE DE COMMANDE
+#####################################################################################
+
+async def serve(service, every, until=None):
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows : Ctrl+C interrompt la boucle (l'état est déjà sauvegardé après chaque interrogation)
+    await service.run(every=every, stop=stop, until=until)
+
+
+# Enregistrer les derniers jours de l'API pour les rejouer ensuite
+def save_recording(path, days):
+    session = extract_data.create_session()
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    records = []
+    for polluant in sorted({normes.get_norme(norme_id)["polluant"] for norme_id in watched}):
+        records += extract_data.fetch_pollution_chunk(session, extract_data.polluants[polluant],
+                                                      ",".join(extract_data.departements) + ",", start, end)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"results": records}, f, ensure_ascii=False)
+    logger.info("%d mesures enregistrées dans %s", len(records), path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Alertes pollution en continu (API airpl)")
+    parser.add_argument("--log-level", default="INFO", help="niveau de log (DEBUG, INFO, WARNING...)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="interroger l'API en continu")
+    run_parser.add_argument("--interval", type=float, default=interval, help="secondes entre deux interrogations")
+    record_parser = subparsers.add_parser("record", help="enregistrer les derniers jours de mesures (JSON)")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--days", type=int, default=30)
+    replay_parser = subparsers.add_parser("replay", help="rejouer un enregistrement sur un serveur local")
+    replay_parser.add_argument("paths", nargs="+", help="enregistrements JSON ou fichiers de datas/")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="secondes par jour simulé")
+    replay_parser.add_argument("--interval", type=float, help="secondes entre deux interrogations (défaut : --speed)")
+    args = parser.parse_args(argv)
+    instrumentation.setup_logging(args.log_level)
+
+    if args.command == "record":
+        save_recording(args.path, args.days)
+        return 0
+    if args.command == "run":
+        asyncio.run(serve(AlertService(), args.interval))
+        return 0
+
+    replay = Replay([record for path in args.paths for record in load_recording(path)], speed=args.speed)
+    server, extract_data.pollution_url = start_replay_server(replay)
+    logger.info("Rejeu du %s au %s sur %s", replay.first_day, replay.last_day, extract_data.pollution_url)
+    try:
+        service = AlertService(clock=replay.now)
+        asyncio.run(serve(service, args.speed if args.interval is None else args.interval, until=replay.finished))
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# normes.py
+# Référentiel des normes de qualité de l'air + moteur d'évaluation de toutes les normes en une passe
+import numpy as np
+import pandas as pd
+import episodes
+import storage
+
+
+#####################################################################################
+#                               RÉFÉRENTIEL DES NORMES
+#####################################################################################
+
+# fenetre : "horaire", "journaliere" ou "annuelle" (période de moyenne de la norme)
+# jours_consecutifs : nb de jours consécutifs au-dessus du seuil pour compter un épisode
+# heures_consecutives (normes horaires) : nb d'heures consécutives au-dessus du seuil, évaluées par hourly.py
+# depassements_autorises : nb de dépassements tolérés par an (None = aucun)
+# categorie : "qualite", "limite", "information", "alerte" ou "recommandation"
+NORMES = [
+    {"id": "no2_annuel", "polluant": "NO2", "norme": "Objectif de qualité (annuel)", "valeur": 40,
+     "origine": "FR", "fenetre": "annuelle", "jours_consecutifs": 1, "depassements_autorises": None, "categorie": "qualite"},
+    {"id": "no2_limite_horaire", "polluant": "NO2", "norme": "Valeur limite horaire (18h/an)", "valeur": 200,
+     "origine": "UE", "fenetre": "horaire", "jours_consecutifs": 1, "heures_consecutives": 1, "depassements_autorises": 18, "categorie": "limite"},
+    {"id": "no2_information", "polluant": "NO2", "norme": "Seuil d’information", "valeur": 200,
+     "origine": "FR", "fenetre": "horaire", "jours_consecutifs": 1, "heures_consecutives": 1, "depassements_autorises": None, "categorie": "information"},
+    {"id": "no2_alerte", "polluant": "NO2", "norme": "Seuil d’alerte", "valeur": 400,
+     "origine": "UE/FR", "fenetre": "horaire", "jours_consecutifs": 1, "heures_consecutives": 3, "depassements_autorises": None, "categorie": "alerte"},
+    {"id": "no2_3jours", "polluant": "NO2", "norme": "Recommandation (3 jours consécutifs)", "valeur": 200,
+     "origine": "Interne", "fenetre": "journaliere", "jours_consecutifs": 3, "depassements_autorises": None, "categorie": "recommandation"},
+    {"id": "pm10_annuel", "polluant": "PM10", "norme": "Objectif de qualité (annuel)", "valeur": 30,
+     "origine": "FR", "fenetre": "annuelle", "jours_consecutifs": 1, "depassements_autorises": None, "categorie": "qualite"},
+    {"id": "pm10_limite_journaliere", "polluant": "PM10", "norme": "Valeur limite journalière (35j/an)", "valeur": 50,
+     "origine": "UE", "fenetre": "journaliere", "jours_consecutifs": 1, "depassements_autorises": 35, "categorie": "limite"},
+    {"id": "pm10_information", "polluant": "PM10", "norme": "Seuil d’information", "valeur": 50,
+     "origine": "FR", "fenetre": "journaliere", "jours_consecutifs": 1, "depassements_autorises": None, "categorie": "information"},
+    {"id": "pm10_alerte", "polluant": "PM10", "norme": "Seuil d’alerte", "valeur": 80,
+     "origine": "FR", "fenetre": "journaliere", "jours_consecutifs": 1, "depassements_autorises": None, "categorie": "alerte"},
+    {"id": "o3_alerte", "polluant": "O3", "norme": "Seuil d’alerte", "valeur": 240,
+     "origine": "FR", "fenetre": "horaire", "jours_consecutifs": 1, "heures_consecutives": 1, "depassements_autorises": None, "categorie": "alerte"},
+    {"id": "so2_alerte", "polluant": "SO2", "norme": "Seuil d’alerte", "valeur": 500,
+     "origine": "FR", "fenetre": "horaire", "jours_consecutifs": 1, "heures_consecutives": 3, "depassements_autorises": None, "categorie": "alerte"},
+]
+
+UNITE = "μg/m³"
+
+# Couleur des lignes de seuil sur les graphiques
+COULEURS = {
+    "qualite": "blue",
+    "limite": "purple",
+    "information": "orange",
+    "alerte": "red",
+    "recommandation": "green",
+}
+
+
+def get_norme(norme_id):
+    for norme in NORMES:
+        if norme["id"] == norme_id:
+            return norme
+    raise KeyError(f"Norme inconnue : {norme_id}")
+
+
+def normes_polluant(polluant):
+    return [norme for norme in NORMES if norme["polluant"] == polluant]
+
+
+# Seuils à tracer sur les graphiques : [(valeur, libellé, couleur)], une ligne par valeur
+def seuils_graphique(polluant):
+    seuils = {}
+    for norme in normes_polluant(polluant):
+        if norme["valeur"] not in seuils:
+            label = f"{norme['norme']} ({norme['valeur']})"
+            seuils[norme["valeur"]] = (norme["valeur"], label, COULEURS[norme["categorie"]])
+    return [seuils[val] for val in sorted(seuils)]
+
+
+#####################################################################################
+#                               MOTEUR D'ÉVALUATION
+#####################################################################################
+
+# frames : {"NO2": df_no2, "PM10": df_pm10, ...} avec les colonnes commune_id, station_id, date_local, <polluant>_value
+# Les mesures sont journalières : les normes horaires sont évaluées sur la moyenne journalière
+# (elles ne peuvent donc que sous-estimer les dépassements horaires ; avec Main.py --hourly,
+# analyse_normes les remplace par celles de hourly.py, calculées sur les mesures horaires)
+# Retourne une ligne par (norme, station, année) avec au moins un dépassement
+# (analyse_normes passe par database.evaluate_norms ; ce calcul en mémoire reste la référence
+# à laquelle la requête SQL est comparée dans tests/test_database.py)
+def evaluate_norms(frames):
+    # Format long commun à tous les polluants, puis une seule moyenne journalière
+    long_frames = []
+    for polluant, df in frames.items():
+        value_col = storage.value_column(polluant)
+        long_frames.append(pd.DataFrame({
+            'polluant': polluant,
+            'commune_id': df['commune_id'].astype('int32'),
+            'station_id': df['station_id'].astype('int32'),
+            'date_local': df['date_local'],
+            'valeur': df[value_col].astype('float64'),
+        }))
+    if not long_frames:
+        return empty_alerts()
+    measures = pd.concat(long_frames, ignore_index=True)
+    daily = episodes.daily_means(measures, 'valeur', group_cols=('polluant', 'commune_id', 'station_id'))
+    daily['annee'] = daily['date_local'].dt.year.astype('int16')
+
+    normes = [n for n in NORMES if n["polluant"] in frames]
+    polluants = daily['polluant'].to_numpy()
+    values = daily['valeur'].to_numpy()
+    keys = ['polluant', 'commune_id', 'station_id', 'annee']
+
+    # Normes journalières / horaires sur 1 jour : matrice (jours x normes) de dépassements,
+    # agrégée par station et par année dans le même groupby que la moyenne annuelle
+    daily_normes = [n for n in normes if n["fenetre"] != "annuelle" and n["jours_consecutifs"] == 1]
+    flags = daily[keys + ['valeur']].copy()
+    for norme in daily_normes:
+        flags[norme["id"]] = (polluants == norme["polluant"]) & (values > norme["valeur"])
+    aggregations = {norme["id"]: 'sum' for norme in daily_normes}
+    aggregations['valeur'] = 'mean'
+    yearly = flags.groupby(keys, sort=False).agg(aggregations)
+
+    results = [
+        yearly[[n["id"] for n in daily_normes]]
+        .melt(var_name='norme_id', value_name='nb_depassements', ignore_index=False)
+        .reset_index()
+    ]
+
+    # Normes sur plusieurs jours consécutifs : nb de jours dans des épisodes assez longs
+    station_ids = daily.groupby(['polluant', 'commune_id', 'station_id'], sort=False).ngroup().to_numpy()
+    days = daily['date_local'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    for norme in [n for n in normes if n["fenetre"] != "annuelle" and n["jours_consecutifs"] > 1]:
+        mask = polluants == norme["polluant"]
+        start_idx, _, lengths, _ = episodes.find_runs(
+            station_ids[mask], days[mask], values[mask], norme["valeur"], norme["jours_consecutifs"]
+        )
+        runs = daily.loc[mask, keys].iloc[start_idx].assign(nb_depassements=lengths)
+        runs = runs.groupby(keys, sort=False)['nb_depassements'].sum().reset_index()
+        results.append(runs.assign(norme_id=norme["id"]))
+
+    # Normes annuelles : moyenne annuelle au-dessus de la valeur = 1 dépassement
+    annual = yearly['valeur'].reset_index()
+    for norme in [n for n in normes if n["fenetre"] == "annuelle"]:
+        over = annual[(annual['polluant'] == norme["polluant"]) & (annual['valeur'] > norme["valeur"])]
+        results.append(over[keys].assign(nb_depassements=1, norme_id=norme["id"]))
+
+    alerts = pd.concat(results, ignore_index=True)
+    alerts = alerts[alerts['nb_depassements'] > 0]
+
+    # Ajouter le libellé de la norme et la tolérance annuelle
+    registry = pd.DataFrame(normes)[['id', 'norme', 'valeur', 'fenetre', 'depassements_autorises']]
+    alerts = alerts.merge(registry, left_on='norme_id', right_on='id', how='left').drop(columns='id')
+    allowed = alerts['depassements_autorises'].fillna(0)
+    alerts['non_conforme'] = alerts['nb_depassements'] > allowed
+    alerts['nb_depassements'] = alerts['nb_depassements'].astype('int32')
+
+    return alerts.sort_values(['polluant', 'norme_id', 'commune_id', 'station_id', 'annee']).reset_index(drop=True)
+
+
+def empty_alerts():
+    return pd.DataFrame(columns=[
+        'polluant', 'commune_id', 'station_id', 'annee', 'norme_id', 'nb_depassements',
+        'norme', 'valeur', 'fenetre', 'depassements_autorises', 'non_conforme',
+    ])
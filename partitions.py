@@ -0,0 +1,172 @@
+# partitions.py
+# Pipeline découpé en partitions : un département, ou un groupe de départements / de stations (autre région...)
+# Chaque partition a ses dossiers datas/partition=<nom>/ et data_clean/partition=<nom>/ et exécute
+# pipeline.partition_stages (fetch_pollution -> process_<polluant> -> rollup -> series -> analyses)
+# dans son propre processus. Les dimensions (dim_commune, dim_station) restent communes (data_clean/) :
+# les identifiants sont les mêmes dans toutes les partitions.
+# merge_partitions regroupe ensuite leurs tables dans data_clean/ pour les étapes globales
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import storage
+import raw_store
+import cache
+import pipeline
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               DÉFINITION DES PARTITIONS
+#####################################################################################
+
+# Une partition : {"departements": ["44"], "stations": ["FR23068", ...] (optionnel),
+#                  "pollution_url": "https://..." (optionnel, API d'une autre région)}
+
+# Une partition par département (ceux de extract_data par défaut)
+def by_departement(departements=None):
+    if departements is None:
+        import extract_data
+        departements = extract_data.departements
+    return {dep: {"departements": [dep]} for dep in departements}
+
+
+# Partitions lues dans un fichier JSON {nom: {...}}
+def load_definitions(path):
+    with open(path, encoding="utf-8") as f:
+        definitions = json.load(f)
+    if not isinstance(definitions, dict) or not definitions:
+        raise ValueError(f"{path} : objet JSON {{nom: partition}} attendu")
+    for name, spec in definitions.items():
+        if not spec.get("departements"):
+            raise ValueError(f"{path} : partition {name} sans départements")
+        if os.sep in name or name.startswith("."):
+            raise ValueError(f"{path} : nom de partition invalide : {name}")
+    return definitions
+
+
+#####################################################################################
+#                               EXÉCUTION D'UNE PARTITION
+#####################################################################################
+
+# Dossiers de la partition (roots : datas/, data_clean/, metrics/ et cache/ du processus principal)
+# (le cache est commun : ses clés dépendent du contenu des entrées, pas de la partition)
+def activate(name, spec, roots):
+    import extract_data
+
+    raw_root, clean_root, metrics_root, cache.cache_dir = roots
+    raw_store.raw_dir = os.path.join(raw_root, f"{storage.partition_prefix}{name}")
+    storage.shared_dir = clean_root
+    storage.clean_dir = storage.partition_dir(name, clean_root)
+    instrumentation.metrics_dir = os.path.join(metrics_root, f"{storage.partition_prefix}{name}")
+
+    extract_data.departements = list(spec["departements"])
+    extract_data.stations = spec.get("stations")
+    if spec.get("pollution_url"):
+        extract_data.pollution_url = spec["pollution_url"]
+
+
+# Sélection (--only, --from, sous-commande) restreinte aux étapes d'une partition
+def select_partition_stages(stages, only=None, from_stage=None, group=None):
+    names = {stage.name for stage in stages}
+    if from_stage is not None and from_stage not in names:
+        return []  # étape globale : rien à refaire dans les partitions
+    if only is not None:
+        only = [name for name in only if name in names]
+    return pipeline.select_stages(stages, only=only, from_stage=from_stage, group=group)
+
+
+# Exécuté dans un processus du pool : toutes les étapes de la partition, en threads
+def run_partition(name, spec, roots, start_date, end_date, incremental, selection, options):
+    instrumentation.setup_logging(options.pop("log_level"))  # (processus "spawn" : logging à reconfigurer)
+    activate(name, spec, roots)
+    logger.info("Partition %s : départements %s", name, ", ".join(spec["departements"]))
+
+    stages = [stage for stage in pipeline.build_stages(start_date, end_date, incremental)
+              if stage.name in pipeline.partition_stages]
+    stages = pipeline.build_graph(stages)
+    selected = select_partition_stages(stages, **selection)
+    status, _ = pipeline.run(stages, selected, **options)
+    return status
+
+
+# Toutes les partitions, une par processus (au plus max_workers à la fois)
+# Retourne {partition: {étape: statut}}
+def run_partitions(partitions, start_date, end_date, incremental=True, only=None, from_stage=None, group=None,
+                   force=False, max_workers=4, metrics=True, memory="rss", profile=None, log_level=None):
+    roots = (raw_store.raw_dir, storage.clean_dir, instrumentation.metrics_dir, cache.cache_dir)
+    workers = max(1, min(len(partitions), max_workers))
+    selection = {"only": only, "from_stage": from_stage, "group": group}
+    options = {"force": force, "max_workers": max(1, max_workers // workers), "metrics": metrics,
+               "memory": memory, "profile": profile, "use_cache": cache.enabled}
+    logger.info("%d partitions (%s), %d processus", len(partitions), ", ".join(partitions), workers)
+
+    statuses = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(run_partition, name, spec, roots, start_date, end_date, incremental,
+                                  selection, dict(options, log_level=log_level or logging.getLevelName(logging.getLogger().level)))
+            for name, spec in partitions.items()
+        }
+        for name, future in futures.items():
+            try:
+                statuses[name] = future.result()
+            except Exception as e:
+                logger.error("Partition %s : échec (%r)", name, e)
+                statuses[name] = {"partition": "échec"}
+
+    for name, status in statuses.items():
+        counts = {}
+        for state in status.values():
+            counts[state] = counts.get(state, 0) + 1
+        logger.info("Partition %-10s %s", name, ", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
+    return statuses
+
+
+def failed(statuses):
+    return any(state in ("échec", "bloqué") for status in statuses.values() for state in status.values())
+
+
+#####################################################################################
+#                               FUSION (RAPPORTS GLOBAUX)
+#####################################################################################
+
+# Tables regroupées : cubes, alertes et mesures nettoyées
+def merged_table_names():
+    return pipeline.merged_tables + [f"{polluant}_data" for polluant in storage.polluants]
+
+
+# Partitions fusionnées dans chaque table de data_clean/ (une partition retirée force la refusion)
+def merge_index_path():
+    return os.path.join(storage.clean_dir, "partitions.json")
+
+
+# Regrouper les tables des partitions dans data_clean/ (colonne "partition" en tête)
+# Une table n'est réécrite que si une de ses partitions a changé depuis la dernière fusion
+def merge_partitions(partitions):
+    merged = {}
+    if os.path.exists(merge_index_path()):
+        with open(merge_index_path(), encoding="utf-8") as f:
+            merged = json.load(f)
+
+    for table in merged_table_names():
+        sources = [p for p in partitions if storage.table_exists(table, directory=storage.partition_dir(p))]
+        if not sources:
+            continue
+        target = storage.table_path(table)
+        newest = max(os.path.getmtime(storage.table_path(table, directory=storage.partition_dir(p))) for p in sources)
+        if merged.get(table) == sources and os.path.exists(target) and os.path.getmtime(target) >= newest:
+            continue
+
+        df = storage.load_partitions(table, sources)
+        storage.save_table(df, table)
+        merged[table] = sources
+        logger.info("%s : %d lignes fusionnées (%s)", table, len(df), ", ".join(sources))
+
+        missing = sorted(set(partitions) - set(sources))
+        if missing and table in pipeline.merged_tables:
+            logger.warning("%s absente des partitions %s", table, ", ".join(missing))
+
+    instrumentation.write_atomic(merge_index_path(), json.dumps(merged, indent=4))
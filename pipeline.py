@@ -0,0 +1,410 @@
+# pipeline.py
+# Ordonnanceur du pipeline : chaque étape déclare ses fichiers d'entrée / sortie,
+# les branches indépendantes tournent en parallèle et les étapes à jour sont sautées.
+# Le module d'une étape n'est importé que quand elle s'exécute : `Main.py analyse`
+# ne charge ni requests, ni openpyxl, ni matplotlib
+import os
+import time
+import logging
+import importlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cache
+import storage
+import database
+import raw_store
+import export_excel
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               ÉTAPES
+#####################################################################################
+
+# group : "fetch", "process", "analyse" ou "export" (sous-commandes de Main.py)
+# cacheable : sorties reprises du cache si les entrées n'ont pas changé de contenu (cache.py)
+# (False quand les sorties déclarées ne sont pas tous les fichiers écrits par l'étape)
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=(), group=None, cacheable=True):
+        self.name = name
+        self.func = func
+        self.group = group
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cacheable = cacheable
+        # module exécuté (son code fait partie de la clé de cache)
+        self.module = func.args[0] if getattr(func, "func", None) is call else getattr(func, "__module__", None)
+        self.deps = []  # étapes qui produisent nos entrées (rempli par build_graph)
+
+    # À jour si toutes les sorties existent et sont plus récentes que toutes les entrées présentes
+    # (une étape sans entrée, comme un fetch, n'est jamais à jour ;
+    # une étape dont aucune entrée n'existe, ex : polluant jamais téléchargé, n'a rien à faire)
+    def is_up_to_date(self):
+        if not self.inputs or not self.outputs:
+            return False
+        inputs = [path for path in self.inputs if os.path.exists(path)]
+        if not inputs:
+            return True
+        if not all(os.path.exists(path) for path in self.outputs):
+            return False
+        newest_input = max(os.path.getmtime(path) for path in inputs)
+        oldest_output = min(os.path.getmtime(path) for path in self.outputs)
+        return oldest_output >= newest_input
+
+
+# Fonction d'une étape, résolue à l'exécution : partial(call, "analyse", "analyse_PM10")
+# (picklable, donc utilisable aussi avec le pool de processus)
+def call(module, function, *args, **kwargs):
+    return getattr(importlib.import_module(module), function)(*args, **kwargs)
+
+
+def raw(name):
+    return raw_store.raw_path(name)
+
+
+# Entrées d'une étape de process : le fichier brut au format courant ou un ancien format
+def raw_inputs(name):
+    return raw_store.candidate_paths(name)
+
+
+def clean(name):
+    return storage.table_path(name)
+
+
+# Tables produites par rollup.build_rollups (rollup.cubes)
+rollup_tables = ["cube_journalier", "cube_mensuel", "cube_annuel"]
+
+# Pipeline partitionné (partitions.py) : étapes exécutées dans chaque partition, les autres restent globales
+partition_stages = ["fetch_pollution", *[f"process_{polluant}" for polluant in storage.polluants],
+                    "rollup", "series", "database", "analyse_NO2", "analyse_PM10", "analyse_normes"]
+
+# Étapes de partition refaites aussi après la fusion, sur les tables regroupées
+shared_stages = ["series", "database"]
+
+# Tables des partitions regroupées dans data_clean/ par partitions.merge_partitions
+# (les tables <polluant>_data aussi, sans être déclarées : un polluant peut n'être mesuré nulle part)
+merged_tables = rollup_tables + ["NO2_alert_200_3days", "PM10_alerts", "alertes_normes"]
+
+
+# partitions : noms des partitions (None = pipeline sur une seule région, sans partition)
+# hourly : ajouter les mesures horaires (fetch_hourly -> process_hourly -> analyse_horaire), ~24x plus volumineuses
+def build_stages(start_date, end_date, incremental=True, partitions=None, hourly=False):
+    series_index = os.path.join(storage.clean_dir, "series", "series.json")  # timeseries.index_path()
+    db = database.database_path()
+    # Partitionné : séries et exposition globales reconstruites depuis le cube fusionné
+    # (une partition ajoutée peut apporter des jours antérieurs au dernier jour connu)
+    global_incremental = incremental and not partitions
+
+    # Une étape par polluant : process_NO2, process_PM10, process_O3...
+    process_polluants = [
+        Stage(f"process_{polluant}", partial(call, "process_data", "process_polluant_data", polluant),
+              inputs=raw_inputs(f"{polluant}_Data"), outputs=[clean(f"{polluant}_data")], group="process")
+        for polluant in storage.polluants
+    ]
+
+    stages = [
+        # Extract
+        Stage("fetch_pollution",
+              partial(call, "extract_data", "fetch_pollution_data_concurrent", start_date, end_date, incremental=incremental),
+              outputs=[raw(f"{polluant}_Data") for polluant in storage.polluants], group="fetch"),
+        Stage("fetch_population",
+              partial(call, "extract_data", "fetch_population_data", incremental=incremental),
+              outputs=[raw("population_data")], group="fetch"),
+        Stage("fetch_enterprise",
+              partial(call, "extract_data", "fetch_enterprise_data", incremental=incremental),
+              outputs=[raw("enterprise_data")], group="fetch"),
+
+        # Process
+        *process_polluants,
+        Stage("process_population", partial(call, "process_data", "process_population_data"),
+              inputs=raw_inputs("population_data"), outputs=[clean("population_data")], group="process"),
+        Stage("process_enterprise", partial(call, "process_data", "process_enterprise_data"),
+              inputs=raw_inputs("enterprise_data"), outputs=[clean("enterprise_data")], group="process"),
+
+        # Cubes pré-agrégés
+        Stage("rollup", partial(call, "rollup", "build_rollups"),
+              inputs=[clean(f"{polluant}_data") for polluant in storage.polluants],
+              outputs=[clean(table) for table in rollup_tables], group="process"),
+
+        # Créations / fermetures d'établissements par commune, section et mois (entreprises.py)
+        Stage("rollup_entreprises", partial(call, "entreprises", "build_activity_cube", incremental=incremental),
+              inputs=[clean("enterprise_data")], outputs=[clean("cube_entreprises")], group="process"),
+
+        # Séries journalières par station (timeseries.py), index écrit en dernier
+        # (non cacheable : les fichiers data_clean/series/<polluant>.f32 ne sont pas des sorties déclarées)
+        Stage("series", partial(call, "timeseries", "build_series", incremental=global_incremental),
+              inputs=[clean("cube_journalier")], outputs=[series_index], group="process", cacheable=False),
+
+        # Base SQLite des tables nettoyées (database.py), interrogée par les analyses et le Dashboard
+        Stage("database", partial(call, "database", "build_database"),
+              inputs=database.source_paths(), outputs=[db], group="process"),
+
+        # Index des communes (population, établissements, stations par commune_id)
+        Stage("commune_index", partial(call, "dimensions", "build_commune_index"),
+              inputs=[clean(name) for name in ["population_data", "enterprise_data"]]
+                     + [clean(f"{polluant}_data") for polluant in storage.polluants],
+              outputs=[clean("communes")], group="process"),
+
+        # Analyse
+        Stage("analyse_NO2", partial(call, "analyse", "analyse_NO2_200_3days"),
+              inputs=[db], outputs=[clean("NO2_alert_200_3days")], group="analyse"),
+        Stage("analyse_PM10", partial(call, "analyse", "analyse_PM10"),
+              inputs=[db], outputs=[clean("PM10_alerts")], group="analyse"),
+        Stage("analyse_normes", partial(call, "analyse", "analyse_normes", hourly=hourly),
+              inputs=[db] + ([clean("alertes_horaires")] if hourly else []), outputs=[clean("alertes_normes")],
+              group="analyse"),
+        Stage("analyse_exposition", partial(call, "analyse", "analyse_exposition", incremental=global_incremental),
+              inputs=[clean("cube_journalier"), clean("population_data")],
+              outputs=[clean(name) for name in ["exposition_journaliere", "exposition_communes", "exposition_tranches"]],
+              group="analyse"),
+        Stage("analyse_entreprises", partial(call, "analyse", "analyse_entreprises"),
+              inputs=[clean("cube_entreprises"), clean("exposition_journaliere")],
+              outputs=[clean(name) for name in ["entreprises_pollution", "correlation_entreprises"]], group="analyse"),
+
+        # Export
+        Stage("run_export", partial(call, "export_excel", "run_export"),
+              inputs=[clean(name) for name in [
+                  "NO2_data", "PM10_data", "population_data", "enterprise_data", "exposition_tranches",
+                  "correlation_entreprises",
+              ]] + [series_index, db],
+              outputs=[export_excel.export_path()], group="export"),
+    ]
+    if hourly:
+        stages = with_hourly_stages(stages, start_date, end_date, incremental)
+    if partitions:
+        stages = partitioned_stages(stages, partitions)
+    return build_graph(stages)
+
+
+# Mesures horaires : un fichier par polluant et par mois, suivis par leurs index
+# (non cacheables : les fichiers des mois ne sont pas des sorties déclarées)
+def with_hourly_stages(stages, start_date, end_date, incremental):
+    raw_index = os.path.join(raw_store.raw_dir, "horaire", "index.json")  # extract_data.hourly_index_path()
+    clean_index = os.path.join(storage.clean_dir, "horaire", "index.json")  # hourly.index_path()
+    hourly_stages = {
+        "fetch": Stage("fetch_hourly",
+                       partial(call, "extract_data", "fetch_pollution_hourly", start_date, end_date, incremental=incremental),
+                       outputs=[raw_index], group="fetch"),
+        "process": Stage("process_hourly", partial(call, "hourly", "process_hourly", incremental=incremental),
+                         inputs=[raw_index], outputs=[clean_index], group="process", cacheable=False),
+        "analyse": Stage("analyse_horaire", partial(call, "analyse", "analyse_horaire"),
+                         inputs=[clean_index], outputs=[clean("alertes_horaires")], group="analyse", cacheable=False),
+    }
+    # chaque étape horaire après la dernière étape de son groupe (--list, ordre d'exécution)
+    for group, stage in hourly_stages.items():
+        index = max(i for i, other in enumerate(stages) if other.group == group)
+        if group == "analyse":
+            index = next(i for i, other in enumerate(stages) if other.name == "analyse_normes") - 1
+        stages.insert(index + 1, stage)
+    return stages
+
+
+# Étapes globales d'un pipeline partitionné : celles de partition_stages tournent dans chaque partition
+# (partitions.run_partitions), merge_partitions regroupe leurs tables avant les séries, la base, l'exposition et l'export
+def partitioned_stages(stages, partitions):
+    # partitions.merge_index_path(), réécrit à chaque fusion : la base dépend ainsi aussi des tables <polluant>_data
+    merge_index = os.path.join(storage.clean_dir, "partitions.json")
+    merge = Stage("merge_partitions", partial(call, "partitions", "merge_partitions", list(partitions)),
+                  inputs=[storage.table_path(table, directory=storage.partition_dir(partition))
+                          for partition in partitions for table in merged_tables],
+                  outputs=[clean(table) for table in merged_tables] + [merge_index], group="process", cacheable=False)
+    stages = [stage for stage in stages if stage.name not in partition_stages or stage.name in shared_stages]
+    for stage in stages:
+        if stage.name == "database":
+            stage.inputs.append(merge_index)
+    index = min(i for i, stage in enumerate(stages) if stage.name in shared_stages)
+    return stages[:index] + [merge] + stages[index:]
+
+
+# Relier chaque étape aux étapes qui produisent ses entrées
+def build_graph(stages):
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers[path] = stage
+    for stage in stages:
+        stage.deps = []
+        for path in stage.inputs:
+            producer = producers.get(path)
+            if producer is not None and producer is not stage and producer not in stage.deps:
+                stage.deps.append(producer)
+    return stages
+
+
+#####################################################################################
+#                               SÉLECTION
+#####################################################################################
+
+# Étapes qui dépendent (directement ou non) de `stage`
+def downstream(stages, stage):
+    result = {stage.name}
+    changed = True
+    while changed:
+        changed = False
+        for other in stages:
+            if other.name not in result and any(dep.name in result for dep in other.deps):
+                result.add(other.name)
+                changed = True
+    return result
+
+
+# only : liste de noms d'étapes à exécuter (et seulement elles)
+# from_stage : exécuter cette étape et tout ce qui en dépend
+# group : seulement les étapes de ce groupe ("fetch", "process", "analyse", "export")
+def select_stages(stages, only=None, from_stage=None, group=None):
+    names = {stage.name for stage in stages}
+    for name in (only or []) + ([from_stage] if from_stage else []):
+        if name not in names:
+            raise ValueError(f"Étape inconnue : {name} (disponibles : {', '.join(sorted(names))})")
+
+    selected = set(names)
+    if group:
+        selected = {stage.name for stage in stages if stage.group == group}
+    if only is not None:
+        selected &= set(only)
+    if from_stage:
+        start = next(stage for stage in stages if stage.name == from_stage)
+        selected &= downstream(stages, start)
+    return [stage for stage in stages if stage.name in selected]
+
+
+#####################################################################################
+#                               EXÉCUTION
+#####################################################################################
+
+# force : exécuter même les étapes à jour
+# processes : pool de processus au lieu de threads (les étapes pandas lourdes ne partagent pas le GIL)
+# metrics : mesurer chaque étape (instrumentation.run_stage) et écrire les rapports JSON / Prometheus
+# memory : "rss" ou "tracemalloc" ; profile : None, "cprofile" ou "sample"
+# (tracemalloc est global au processus, cProfile aussi depuis Python 3.12 : les étapes passent alors une par une)
+# use_cache : étape pas à jour d'après les dates mais entrées inchangées -> sorties reprises du cache
+# (None = cache.enabled ; vaut aussi pour les graphiques du rapport, y compris dans les processus du pool)
+def run(stages, selected=None, force=False, max_workers=4, processes=False, metrics=True, memory="rss", profile=None,
+        use_cache=None):
+    use_cache = cache.enabled if use_cache is None else use_cache
+    selected = stages if selected is None else selected
+    # une dépendance absente de `stages` ne serait jamais terminée (étapes à filtrer avec `selected`)
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = [dep.name for dep in stage.deps if dep.name not in names]
+        if missing:
+            raise ValueError(f"{stage.name} dépend de {', '.join(missing)}, absente(s) des étapes du pipeline "
+                             f"(passer toutes les étapes et filtrer avec selected)")
+    selected_names = {stage.name for stage in selected}
+    status = {}   # nom -> "ok", "à jour", "en cache", "échec", "bloqué", "non sélectionné"
+    results = {}  # nom -> mesures de l'étape
+    keys = {}     # nom -> clé de cache de l'exécution en cours
+
+    if metrics and (memory == "tracemalloc" or profile == "cprofile") and not processes and max_workers > 1:
+        logger.info("Mesure %s : étapes exécutées une par une", "tracemalloc" if memory == "tracemalloc" else "cProfile")
+        max_workers = 1
+
+    pending = list(stages)
+    running = {}
+    start = time.perf_counter()
+
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pool = pool_class(max_workers=max_workers, initializer=cache.set_enabled, initargs=(use_cache,))
+    with pool as executor, cache.enabled_as(use_cache):
+        while pending or running:
+            # Lancer toutes les étapes dont les dépendances sont terminées
+            for stage in list(pending):
+                if any(dep.name not in status for dep in stage.deps):
+                    continue
+                pending.remove(stage)
+
+                if stage.name not in selected_names:
+                    status[stage.name] = "non sélectionné"
+                elif any(status[dep.name] in ("échec", "bloqué") for dep in stage.deps):
+                    status[stage.name] = "bloqué"
+                elif not force and stage.is_up_to_date():
+                    status[stage.name] = "à jour"
+                else:
+                    keys[stage.name] = cache_key(stage) if use_cache else None
+                    if not force and keys[stage.name] and restore(stage, keys[stage.name]):
+                        status[stage.name] = "en cache"
+                        continue
+                    logger.info("[pipeline] start %s", stage.name)
+                    future = executor.submit(instrumentation.run_stage, stage.name, stage.func,
+                                             collect=metrics, memory=memory, profile=profile)
+                    running[future] = stage
+
+            if not running:
+                # plus rien à lancer (dépendances circulaires) : le reste est bloqué
+                if pending and all(any(dep.name not in status for dep in stage.deps) for stage in pending):
+                    for stage in pending:
+                        status[stage.name] = "bloqué"
+                        logger.error("[pipeline] %s bloquée : dépendances jamais terminées", stage.name)
+                    pending = []
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                    status[stage.name] = "ok"
+                    logger.info("[pipeline] done  %s (%.2fs)", stage.name, results[stage.name]["wall_s"])
+                except Exception as e:
+                    status[stage.name] = "échec"
+                    logger.error("[pipeline] FAILED %s : %r", stage.name, e)
+                    continue
+                if keys.get(stage.name):
+                    try:
+                        cache.store(stage, keys[stage.name])
+                    except Exception as e:
+                        logger.warning("[cache] %s : sorties non mises en cache (%r)", stage.name, e)
+
+    total = time.perf_counter() - start
+    timings = {name: result["wall_s"] for name, result in results.items()}
+    print_report(stages, status, results, total, metrics)
+    if metrics:
+        json_path = instrumentation.write_json_report(results, status, total)
+        prom_path = instrumentation.write_prometheus_report(results, status, total)
+        logger.info("Mesures écrites dans %s et %s", json_path, prom_path)
+    return status, timings
+
+
+# Clé de cache d'une étape, None si elle n'est pas cacheable ou si le calcul échoue (entrée illisible...)
+def cache_key(stage):
+    try:
+        return cache.stage_key(stage)
+    except Exception as e:
+        logger.warning("[cache] %s : empreinte des entrées impossible (%r)", stage.name, e)
+        return None
+
+
+def restore(stage, key):
+    try:
+        return cache.restore(stage, key)
+    except Exception as e:
+        logger.warning("[cache] %s : reprise du cache impossible (%r)", stage.name, e)
+        return False
+
+
+def print_report(stages, status, results, total, metrics=True):
+    lines = ["=" * 100]
+    header = f"{'Étape':<22}{'Statut':<18}{'Durée':>9}"
+    if metrics:
+        header += f"{'CPU':>9}{'Mém. Mo':>9}{'Lignes in':>11}{'Lignes out':>11}{'Req. HTTP':>11}"
+    lines += [header, "-" * 100]
+    for stage in stages:
+        result = results.get(stage.name)
+        line = f"{stage.name:<22}{status.get(stage.name, '-'):<18}"
+        if result is None:
+            line += f"{'-':>9}"
+        else:
+            line += f"{result['wall_s']:>8.2f}s"
+            if metrics:
+                peak = f"{result['peak_mb']:.0f}" if result["peak_mb"] is not None else "-"
+                line += (f"{result['cpu_s']:>8.2f}s{peak:>9}{result['rows_in']:>11}{result['rows_out']:>11}"
+                         f"{result['http']['requests']:>11}")
+        lines.append(line)
+    lines.append("-" * 100)
+    lines.append(f"{'Total (mur)':<40}{total:>9.2f}s")
+    lines.append(f"{'Somme des étapes':<40}{sum(r['wall_s'] for r in results.values()):>9.2f}s")
+    lines.append("=" * 100)
+    logger.info("Rapport du pipeline :\n%s", "\n".join(lines))
@@ -1,134 +1,132 @@
 # process_data.py
-import os
-import json
+import logging
+import numpy as np
 import pandas as pd
+import storage
+import raw_store
+import dimensions
+
+logger = logging.getLogger(__name__)
 
 #####################################################################################
 #                               GLOBAL VARIABLE
 #####################################################################################
-script_dir = os.path.dirname(os.path.abspath(__file__))
-datas_dir = os.path.join(script_dir, "datas")
-clean_dir = os.path.join(script_dir, "data_clean")
-os.makedirs(clean_dir, exist_ok=True)  # ensure data_clean exists
-
+# Nombre de records convertis en DataFrame à la fois lors de la lecture en streaming
+chunk_size = 50000
+
+# Colonnes utiles des établissements SIRENE
+enterprise_columns = [
+    'codecommuneetablissement',
+    'libellecommuneetablissement',
+    'etatadministratifetablissement',
+    'activiteprincipaleetablissement',
+    'soussectionetablissement',
+    'sectionetablissement',
+    'datecreationetablissement',
+    'datefermetureetablissement'
+]
+
+# Polluants traités (mêmes noms que extract_data.polluants) : datas/<polluant>_Data -> data_clean/<polluant>_data
+polluants = storage.polluants
+
+# Valeurs plausibles des mesures (μg/m³) : en dehors, la mesure est jugée aberrante
+valeur_min = 0
+valeur_max = 1000
+
+# Code INSEE de la commune dans le dataset population (premier champ présent)
+population_code_fields = ['code_commune', 'code_insee']
+
+# Colonnes utiles des mesures airpl (les autres ne sont jamais chargées)
+pollution_columns = [
+    'code_commune',
+    'nom_commune',
+    'code_station',
+    'nom_station',
+    'valeur',
+    'date_heure_local'
+]
 
 
 #####################################################################################
-#                               PROCESSING PM10
+#                               LECTURE EN STREAMING
 #####################################################################################
 
-def process_PM10_data():
-    print("Processing PM10 data...")
-
-    # Load JSON
-    with open(os.path.join(datas_dir, "PM10_Data.json"), "r", encoding="utf-8") as f:
-        data_PM10 = json.load(f)
-
-    # Les données sont sous "results"
-    records = data_PM10.get('results', [])
-
-    # Transformer en DataFrame
-    df_PM10 = pd.json_normalize(records)
-
-    # === DEBUG : pour mes tests ===
-    print("Colonnes PM10 disponibles :")
-    print(df_PM10.columns.tolist())
-
-    # Garder uniquement les colonnes utiles
-    columns_to_keep = [
-        'nom_commune',
-        'nom_station',
-        'valeur',
-        'date_heure_local'
-    ]
-    df_PM10 = df_PM10[columns_to_keep]
-
-    # === Nettoyage ===
-    # Renommer les colonnes pour être plus clair pour Power BI
-    df_PM10 = df_PM10.rename(columns={
-        'nom_commune': 'commune',
-        'nom_station': 'station',
-        'valeur': 'pm10_value',
-        'date_heure_local': 'date_local'
-    })
-
-    # Forcer les types :
-    df_PM10['date_local'] = pd.to_datetime(df_PM10['date_local']).dt.date
-    df_PM10['pm10_value'] = pd.to_numeric(df_PM10['pm10_value'], errors='coerce')
-
-    df_PM10 = df_PM10.dropna(subset=['pm10_value'])
-    # Supprimer les valeurs négatives ou aberrantes
-    df_PM10 = df_PM10[df_PM10["pm10_value"] >= 0]
-    df_PM10 = df_PM10[df_PM10["pm10_value"] < 1000]
+# Records bruts d'un dataset en DataFrames de chunk_size lignes, uniquement `columns`
+# (records à plat, ou {"fields": {...}} pour l'ancienne API Opendatasoft)
+def iter_raw_chunks(name, columns):
+    rows = []
+    empty = True
+    for record in raw_store.iter_records(name):
+        record = record.get("fields", record)
+        rows.append(tuple(record.get(col) for col in columns))
+        if len(rows) >= chunk_size:
+            yield pd.DataFrame.from_records(rows, columns=columns)
+            rows = []
+            empty = False
+    if rows or empty:
+        yield pd.DataFrame.from_records(rows, columns=columns)
 
 
-    # === Ajouter la colonne de seuil pour info ===
-    df_PM10['seuil_info_recommandation'] = 50  # µg/m³
-    df_PM10['seuil_alerte'] = 80  # µg/m³
+def read_raw_columns(name, columns):
+    return pd.concat(iter_raw_chunks(name, columns), ignore_index=True)
 
-    # === Sauvegarder le CSV ===
-    df_PM10.to_csv(os.path.join(clean_dir, "PM10_data.csv"), index=False)
-    print("PM10 data saved to data_clean/PM10_data.csv")
 
+# Mesures d'un fichier airpl, uniquement `pollution_columns`
+def read_pollution_records(name):
+    return read_raw_columns(name, pollution_columns)
 
 
 #####################################################################################
-#                               PROCESSING N02
+#                               PROCESSING POLLUANTS
 #####################################################################################
 
-def process_NO2_data():
-    print("Processing NO2 data...")
-
-    # Load JSON
-    with open(os.path.join(datas_dir, "NO2_Data.json"), "r", encoding="utf-8") as f:
-        data_NO2 = json.load(f)
-
-    # Les données sont sous "results"
-    records = data_NO2.get('results', [])
-
-    # Transformer en DataFrame
-    df_NO2 = pd.json_normalize(records)
+# Nettoyer un paquet de mesures brutes en une passe : un seul masque (date ou valeur manquante,
+# valeur négative ou aberrante), appliqué une fois à chaque colonne du résultat
+# Dates gardées en datetime64 (jour local, lu dans "2024-05-03T00:00:00+02:00")
+# Station et commune remplacées par leurs identifiants int32 (dimensions.py)
+def clean_pollution_chunk(chunk, value_col):
+    values = pd.to_numeric(chunk['valeur'], errors='coerce').to_numpy(dtype='float64')
+    dates = pd.to_datetime(chunk['date_heure_local'].str.slice(0, 10), format="%Y-%m-%d", errors='coerce').to_numpy()
+    keep = (values >= valeur_min) & (values < valeur_max) & ~np.isnat(dates)  # False pour les NaN
+
+    commune_id = dimensions.commune_ids(chunk['code_commune'].to_numpy()[keep], chunk['nom_commune'].to_numpy()[keep])
+    station_id = dimensions.station_ids(chunk['code_station'].to_numpy()[keep], chunk['nom_station'].to_numpy()[keep], commune_id)
+    return pd.DataFrame({
+        'station_id': station_id,
+        'commune_id': commune_id,
+        'date_local': dates[keep],
+        value_col: values[keep].astype(np.float32),
+    })
 
-    # === DEBUG : pour mes tests ===
-    print("Colonnes NO2 disponibles :")
-    print(df_NO2.columns.tolist())
 
-    # Garder uniquement les colonnes utiles
-    columns_to_keep = [
-        'nom_commune',
-        'nom_station',
-        'valeur',
-        'date_heure_local'
-    ]
-    df_NO2 = df_NO2[columns_to_keep]
-
-    # Renommer les colonnes
-    df_NO2 = df_NO2.rename(columns={
-        'nom_commune': 'commune',
-        'nom_station': 'station',
-        'valeur': 'no2_value',
-        'date_heure_local': 'date_local'
-    })
+def process_polluant_data(polluant):
+    dataset = f"{polluant}_Data"
+    if not raw_store.raw_exists(dataset):
+        logger.info("Pas de données brutes pour %s (%s), ignoré.", polluant, dataset)
+        return
+    logger.info("Processing %s data...", polluant)
 
-    # Forcer les types
-    df_NO2['date_local'] = pd.to_datetime(df_NO2['date_local']).dt.date
-    df_NO2['no2_value'] = pd.to_numeric(df_NO2['no2_value'], errors='coerce')
+    # Lecture en streaming, nettoyage paquet par paquet (les lignes rejetées ne sont jamais gardées)
+    value_col = storage.value_column(polluant)
+    nb_lues = 0
+    chunks = []
+    for chunk in iter_raw_chunks(dataset, pollution_columns):
+        nb_lues += len(chunk)
+        chunks.append(clean_pollution_chunk(chunk, value_col))
+    df = pd.concat(chunks, ignore_index=True)
+    logger.info("%d mesures %s lues, %d rejetées (manquantes ou aberrantes)", nb_lues, polluant, nb_lues - len(df))
 
-    # === SUPPRIMER les lignes où la valeur est null ===
-    df_NO2 = df_NO2.dropna(subset=['no2_value'])
-    # Supprimer les valeurs négatives ou aberrantes
-    df_NO2 = df_NO2[df_NO2["no2_value"] >= 0]
-    df_NO2 = df_NO2[df_NO2["no2_value"] < 1000]
+    # (les seuils réglementaires sont dans normes.py, plus dans chaque ligne)
 
+    # Sauvegarder (Parquet + CSV pour Power BI)
+    storage.save_table(df, f"{polluant}_data")
+    logger.info("%s data saved to data_clean/%s_data.%s", polluant, polluant, storage.backend)
 
-    # === Ajouter les seuils réglementaires NO2 ===
-    # (source : ton PDF :contentReference[oaicite:0]{index=0})
-    df_NO2['seuil_info_recommandation'] = 200  # µg/m³ en moyenne horaire
-    df_NO2['seuil_alerte'] = 400  # µg/m³ en moyenne horaire
 
-    # Sauvegarder le CSV
-    df_NO2.to_csv(os.path.join(clean_dir, "NO2_data.csv"), index=False)
-    print("NO2 data saved to data_clean/NO2_data.csv")
+# Tous les polluants (ou ceux demandés) en un seul appel
+def process_pollution_data(polluants_list=None):
+    for polluant in polluants_list or polluants:
+        process_polluant_data(polluant)
 
 
 #####################################################################################
@@ -137,49 +135,41 @@ def process_NO2_data():
 
 
 def process_population_data():
-    print("Processing population data...")
+    logger.info("Processing population data...")
 
-    # Load JSON
-    with open(os.path.join(datas_dir, "population_data.json"), "r", encoding="utf-8") as f:
-        data_population = json.load(f)
+    # Les records Opendatasoft ont leurs colonnes dans 'fields'
+    fields_list = [record.get('fields', record) for record in raw_store.iter_records("population_data")]
 
-    # Les données sont dans 'records' → et les colonnes sont dans 'fields'
-    records = data_population.get('records', [])
-    # Extraire directement la liste des 'fields'
-    fields_list = [record['fields'] for record in records]
-    
     # Transformer en DataFrame
     df_population = pd.DataFrame(fields_list)
 
 
     # === DEBUG : pour mes tests ===
-    print("Colonnes population disponibles :")
-    print(df_population.columns.tolist())
+    logger.debug("Colonnes population disponibles : %s", df_population.columns.tolist())
+
+    # Commune -> commune_id : par code INSEE si le dataset le donne (pas d'erreur sur les accents
+    # ni les homonymes), sinon par le nom
+    code_field = next((field for field in population_code_fields if field in df_population.columns), None)
+    codes = df_population[code_field] if code_field else [None] * len(df_population)
+    df_population['commune_id'] = dimensions.commune_ids(codes, df_population['nom_de_la_commune'])
 
     # Garder les colonnes utiles
     columns_to_keep = [
-        'nom_de_la_commune',
+        'commune_id',
         'population_totale',
         'tranche_population'
     ]
     df_population = df_population[columns_to_keep]
 
-    # Renommer pour plus de clarté
-    df_population = df_population.rename(columns={
-        'nom_de_la_commune': 'commune',
-        'population_totale': 'population_totale',
-        'tranche_population': 'tranche_population'
-    })
-
     # Forcer les types
     df_population['population_totale'] = pd.to_numeric(df_population['population_totale'], errors='coerce')
 
     # Supprimer les lignes où population_totale est null
     df_population = df_population.dropna(subset=['population_totale'])
 
-    # Sauvegarder le CSV
-    df_population.to_csv(os.path.join(clean_dir, "population_data.csv"), index=False)
-    print("Population data saved to data_clean/population_data.csv")
+    # Sauvegarder (Parquet + CSV pour Power BI)
+    storage.save_table(df_population, "population_data")
+    logger.info("Population data saved to data_clean/population_data.%s", storage.backend)
 
 #####################################################################################
 #                               PROCESSING ENTERPRISE
@@ -187,38 +177,18 @@ def process_population_data():
 
 
 def process_enterprise_data():
-    print("Processing enterprise data...")
-
-    # Load JSON
-    with open(os.path.join(datas_dir, "enterprise_data.json"), "r", encoding="utf-8") as f:
-        data_enterprises = json.load(f)
-
-    # Les données sont dans 'records'
-    records = data_enterprises.get('records', [])
+    logger.info("Processing enterprise data...")
 
-    # Extraire directement la liste des 'fields'
-    fields_list = [record['fields'] for record in records]
-
-    # Transformer en DataFrame
-    df_enterprises = pd.DataFrame(fields_list)
+    # Un établissement par record, uniquement les colonnes utiles
+    df_enterprises = read_raw_columns("enterprise_data", enterprise_columns)
 
-   
-
-    # Garder les colonnes utiles
-    columns_to_keep = [
-        'libellecommuneetablissement',
-        'etatadministratifetablissement',
-        'activiteprincipaleetablissement',
-        'soussectionetablissement',
-        'sectionetablissement',
-        'datecreationetablissement',
-        'datefermetureetablissement'
-    ]
-    df_enterprises = df_enterprises[columns_to_keep]
+    # Commune (code INSEE + libellé) -> commune_id
+    commune_id = dimensions.commune_ids(df_enterprises.pop('codecommuneetablissement'),
+                                        df_enterprises.pop('libellecommuneetablissement'))
+    df_enterprises.insert(0, 'commune_id', commune_id)
 
     # Renommer pour plus de clarté
     df_enterprises = df_enterprises.rename(columns={
-        'libellecommuneetablissement': 'commune',
         'etatadministratifetablissement': 'etat',
         'activiteprincipaleetablissement': 'activite_principale',
         'soussectionetablissement': 'soussection',
@@ -228,18 +198,17 @@ def process_enterprise_data():
     })
 
     # === DEBUG : afficher les colonnes ===
-    print("Colonnes entreprises disponibles :")
-    print(df_enterprises.columns.tolist())
+    logger.debug("Colonnes entreprises disponibles : %s", df_enterprises.columns.tolist())
 
-    # Forcer le type date
-    df_enterprises['date_fermeture'] = pd.to_datetime(df_enterprises['date_fermeture'], errors='coerce')
+    # Forcer le type date ("AAAA-MM-JJ", date32 dans le Parquet)
+    df_enterprises['date_creation'] = pd.to_datetime(df_enterprises['date_creation'], format="%Y-%m-%d", errors='coerce')
+    df_enterprises['date_fermeture'] = pd.to_datetime(df_enterprises['date_fermeture'], format="%Y-%m-%d", errors='coerce')
 
-    # Sauvegarder le CSV
-    df_enterprises.to_csv(os.path.join(clean_dir, "enterprise_data.csv"), index=False)
-    print("Enterprise data saved to data_clean/enterprise_data.csv")
+    # Sauvegarder (Parquet + CSV pour Power BI)
+    storage.save_table(df_enterprises, "enterprise_data")
+    logger.info("Enterprise data saved to data_clean/enterprise_data.%s", storage.backend)
 
 
-#process_PM10_data()
-#process_NO2_data()
+#process_pollution_data()
 #process_population_data()
 #process_enterprise_data()
\ No newline at end of file
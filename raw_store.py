@@ -0,0 +1,280 @@
+# raw_store.py
+# Cache des données brutes (datas/) : JSON lines compressé (zstd si disponible, sinon gzip),
+# un record par ligne, écrit et relu en streaming.
+# Les anciens fichiers <dataset>.json (indentés) et <dataset>.ndjson restent lisibles.
+import os
+import gzip
+import json
+import tempfile
+
+import instrumentation
+
+try:
+    import zstandard  # optionnel : plus rapide et plus compact que gzip
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson  # optionnel : (dé)sérialisation JSON rapide
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # optionnel : parseur JSON en streaming (C) pour les anciens fichiers
+except ImportError:
+    ijson = None
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+raw_dir = os.path.join(script_dir, "datas")
+
+# Compression des nouveaux fichiers : "zstd", "gzip" ou None (JSON lines brut)
+compression = "zstd" if zstandard is not None else "gzip"
+
+extensions = {
+    "zstd": ".ndjson.zst",
+    "gzip": ".ndjson.gz",
+    None: ".ndjson",
+}
+
+# Niveaux rapides : le cache est réécrit à chaque fetch
+compression_levels = {"zstd": 3, "gzip": 5}
+
+# Tableau des records dans les anciens fichiers JSON
+legacy_keys = {
+    "population_data": "records",
+    "enterprise_data": "records",
+}
+legacy_default_key = "results"  # fichiers airpl <polluant>_Data.json
+
+
+#####################################################################################
+#                               CHEMINS
+#####################################################################################
+
+def raw_path(name, fmt="default"):
+    fmt = compression if fmt == "default" else fmt
+    return os.path.join(raw_dir, name + extensions[fmt])
+
+
+def legacy_path(name):
+    return os.path.join(raw_dir, name + ".json")
+
+
+# Fichiers possibles d'un dataset, du format courant au plus ancien
+def candidate_paths(name):
+    formats = [compression] + [fmt for fmt in extensions if fmt != compression]
+    return [raw_path(name, fmt) for fmt in formats] + [legacy_path(name)]
+
+
+# Fichier à lire pour `name` (None s'il n'a jamais été téléchargé)
+def find_raw(name):
+    for path in candidate_paths(name):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def raw_exists(name):
+    return find_raw(name) is not None
+
+
+#####################################################################################
+#                               (DÉ)SÉRIALISATION
+#####################################################################################
+
+def dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+# Flux binaire selon l'extension (compressé ou non)
+def open_raw(path, mode="rb"):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} est compressé en zstd : pip install zstandard")
+        level = compression_levels["zstd"]
+        cctx = zstandard.ZstdCompressor(level=level) if "w" in mode else None
+        return zstandard.open(path, mode, cctx=cctx)
+    if path.endswith(".gz"):
+        # mtime=0 : mêmes records -> mêmes octets (sinon la date dans l'en-tête change l'empreinte, voir cache.py)
+        return gzip.GzipFile(path, mode, compresslevel=compression_levels["gzip"], mtime=0)
+    return open(path, mode)
+
+
+#####################################################################################
+#                               LECTURE
+#####################################################################################
+
+# Parcourir les records d'un dataset, quel que soit le format sur disque
+def iter_records(name):
+    path = find_raw(name)
+    if path is None:
+        raise FileNotFoundError(f"Aucune donnée brute pour {name} dans {raw_dir}")
+    instrumentation.count_file("bytes_read", path)
+    nb_records = 0
+    try:
+        if path.endswith(".json"):
+            for nb_records, record in enumerate(iter_json_array(path, legacy_keys.get(name, legacy_default_key)), 1):
+                yield record
+            return
+        with open_raw(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    nb_records += 1
+                    yield loads(line)
+    finally:
+        # compté aussi si le lecteur s'arrête avant la fin
+        instrumentation.count("rows_in", nb_records)
+
+
+# Parcourir le tableau `key` d'un gros fichier JSON record par record,
+# sans charger tout le fichier en mémoire (anciens fichiers indentés)
+def iter_json_array(path, key="results", block_size=1 << 16):
+    with open(path, "rb" if ijson else "r", encoding=None if ijson else "utf-8") as f:
+        if ijson is not None:
+            yield from ijson.items(f, f"{key}.item", use_float=True)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        eof = False
+
+        # Avancer jusqu'au début du tableau : "key": [
+        marker = f'"{key}"'
+        while True:
+            idx = buffer.find(marker)
+            if idx >= 0:
+                start = buffer.find("[", idx + len(marker))
+                if start >= 0:
+                    buffer = buffer[start + 1:]
+                    break
+            if eof:
+                return  # pas de tableau `key` dans le fichier
+            block = f.read(block_size)
+            eof = not block
+            # garder la fin au cas où le marqueur est coupé entre deux blocs
+            buffer = buffer[-len(marker):] + block if idx < 0 else buffer + block
+
+        # Décoder les éléments un par un
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # élément incomplet (ou buffer vide) : lire la suite du fichier
+                if eof:
+                    raise
+                block = f.read(block_size)
+                eof = not block
+                buffer = buffer[pos:] + block
+                pos = 0
+                continue
+            yield record
+            pos = end
+
+
+# Plus grande valeur de `field` (records à plat ou {"fields": {...}}), None si aucune
+def max_value(name, field):
+    values = (record.get("fields", record).get(field) for record in iter_records(name))
+    return max((str(v) for v in values if v), default=None)
+
+
+#####################################################################################
+#                               ÉCRITURE
+#####################################################################################
+
+# Écriture en streaming dans un fichier temporaire, renommé à la fermeture
+# (un fetch interrompu ne laisse jamais de fichier tronqué)
+#
+#   with RecordWriter("NO2_Data") as writer:
+#       writer.write(record)
+class RecordWriter:
+    def __init__(self, name):
+        self.name = name
+        self.path = raw_path(name)
+        self.part_path = raw_path(name + ".part")  # même extension, donc même compression
+        self.count = 0
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(raw_dir, exist_ok=True)
+        self.file = open_raw(self.part_path, "wb")
+        return self
+
+    def write(self, record):
+        self.file.write(dumps(record))
+        self.count += 1
+
+    # Ligne déjà sérialisée (ex : export JSON lines de l'API)
+    def write_line(self, line):
+        self.file.write(line if line.endswith(b"\n") else line + b"\n")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.part_path)
+            return False
+        os.replace(self.part_path, self.path)
+        instrumentation.count("rows_out", self.count)
+        instrumentation.count_file("bytes_written", self.path)
+        # les autres formats du même dataset sont désormais périmés
+        for path in candidate_paths(self.name):
+            if path != self.path and os.path.exists(path):
+                os.remove(path)
+        return False
+
+
+def write_records(name, records):
+    with RecordWriter(name) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+# Fusionner un delta dans un dataset : en cas de doublon c'est le delta qui gagne
+# keep : filtre optionnel sur les records fusionnés (ex : fenêtre de dates)
+# Seules les clés du delta sont gardées en mémoire : le delta est relu une fois (clés) et recopié
+# dans un fichier temporaire, rejoué après les anciens records ; retourne le nombre de records écrits
+def merge_records(name, new_records, record_key, keep=None):
+    os.makedirs(raw_dir, exist_ok=True)
+    with tempfile.TemporaryFile(dir=raw_dir, suffix=".ndjson") as spool:
+        new_keys = set()
+        for record in new_records:
+            new_keys.add(record_key(record))
+            spool.write(dumps(record))
+        spool.seek(0)
+        old_records = iter_records(name) if raw_exists(name) else []
+
+        def merged():
+            for record in old_records:
+                if record_key(record) not in new_keys:
+                    yield record
+            for line in spool:
+                yield loads(line)
+
+        if keep is None:
+            return write_records(name, merged())
+        return write_records(name, (record for record in merged() if keep(record)))
+
+
+def remove_raw(name):
+    for path in candidate_paths(name):
+        if os.path.exists(path):
+            os.remove(path)
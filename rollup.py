@@ -0,0 +1,229 @@
+# rollup.py
+# Cubes pré-agrégés (journalier, mensuel, annuel) par polluant x commune x station (identifiants int32),
+# calculés une fois après process_data et mis à jour seulement pour les nouveaux jours
+import logging
+import pandas as pd
+import storage
+import normes
+import process_data
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+polluants = process_data.polluants
+
+cube_keys = ['polluant', 'commune_id', 'station_id']
+
+# Un compteur de jours de dépassement par catégorie de norme (moyenne journalière > seuil)
+categories_journalieres = ["limite", "information", "alerte", "recommandation"]
+
+# Tables produites dans data_clean/ (déclarées aussi dans pipeline.rollup_tables)
+cubes = {
+    "journalier": ("cube_journalier", "date_local"),
+    "mensuel": ("cube_mensuel", "mois"),
+    "annuel": ("cube_annuel", "annee"),
+}
+
+
+#####################################################################################
+#                               CALCUL DES CUBES
+#####################################################################################
+
+# Cube journalier d'un polluant à partir de sa table nettoyée
+def daily_cube(df, polluant):
+    value_col = storage.value_column(polluant)
+    cube = (
+        df.groupby(['commune_id', 'station_id', 'date_local'])[value_col]
+        .agg(['sum', 'count', 'max'])
+        .reset_index()
+        .rename(columns={'sum': 'somme', 'count': 'nb_mesures'})
+    )
+    cube.insert(0, 'polluant', polluant)
+    cube['moyenne'] = cube['somme'] / cube['nb_mesures']
+
+    seuils = {
+        norme["categorie"]: norme["valeur"]
+        for norme in normes.normes_polluant(polluant)
+        if norme["fenetre"] != "annuelle"
+    }
+    for categorie in categories_journalieres:
+        if categorie in seuils:
+            cube[f"jours_{categorie}"] = (cube['moyenne'] > seuils[categorie]).astype('int16')
+        else:
+            cube[f"jours_{categorie}"] = 0
+    return cube
+
+
+def period_column(dates, grain):
+    if grain == "mensuel":
+        return dates.dt.to_period('M').dt.to_timestamp()
+    return dates.dt.year.astype('int16')
+
+
+# Agréger le cube journalier au mois ou à l'année
+def rollup_daily(daily, grain):
+    period = cubes[grain][1]
+    daily = daily.assign(**{period: period_column(daily['date_local'], grain)})
+    aggregations = {'somme': 'sum', 'nb_mesures': 'sum', 'max': 'max', 'date_local': 'count'}
+    aggregations.update({f"jours_{c}": 'sum' for c in categories_journalieres})
+    cube = (
+        daily.groupby(cube_keys + [period], observed=True)
+        .agg(aggregations)
+        .rename(columns={'date_local': 'nb_jours'})
+        .reset_index()
+    )
+    cube['moyenne'] = cube['somme'] / cube['nb_mesures']
+    return cube
+
+
+#####################################################################################
+#                               CONSTRUCTION / MISE À JOUR
+#####################################################################################
+
+def build_rollups(incremental=True):
+    logger.info("Building rollup cubes...")
+
+    existing = None
+    if incremental and all(storage.table_exists(table) for table, _ in cubes.values()):
+        existing = {grain: storage.load_table(table) for grain, (table, _) in cubes.items()}
+        # cubes d'avant les identifiants (colonnes commune / station en texte) : tout reconstruire
+        if not all(set(cube_keys) <= set(cube.columns) for cube in existing.values()):
+            existing = None
+
+    # Pour chaque polluant : premier jour à recalculer (None = tout)
+    # On recalcule toujours le dernier jour connu (mesures corrigées a posteriori)
+    # firsts : premier jour de la table nettoyée quand la fenêtre a avancé (jours plus anciens retirés des cubes)
+    since = {}
+    firsts = {}
+    new_days = []
+    for polluant in polluants:
+        # polluant jamais traité : ses lignes éventuelles dans les cubes sont gardées telles quelles
+        if not storage.table_exists(f"{polluant}_data"):
+            continue
+        since[polluant] = None
+        if existing is not None:
+            known = existing["journalier"].loc[existing["journalier"]['polluant'] == polluant, 'date_local']
+            if not known.empty:
+                since[polluant] = known.max()
+                first = first_day(polluant)
+                if pd.isna(first):
+                    since[polluant] = None
+                elif known.min() < first:
+                    firsts[polluant] = first
+
+        value_col = storage.value_column(polluant)
+        df = storage.load_table(
+            f"{polluant}_data",
+            columns=['commune_id', 'station_id', 'date_local', value_col],
+            date_range=(since[polluant], None) if since[polluant] is not None else None,
+        )
+        new_days.append(daily_cube(df, polluant))
+        logger.info("%s : %d mesures agrégées%s", polluant, len(df),
+                    f" depuis le {since[polluant]:%Y-%m-%d}" if since[polluant] is not None else "")
+
+    if not new_days:
+        logger.warning("Aucune table polluant dans data_clean/, cubes non construits.")
+        return
+
+    daily = pd.concat(new_days, ignore_index=True)
+    if existing is not None:
+        daily = pd.concat([drop_since(existing["journalier"], since, "journalier", firsts), daily], ignore_index=True)
+    daily = sort_cube(daily, "date_local")
+    storage.save_table(daily, cubes["journalier"][0])
+
+    # Mois / années : seules les périodes touchées par les nouveaux jours sont recalculées
+    for grain in ["mensuel", "annuel"]:
+        table, period = cubes[grain]
+        if existing is None:
+            cube = rollup_daily(daily, grain)
+        else:
+            touched = restrict_since(daily, since, grain, firsts)
+            cube = pd.concat([drop_since(existing[grain], since, grain, firsts), rollup_daily(touched, grain)],
+                             ignore_index=True)
+        storage.save_table(sort_cube(cube, period), table)
+
+    logger.info("Cubes sauvegardés dans data_clean/ (%d lignes journalières)", len(daily))
+
+
+# Premier jour d'une table nettoyée (NaT si elle est vide), seule la colonne date_local est lue
+def first_day(polluant):
+    return storage.load_table(f"{polluant}_data", columns=['date_local'])['date_local'].min()
+
+
+# Début de la période (jour, mois ou année) contenant `date`
+def period_start(date, grain):
+    date = pd.Timestamp(date)
+    if grain == "mensuel":
+        return date.to_period('M').to_timestamp()
+    if grain == "annuel":
+        return date.year
+    return date
+
+
+# Lignes d'un cube à garder : celles des périodes antérieures au recalcul,
+# sans les jours sortis de la fenêtre (firsts) ; la période qui contient le premier jour est recalculée
+def drop_since(cube, since, grain, firsts=None):
+    period = cubes[grain][1]
+    keep = pd.Series(True, index=cube.index)
+    for polluant, start in since.items():
+        is_polluant = cube['polluant'] == polluant
+        if start is None:
+            keep &= ~is_polluant
+        else:
+            keep &= ~(is_polluant & (cube[period] >= period_start(start, grain)))
+    for polluant, first in (firsts or {}).items():
+        is_polluant = cube['polluant'] == polluant
+        if grain == "journalier":
+            keep &= ~(is_polluant & (cube[period] < first))
+        else:
+            keep &= ~(is_polluant & (cube[period] <= period_start(first, grain)))
+    return cube[keep]
+
+
+# Lignes journalières des périodes à recalculer
+def restrict_since(daily, since, grain, firsts=None):
+    keep = pd.Series(False, index=daily.index)
+    for polluant, start in since.items():
+        is_polluant = daily['polluant'] == polluant
+        if start is None:
+            keep |= is_polluant
+        else:
+            keep |= is_polluant & (period_column(daily['date_local'], grain) >= period_start(start, grain))
+    for polluant, first in (firsts or {}).items():
+        keep |= (daily['polluant'] == polluant) & (period_column(daily['date_local'], grain) == period_start(first, grain))
+    return daily[keep]
+
+
+def sort_cube(cube, period):
+    cube['polluant'] = cube['polluant'].astype(str)
+    return cube.sort_values(cube_keys + [period]).reset_index(drop=True)
+
+
+#####################################################################################
+#                               LECTURE
+#####################################################################################
+
+def load_cube(grain, polluant=None, columns=None, date_range=None):
+    table, period = cubes[grain]
+    filters = [('polluant', '==', polluant)] if polluant else None
+    return storage.load_table(table, columns=columns, date_range=date_range, date_column=period, filters=filters)
+
+
+# Premier jour de chaque polluant dans le cube journalier : {polluant: Timestamp}
+# (tables construites depuis le cube : les jours sortis de la fenêtre y sont retirés aussi)
+def first_days():
+    cube = storage.load_table(cubes["journalier"][0], columns=['polluant', 'date_local'])
+    return cube.groupby(cube['polluant'].astype(str))['date_local'].min().to_dict()
+
+
+# Mesures journalières d'un polluant au format des tables nettoyées
+# (commune_id, station_id, date_local, <polluant>_value), lues depuis le cube
+def daily_measures(polluant, date_range=None):
+    value_col = storage.value_column(polluant)
+    cube = load_cube("journalier", polluant, ['commune_id', 'station_id', 'date_local', 'moyenne'], date_range)
+    return cube.rename(columns={'moyenne': value_col})
+
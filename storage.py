@@ -0,0 +1,260 @@
+# storage.py
+# Stockage des tables nettoyées de data_clean/ (Parquet typé, CSV en option pour Power BI)
+# pandas / pyarrow sont importés à la première lecture ou écriture : importer ce module
+# (chemins, noms de colonnes) reste instantané, ex : pour construire le pipeline
+import os
+import operator
+import importlib.util
+import instrumentation
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+script_dir = os.path.dirname(os.path.abspath(__file__))
+clean_dir = os.path.join(script_dir, "data_clean")
+
+# Pipeline partitionné (partitions.py) : clean_dir pointe sur data_clean/partition=<nom>/ dans chaque worker,
+# shared_dir sur data_clean/ pour les tables communes à toutes les partitions (dimensions)
+shared_dir = None
+partition_prefix = "partition="
+
+# "parquet" (colonnes typées, projection, filtres sur les dates) ou "csv" si pyarrow est absent
+backend = "parquet" if importlib.util.find_spec("pyarrow") is not None else "csv"
+
+# Polluants traités : datas/<polluant>_Data -> data_clean/<polluant>_data
+polluants = ["NO2", "PM10", "O3", "SO2", "PM2.5"]
+
+# Garder aussi une copie CSV des tables lues par le rapport Power BI (csv_tables)
+export_csv = True
+
+# Tables CSV de data_clean/ avant le passage au Parquet : mesures, population, entreprises, alertes, dimensions.
+# Les cubes, l'exposition et les autres analyses (volumineux en CSV) restent en Parquet seul
+csv_tables = {f"{polluant}_data" for polluant in polluants} | {
+    "population_data",
+    "enterprise_data",
+    "NO2_alert_200_3days",
+    "PM10_alerts",
+    "dim_commune",
+    "dim_station",
+}
+
+# Typage des colonnes connues
+categorical_columns = [
+    'partition',
+    'polluant',
+    'commune',
+    'station',
+    'tranche_population',
+    'etat',
+    'activite_principale',
+    'soussection',
+    'section',
+]
+date_columns = [
+    'date_local',
+    'date_creation',
+    'date_fermeture',
+    'date_debut',
+    'date_fin',
+    'mois',
+]
+float_suffix = '_value'  # pm10_value, no2_value... stockées en float32
+
+# Clés entières int32 des dimensions (-1 = inconnue), voir dimensions.py
+id_columns = [
+    'commune_id',
+    'station_id',
+]
+
+
+# Colonne de valeur d'un polluant : "NO2" -> "no2_value", "PM2.5" -> "pm25_value"
+def value_column(polluant):
+    return polluant.lower().replace(".", "") + float_suffix
+
+
+# Opérateurs acceptés dans les filtres de load_table
+comparisons = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+# directory : dossier des tables (None = clean_dir), ex : shared_clean_dir() ou partition_dir("44")
+def table_path(name, fmt=None, directory=None):
+    fmt = fmt or backend
+    return os.path.join(directory or clean_dir, f"{name}.{fmt}")
+
+
+# La table `name` a-t-elle une copie CSV ? (csv : choix explicite de l'appelant, None = csv_tables)
+def has_csv_copy(name, csv=None):
+    if backend == "csv":
+        return False
+    return export_csv and name in csv_tables if csv is None else csv
+
+
+def table_exists(name, directory=None):
+    return os.path.exists(table_path(name, directory=directory))
+
+
+def shared_clean_dir():
+    return shared_dir or clean_dir
+
+
+#####################################################################################
+#                               PARTITIONS
+#####################################################################################
+
+def partition_dir(partition, root=None):
+    return os.path.join(root or shared_clean_dir(), f"{partition_prefix}{partition}")
+
+
+# Partitions présentes dans data_clean/ (dossiers partition=<nom>)
+def list_partitions(root=None):
+    root = root or shared_clean_dir()
+    if not os.path.isdir(root):
+        return []
+    return sorted(entry.name[len(partition_prefix):] for entry in os.scandir(root)
+                  if entry.is_dir() and entry.name.startswith(partition_prefix))
+
+
+# Une table lue dans plusieurs partitions (None = toutes), avec une colonne "partition"
+# (mêmes options que load_table, appliquées à chaque partition : seules les partitions demandées sont lues)
+def load_partitions(name, partitions=None, **kwargs):
+    import pandas as pd
+
+    partitions = list_partitions() if partitions is None else list(partitions)
+    frames = []
+    for partition in partitions:
+        directory = partition_dir(partition)
+        if table_exists(name, directory=directory):
+            df = load_table(name, directory=directory, **kwargs)
+            df.insert(0, 'partition', pd.Categorical([partition] * len(df), categories=partitions))
+            frames.append(df)
+    if not frames:
+        raise FileNotFoundError(f"Table {name} absente des partitions {', '.join(partitions) or '(aucune)'}")
+    return pd.concat(frames, ignore_index=True)
+
+
+#####################################################################################
+#                               TYPAGE
+#####################################################################################
+
+# Colonne convertie au type attendu, None si elle l'a déjà
+def typed_column(series):
+    import pandas as pd
+
+    col = series.name
+    if col in categorical_columns:
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return series.astype('category')
+        if series.cat.codes.nunique() - (series.cat.codes < 0).any() < len(series.cat.categories):
+            return series.cat.remove_unused_categories()
+    elif col in date_columns:
+        if not pd.api.types.is_datetime64_dtype(series.dtype):
+            return pd.to_datetime(series, errors='coerce').dt.normalize()
+        normalized = series.dt.normalize()
+        if not normalized.equals(series):
+            return normalized
+    elif col.endswith(float_suffix):
+        if series.dtype != 'float32':
+            return pd.to_numeric(series, errors='coerce').astype('float32')
+    elif col in id_columns:
+        if series.dtype != 'int32':
+            return pd.to_numeric(series, errors='coerce').fillna(-1).astype('int32')
+    return None
+
+
+# Le DataFrame n'est copié (copie superficielle) que si une colonne change de type
+def apply_types(df):
+    typed = df
+    for col in df.columns:
+        converted = typed_column(df[col])
+        if converted is not None:
+            if typed is df:
+                typed = df.copy(deep=False)
+            typed[col] = converted
+    return typed
+
+
+#####################################################################################
+#                               ÉCRITURE
+#####################################################################################
+
+# csv : copie CSV (None = selon export_csv et csv_tables), ex : False pour les tables horaires
+# names : colonnes commune / station ajoutées à la copie CSV à côté des identifiants (dimensions.with_names),
+# Power BI n'a pas à joindre dim_commune / dim_station ; False pour les dimensions elles-mêmes
+def save_table(df, name, directory=None, csv=None, names=True):
+    os.makedirs(directory or clean_dir, exist_ok=True)
+    df = apply_types(df)
+
+    if backend == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Dates stockées en vrai type date (date32) et non en timestamp
+        for col in date_columns:
+            if col in table.column_names:
+                idx = table.column_names.index(col)
+                table = table.set_column(idx, col, table.column(col).cast(pa.date32()))
+        pq.write_table(table, table_path(name, "parquet", directory), compression="zstd")
+    else:
+        df.to_csv(table_path(name, "csv", directory), index=False)
+
+    if has_csv_copy(name, csv):
+        csv_df = df
+        if names and any(col in df.columns for col in id_columns):
+            import dimensions
+            csv_df = dimensions.with_names(df)
+        csv_df.to_csv(table_path(name, "csv", directory), index=False)
+
+    instrumentation.count("rows_out", len(df))
+    instrumentation.count_file("bytes_written", table_path(name, directory=directory))
+
+
+#####################################################################################
+#                               LECTURE
+#####################################################################################
+
+# columns : projection (None = toutes les colonnes)
+# date_range : (début, fin) inclus, filtré à la lecture sur date_column (None = pas de borne)
+# filters : filtres supplémentaires [(colonne, "==", valeur), ...] (ex : [("polluant", "==", "NO2")])
+def load_table(name, columns=None, date_range=None, date_column="date_local", filters=None, directory=None):
+    import pandas as pd
+
+    conditions = list(filters or [])
+    if date_range is not None:
+        start, end = date_range
+        if start is not None:
+            conditions.append((date_column, ">=", pd.Timestamp(start)))
+        if end is not None:
+            conditions.append((date_column, "<=", pd.Timestamp(end)))
+
+    if backend == "parquet":
+        import pyarrow.parquet as pq
+
+        # les colonnes date32 se comparent à des dates, pas à des timestamps
+        arrow_filters = [
+            (col, op, val.date() if isinstance(val, pd.Timestamp) else val)
+            for col, op, val in conditions
+        ]
+        table = pq.read_table(table_path(name, "parquet", directory), columns=columns, filters=arrow_filters or None)
+        instrumentation.count("rows_in", table.num_rows)
+        instrumentation.count("bytes_read", table.nbytes)
+        return table.to_pandas(date_as_object=False)
+
+    instrumentation.count_file("bytes_read", table_path(name, "csv", directory))
+    df = pd.read_csv(table_path(name, "csv", directory), usecols=columns)
+    df = apply_types(df)
+    if conditions:
+        mask = pd.Series(True, index=df.index)
+        for col, op, val in conditions:
+            mask &= comparisons[op](df[col], val)
+        df = df[mask].reset_index(drop=True)
+    instrumentation.count("rows_in", len(df))
+    return df
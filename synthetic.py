@@ -0,0 +1,272 @@
+# synthetic.py
+# Données synthétiques et serveurs HTTP locaux (stubs airpl.org / Opendatasoft v2.1)
+# partagés par les benchmarks (benchmark.py) et les tests (tests/), sans accès réseau
+import re
+import json
+import time
+import bisect
+import operator
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import extract_data
+import raw_store
+
+
+#####################################################################################
+#                               DONNÉES SYNTHÉTIQUES
+#####################################################################################
+
+nom_polluants = {code: name for name, code in extract_data.polluants.items()}
+
+
+# Un record au format de l'API airpl (mêmes champs annexes que les vrais exports)
+def make_pollution_record(dep, i, day, code):
+    return {
+        "id": day.toordinal() * 1000 + i,
+        "code_configuration_de_mesure": f"FR{dep}{i:03d}_{code}",
+        "code_point_de_prelevement": f"FR{dep}{i:03d}",
+        "code_station": f"FR{dep}{i:03d}",
+        "nom_station": f"Station {dep}-{i}",
+        "code_commune": f"{dep}{i:03d}",
+        "nom_commune": f"Commune {dep}-{i}",
+        "departement_code": dep,
+        "code_polluant": code,
+        "nom_polluant": nom_polluants.get(code, code),
+        "unite": "microg/m3",
+        "valeur": (day.toordinal() * 7 + i * 13) % 120,
+        "validite": True,
+        "date_heure_local": day.strftime("%Y-%m-%dT%H:%M:%S+01:00"),
+        "date_heure_tu": day.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "x_wgs84": -1.55,
+        "y_wgs84": 47.21,
+    }
+
+
+def make_pollution_records(stations, days, code="24"):
+    start = datetime(2022, 1, 1)
+    return [
+        make_pollution_record(f"{44 + s % 5}", s, start + timedelta(days=d), code)
+        for d in range(days)
+        for s in range(stations)
+    ]
+
+
+# Records Opendatasoft v1 (population) : {"recordid", "fields": {...}}
+def make_population_records(communes):
+    return [
+        {"recordid": f"pop{c}", "fields": {
+            "code_commune": f"{44 + c % 5}{c:03d}",
+            "nom_de_la_commune": f"Commune {44 + c % 5}-{c}",
+            "population_totale": 500 + (c * 7919) % 50000,
+            "tranche_population": ["< 2 000", "2 000 - 10 000", "> 10 000"][c % 3],
+        }}
+        for c in range(communes)
+    ]
+
+
+# Un établissement au format SIRENE de l'API explore v2.1 (records à plat)
+enterprise_sections = ["A", "C", "F", "G", "I", "M", "N", "Q"]
+
+
+def make_enterprise_record(e, communes=100):
+    c = e % communes
+    created = datetime(2024, 1, 1) + timedelta(days=e % 600)
+    closed = created + timedelta(days=90) if e % 7 == 0 else None
+    processed = (closed or created) + timedelta(hours=10)
+    section = enterprise_sections[e % len(enterprise_sections)]
+    return {
+        "siret": f"{e:014d}",
+        "codecommuneetablissement": f"{44 + c % 5}{c:03d}",
+        "libellecommuneetablissement": f"Commune {44 + c % 5}-{c}",
+        "etatadministratifetablissement": "F" if closed else "A",
+        "activiteprincipaleetablissement": f"{(e * 31) % 99:02d}.{(e * 7) % 9}{e % 3}Z",
+        "soussectionetablissement": f"{section}{e % 4}",
+        "sectionetablissement": section,
+        "datecreationetablissement": created.strftime("%Y-%m-%d"),
+        "datefermetureetablissement": closed.strftime("%Y-%m-%d") if closed else None,
+        "datederniertraitementetablissement": processed.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# Ancien format de datas/ : un seul document JSON indenté {"count": n, key: [...]}
+def write_legacy_file(path, key, records):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"count": len(records), key: records}, f, ensure_ascii=False, indent=4)
+    return len(records)
+
+
+def write_pollution_file(path, stations, days, code="24"):
+    return write_legacy_file(path, "results", make_pollution_records(stations, days, code))
+
+
+# Jeux de données bruts synthétiques, par nom de dataset raw_store
+def make_raw_datasets(stations=50, days=1080, communes=1200, enterprises=20000, polluants=("PM10", "NO2")):
+    datasets = {
+        f"{polluant}_Data": make_pollution_records(stations, days, extract_data.polluants[polluant])
+        for polluant in polluants
+    }
+    datasets["population_data"] = make_population_records(communes)
+    datasets["enterprise_data"] = [make_enterprise_record(e) for e in range(enterprises)]
+    return datasets
+
+
+# Écrire les datasets bruts dans raw_store.raw_dir (legacy : anciens fichiers .json indentés)
+def write_raw_files(stations=50, days=1080, communes=1200, enterprises=20000, polluants=("PM10", "NO2"), legacy=False):
+    for name, records in make_raw_datasets(stations, days, communes, enterprises, polluants).items():
+        if legacy:
+            key = raw_store.legacy_keys.get(name, raw_store.legacy_default_key)
+            write_legacy_file(raw_store.legacy_path(name), key, records)
+        else:
+            raw_store.write_records(name, records)
+
+
+# Mesures journalières synthétiques (stations x jours), avec ~5 % de jours manquants
+def make_daily_measures(stations, days, value_col="no2_value", seed=0):
+    rng = np.random.default_rng(seed)
+    station_idx = np.repeat(np.arange(stations), days)
+    day_idx = np.tile(np.arange(days), stations)
+    # Série autocorrélée par station pour avoir de vrais épisodes de plusieurs jours
+    noise = rng.normal(0, 25, stations * days).reshape(stations, days)
+    values = 120 + pd.DataFrame(noise.T).ewm(alpha=0.3).mean().to_numpy().T.ravel() * 4
+    keep = rng.random(stations * days) > 0.05
+    names = np.array([f"Station {i}" for i in range(stations)])
+    return pd.DataFrame({
+        "commune_id": (station_idx[keep] // 2).astype("int32"),
+        "station_id": station_idx[keep].astype("int32"),
+        "commune": pd.Categorical(np.array([f"Commune {i // 2}" for i in range(stations)])[station_idx[keep]]),
+        "station": pd.Categorical(names[station_idx[keep]]),
+        "date_local": pd.Timestamp("2015-01-01") + pd.to_timedelta(day_idx[keep], unit="D"),
+        value_col: values[keep].astype("float32"),
+    })
+
+
+#####################################################################################
+#                               SERVEUR HTTP LOCAL (STUB airpl.org)
+#####################################################################################
+
+STATIONS_PAR_DEPARTEMENT = 3
+
+# Latence simulée : fixe par requête + proportionnelle au volume renvoyé
+LATENCE_REQUETE = 0.05  # secondes
+LATENCE_PAR_RECORD = 0.0002  # secondes
+
+
+def parse_range(value):
+    start, end = value.split(",")
+    return datetime.fromisoformat(start.strip()), datetime.fromisoformat(end.strip())
+
+
+class PollutionStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, pour mesurer l'effet de la session
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        code = query.get("code_configuration_de_mesure__code_point_de_prelevement__code_polluant", ["24"])[0]
+        deps = query.get(
+            "code_configuration_de_mesure__code_point_de_prelevement__code_station__code_commune__code_departement__in",
+            [""],
+        )[0]
+        start, end = parse_range(query["date_heure_tu__range"][0])
+
+        records = []
+        for dep in [d for d in deps.split(",") if d]:
+            day = datetime(start.year, start.month, start.day)
+            if day < start:
+                day += timedelta(days=1)
+            while day <= end:
+                for i in range(STATIONS_PAR_DEPARTEMENT):
+                    records.append(make_pollution_record(dep, i, day, code))
+                day += timedelta(days=1)
+
+        time.sleep(LATENCE_REQUETE + LATENCE_PAR_RECORD * len(records))
+        body = json.dumps({"count": len(records), "next": None, "results": records}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+#####################################################################################
+#                               SERVEUR HTTP LOCAL (STUB Opendatasoft v2.1)
+#####################################################################################
+
+# Dataset SIRENE simulé, trié par date de création (comme le vrai tri par défaut)
+SIRENE_RECORDS = []
+SIRENE_DATES = []
+
+
+def ods_where_filter(where):
+    # Seules les clauses '<champ> <op> "YYYY-MM-DD"' reliées par AND sont comprises
+    # (date de création : recherche dichotomique, autres champs : filtre, valeurs nulles exclues)
+    lo, hi = 0, len(SIRENE_RECORDS)
+    others = []
+    for field, op, value in re.findall(r'(\w+)\s*(>=|>|<=|<)\s*"(\d{4}-\d{2}-\d{2})"', where or ""):
+        if field != "datecreationetablissement":
+            others.append((field, op, value))
+        elif op == ">=":
+            lo = max(lo, bisect.bisect_left(SIRENE_DATES, value))
+        elif op == ">":
+            lo = max(lo, bisect.bisect_right(SIRENE_DATES, value))
+        elif op == "<=":
+            hi = min(hi, bisect.bisect_right(SIRENE_DATES, value))
+        else:
+            hi = min(hi, bisect.bisect_left(SIRENE_DATES, value))
+    records = SIRENE_RECORDS[lo:max(lo, hi)]
+    compare = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt}
+    for field, op, value in others:
+        records = [r for r in records if r.get(field) and compare[op](r[field][:10], value)]
+    return records
+
+
+class OdsStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        records = ods_where_filter(query.get("where", [""])[0])
+
+        if url.path.endswith("/exports/jsonl"):
+            body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+            return self.send_body(200, body, "application/jsonl")
+
+        order_by = query.get("order_by", [""])[0]
+        if order_by:
+            records = sorted(records, key=lambda r: r.get(order_by) or "")
+        limit = int(query.get("limit", ["10"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        if offset + limit > extract_data.ods_max_offset:
+            body = json.dumps({"error_code": "InvalidRESTParameterError",
+                               "message": "offset + limit must be lower than 10000"}).encode("utf-8")
+            return self.send_body(400, body, "application/json")
+
+        time.sleep(LATENCE_REQUETE)
+        body = json.dumps({"total_count": len(records), "results": records[offset:offset + limit]}).encode("utf-8")
+        self.send_body(200, body, "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,56 @@
+# tests/conftest.py
+# Chaque test travaille dans un répertoire temporaire : datas/, data_clean/, cache/, metrics/ et export_auto/
+# redirigés, cache des étapes désactivé. Les serveurs locaux (stub airpl / Opendatasoft) sont ceux de synthetic.py
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import storage
+import raw_store
+import export_excel
+import instrumentation
+import synthetic
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(raw_store, "raw_dir", str(tmp_path / "datas"))
+    monkeypatch.setattr(storage, "clean_dir", str(tmp_path / "data_clean"))
+    monkeypatch.setattr(storage, "shared_dir", None)
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "enabled", False)
+    monkeypatch.setattr(cache, "_hashes", None)
+    monkeypatch.setattr(instrumentation, "metrics_dir", str(tmp_path / "metrics"))
+    monkeypatch.setattr(export_excel, "export_dir", str(tmp_path / "export_auto"))
+    os.makedirs(raw_store.raw_dir)
+    return tmp_path
+
+
+# Serveur HTTP local : start(handler) -> url, arrêté en fin de test
+@pytest.fixture
+def http_server():
+    servers = []
+
+    def start(handler):
+        server, url = synthetic.start_stub_server(handler)
+        servers.append(server)
+        return url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+# Stub airpl sans latence simulée
+@pytest.fixture
+def airpl_url(http_server, monkeypatch):
+    monkeypatch.setattr(synthetic, "LATENCE_REQUETE", 0)
+    monkeypatch.setattr(synthetic, "LATENCE_PAR_RECORD", 0)
+    url = http_server(synthetic.PollutionStubHandler)
+    import extract_data
+    monkeypatch.setattr(extract_data, "pollution_url", url)
+    return url
@@ -0,0 +1,69 @@
+# tests/test_database.py
+# Analyses SQL (database.py) contre les moteurs numpy (episodes.py, normes.py) sur les mêmes tables
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+import synthetic
+import database
+import episodes
+import normes
+import storage
+
+
+@pytest.fixture
+def measures():
+    frames = {}
+    for seed, polluant in enumerate(["NO2", "PM10"]):
+        df = synthetic.make_daily_measures(40, 800, storage.value_column(polluant), seed=seed)
+        if polluant == "PM10":
+            df["pm10_value"] = df["pm10_value"] / 3  # autour des seuils PM10 (50 et 80)
+        storage.save_table(df.drop(columns=["commune", "station"]), f"{polluant}_data")
+        frames[polluant] = storage.load_table(f"{polluant}_data")
+    ids = np.arange(40, dtype="int32")
+    storage.save_table(pd.DataFrame({"commune_id": ids // 2, "code_insee": [f"44{i:03d}" for i in ids // 2],
+                                     "commune": [f"Commune {i}" for i in ids // 2]}).drop_duplicates(), "dim_commune")
+    storage.save_table(pd.DataFrame({"station_id": ids, "code_station": [f"FR{i:05d}" for i in ids],
+                                     "station": [f"Station {i}" for i in ids], "commune_id": ids // 2}), "dim_station")
+    database.build_database(incremental=False)
+    return frames
+
+
+@pytest.mark.parametrize("polluant, norme_id", [("NO2", "no2_3jours"), ("PM10", "pm10_alerte")])
+def test_sql_episodes_match_numpy(measures, polluant, norme_id):
+    norme = normes.get_norme(norme_id)
+    expected = episodes.detect_episodes(measures[polluant], storage.value_column(polluant), norme["valeur"],
+                                        min_days=norme["jours_consecutifs"])
+    result = database.detect_episodes(polluant, norme["valeur"], norme["jours_consecutifs"])
+    assert len(expected) > 0
+    expected = expected.sort_values(["commune_id", "station_id", "date_debut"]).reset_index(drop=True)
+    pdt.assert_frame_equal(result, expected[list(result.columns)], check_dtype=False, rtol=1e-5)
+
+
+def test_sql_norms_match_numpy(measures):
+    expected = normes.evaluate_norms(measures)
+    result = database.evaluate_norms()
+    assert set(expected["norme_id"]) >= {"no2_3jours", "pm10_limite_journaliere", "pm10_annuel"}
+    columns = ["polluant", "commune_id", "station_id", "annee", "norme_id", "nb_depassements", "non_conforme"]
+    pdt.assert_frame_equal(result[columns], expected[columns], check_dtype=False)
+
+
+def test_unchanged_tables_leave_database_untouched(measures):
+    stat = os.stat(database.database_path())
+    database.build_database()
+    assert os.stat(database.database_path()).st_mtime_ns == stat.st_mtime_ns
+
+    storage.save_table(storage.load_table("NO2_data").iloc[:-10], "NO2_data")
+    database.build_database()
+    assert os.stat(database.database_path()).st_mtime_ns != stat.st_mtime_ns
+
+
+# URI de connexion en lecture seule : caractères réservés dans le chemin
+def test_readonly_connection_with_reserved_characters(measures, tmp_path, monkeypatch):
+    directory = tmp_path / "data #1?"
+    directory.mkdir()
+    shutil.copy(database.database_path(), directory / database.database_name)
+    monkeypatch.setattr(storage, "clean_dir", str(directory))
+    assert database.query_rows("SELECT COUNT(*) FROM dim_station")[0][0] == 40
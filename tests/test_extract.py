@@ -0,0 +1,98 @@
+# tests/test_extract.py
+# Téléchargements contre les serveurs locaux de synthetic.py (stub airpl, stub Opendatasoft v2.1)
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+import pytest
+import requests
+import synthetic
+import extract_data
+import raw_store
+
+
+def records(name):
+    return list(raw_store.iter_records(name))
+
+
+def test_concurrent_fetch_matches_serial(airpl_url):
+    start, end = datetime(2024, 1, 1), datetime(2024, 3, 10)
+    extract_data.fetch_pollution_data(start, end)
+    serial = {name: records(f"{name}_Data") for name in extract_data.polluants}
+
+    extract_data.fetch_pollution_data_concurrent(start, end, chunk_days=20)
+    for name in extract_data.polluants:
+        concurrent = records(f"{name}_Data")
+        assert len(concurrent) == len(serial[name]) > 0
+        assert sorted(r["id"] for r in concurrent) == sorted(r["id"] for r in serial[name])
+
+
+def test_incremental_fetch_adds_only_new_days(airpl_url):
+    start = datetime(2024, 1, 1)
+    extract_data.fetch_pollution_data_concurrent(start, datetime(2024, 2, 1), chunk_days=10)
+    extract_data.fetch_pollution_data_concurrent(start, datetime(2024, 3, 1), chunk_days=10, incremental=True)
+    incremental = records("NO2_Data")
+
+    extract_data.fetch_pollution_data_concurrent(start, datetime(2024, 3, 1), chunk_days=10)
+    full = records("NO2_Data")
+    assert sorted(r["id"] for r in incremental) == sorted(r["id"] for r in full)
+
+
+class FailingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_fetch_error_fails_without_overwriting(http_server, monkeypatch):
+    raw_store.write_records("NO2_Data", [{"id": 1}])
+    monkeypatch.setattr(extract_data, "pollution_url", http_server(FailingHandler))
+
+    with pytest.raises(RuntimeError):
+        extract_data.fetch_pollution_data_concurrent(datetime(2024, 1, 1), datetime(2024, 1, 10))
+    with pytest.raises(requests.exceptions.HTTPError):
+        extract_data.fetch_pollution_data(datetime(2024, 1, 1), datetime(2024, 1, 10))
+    assert records("NO2_Data") == [{"id": 1}]
+
+
+@pytest.fixture
+def sirene(http_server, monkeypatch):
+    dataset = [synthetic.make_enterprise_record(e, communes=50) for e in range(3000)]
+    dataset.sort(key=lambda r: r["datecreationetablissement"])
+    monkeypatch.setattr(synthetic, "SIRENE_RECORDS", dataset)
+    monkeypatch.setattr(synthetic, "SIRENE_DATES", [r["datecreationetablissement"] for r in dataset])
+    monkeypatch.setattr(synthetic, "LATENCE_REQUETE", 0)
+    monkeypatch.setattr(extract_data, "ods_base_url", http_server(synthetic.OdsStubHandler).rstrip("/"))
+    # plafond de l'API records abaissé : le mode pages doit découper les fenêtres de dates
+    monkeypatch.setattr(extract_data, "ods_max_offset", 500)
+    monkeypatch.setattr(extract_data, "ods_page_size", 100)
+    monkeypatch.setattr(extract_data, "ods_rate_limit", 0)
+    return dataset
+
+
+@pytest.mark.parametrize("mode", ["export", "pages"])
+def test_enterprise_fetch_past_api_limit(sirene, mode):
+    extract_data.fetch_enterprise_data(mode=mode, max_workers=4)
+    expected = {r["siret"] for r in sirene if r["datecreationetablissement"] > "2024-01-01"}
+    fetched = [r["siret"] for r in records("enterprise_data")]
+    assert len(fetched) == len(expected) > extract_data.ods_max_offset
+    assert set(fetched) == expected
+
+
+# Fermeture d'un établissement créé bien avant le dernier fetch : reprise par la date de dernier traitement
+@pytest.mark.parametrize("mode", ["export", "pages"])
+def test_incremental_enterprise_fetch_refreshes_closures(sirene, mode):
+    extract_data.fetch_enterprise_data(mode=mode, max_workers=4)
+    watermark = extract_data.load_watermarks()["enterprise"]
+
+    old = next(r for r in sirene if "2024-02" < r["datecreationetablissement"] and not r["datefermetureetablissement"])
+    old.update(etatadministratifetablissement="F", datefermetureetablissement="2026-01-05",
+               datederniertraitementetablissement="2026-01-05T09:00:00")
+    extract_data.fetch_enterprise_data(incremental=True, mode=mode, max_workers=4)
+
+    fetched = {r["siret"]: r for r in records("enterprise_data")}
+    assert len(fetched) == sum(1 for r in sirene if r["datecreationetablissement"] > "2024-01-01")
+    assert fetched[old["siret"]]["datefermetureetablissement"] == "2026-01-05"
+    assert watermark < extract_data.load_watermarks()["enterprise"] == "2026-01-05T09:00:00"
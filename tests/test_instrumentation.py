@@ -0,0 +1,42 @@
+# tests/test_instrumentation.py
+# Mesures des étapes (instrumentation.py) : threads de fond, lignes comptées et rapports écrits par renommage
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import synthetic
+import process_data
+import instrumentation
+
+
+def test_background_thread_counts_for_its_stage():
+    def stage():
+        with ThreadPoolExecutor(max_workers=1) as background:
+            background.submit(instrumentation.bind(instrumentation.count), "rows_out", 5).result()
+            background.submit(instrumentation.count, "rows_out", 100).result()  # thread sans étape : ignoré
+        instrumentation.count("rows_out", 1)
+
+    assert instrumentation.run_stage("export_excel", stage)["rows_out"] == 6
+
+
+def test_concurrent_reports_use_distinct_temporary_files():
+    path = os.path.join(instrumentation.metrics_dir, "pipeline.prom")
+    texts = [f"run {i}\n" * 20000 for i in range(8)]
+    barrier = threading.Barrier(len(texts))
+
+    def write(text):
+        barrier.wait()
+        instrumentation.write_atomic(path, text)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        list(executor.map(write, texts))  # relance l'erreur d'un thread
+
+    with open(path, encoding="utf-8") as f:
+        assert f.read() in texts
+    assert os.listdir(instrumentation.metrics_dir) == ["pipeline.prom"]
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+
+def test_row_counts_leave_out_dimension_tables():
+    synthetic.write_raw_files(stations=5, days=10, communes=20, enterprises=50, polluants=("NO2",))
+    result = instrumentation.run_stage("process_NO2", lambda: process_data.process_polluant_data("NO2"))
+    assert result["rows_in"] == result["rows_out"] == 50
@@ -0,0 +1,120 @@
+# tests/test_live_alerts.py
+# Service d'alertes en continu contre le serveur de rejeu : mêmes épisodes que le calcul batch
+import asyncio
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+import synthetic
+import episodes
+import extract_data
+import live_alerts
+import normes
+
+
+def make_records(stations=20, days=90, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for d in range(days):
+        day = datetime(2023, 1, 1) + timedelta(days=d)
+        for s, value in enumerate(np.minimum(rng.gamma(4.0, 55.0, stations), 999).round(1)):
+            record = synthetic.make_pollution_record("44", s, day, extract_data.polluants["NO2"])
+            record["valeur"] = float(value)
+            records.append(record)
+    return records
+
+
+def batch_episodes(records, norme):
+    df = pd.DataFrame({
+        "commune_id": np.zeros(len(records), dtype="int32"),
+        "station_id": np.array([int(r["code_station"][-3:]) for r in records], dtype="int32"),
+        "date_local": pd.to_datetime([r["date_heure_local"][:10] for r in records]),
+        "valeur": np.array([r["valeur"] for r in records], dtype="float32"),
+    })
+    return episodes.detect_episodes(df, "valeur", norme["valeur"], min_days=norme["jours_consecutifs"])
+
+
+@pytest.fixture
+def replay_server(monkeypatch):
+    servers = []
+
+    def start(records):
+        replay = live_alerts.Replay(records, speed=None)
+        server, url = live_alerts.start_replay_server(replay)
+        servers.append(server)
+        monkeypatch.setattr(extract_data, "pollution_url", url)
+        return replay
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def follow(service, replay):
+    async def loop():
+        events = []
+        while not replay.finished():
+            events += await service.poll()
+            replay.advance()
+        return events
+    return asyncio.run(loop())
+
+
+def alert_keys(events):
+    return sorted((e["code_station"], e["date_debut"]) for e in events if e["type"] == "alerte")
+
+
+def test_streamed_alerts_match_batch(replay_server):
+    records = make_records()
+    norme = normes.get_norme("no2_3jours")
+    replay = replay_server(records)
+    service = live_alerts.AlertService(norms=[norme["id"]], handlers=[], clock=replay.now)
+    events = follow(service, replay)
+
+    expected = batch_episodes(records, norme)
+    assert len(expected) > 0
+    assert alert_keys(events) == sorted(
+        (f"FR44{station:03d}", f"{start:%Y-%m-%d}")
+        for station, start in zip(expected["station_id"], expected["date_debut"]))
+
+
+def test_restart_resumes_from_saved_state(replay_server):
+    records = make_records(seed=1)
+    norme = normes.get_norme("no2_3jours")
+    replay = replay_server(records)
+    events = []
+    for _ in range(2):
+        # nouveau service à mi-parcours : l'état est relu depuis data_clean/live/state.json
+        service = live_alerts.AlertService(norms=[norme["id"]], handlers=[], clock=replay.now)
+        for _ in range(45):
+            if not replay.finished():
+                events += asyncio.run(service.poll())
+                replay.advance()
+    events += follow(live_alerts.AlertService(norms=[norme["id"]], handlers=[], clock=replay.now), replay)
+
+    expected = batch_episodes(records, norme)
+    assert len(alert_keys(events)) == len(expected)
+
+
+# Interrogation en cours de journée : la matinée publiée ne suffit pas à juger le jour,
+# l'alerte tombe quand le jour est terminé
+def test_open_day_is_evaluated_once_complete(replay_server):
+    norme = normes.get_norme("pm10_alerte")
+    records = []
+    for d, values in enumerate([[10] * 24, [10] * 12 + [290] * 12]):
+        for hour, value in enumerate(values):
+            record = synthetic.make_pollution_record("44", 0, datetime(2023, 1, 1 + d, hour),
+                                                     extract_data.polluants["PM10"])
+            record["valeur"] = value
+            records.append(record)
+    replay = replay_server(records)
+    service = live_alerts.AlertService(norms=[norme["id"]], handlers=[], clock=replay.now)
+
+    assert asyncio.run(service.poll()) == []
+    replay.advance(days=0, hours=12)
+    assert replay.now() == datetime(2023, 1, 2, 12)
+    assert asyncio.run(service.poll()) == []
+    replay.advance(days=0, hours=12)
+    events = asyncio.run(service.poll())
+    assert [(e["type"], e["date_debut"], e["valeur_max"]) for e in events] == [("alerte", "2023-01-02", 150.0)]
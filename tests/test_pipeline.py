@@ -0,0 +1,55 @@
+# tests/test_pipeline.py
+# Pipeline complet (hors fetch) sur un petit jeu synthétique écrit dans datas/
+import os
+from datetime import datetime
+import pytest
+import synthetic
+import cache
+import export_excel
+import pipeline
+
+
+@pytest.fixture
+def stages():
+    synthetic.write_raw_files(stations=10, days=120, communes=60, enterprises=500)
+    return pipeline.build_stages(datetime(2022, 1, 1), datetime(2022, 5, 1))
+
+
+def run(stages, **kwargs):
+    selected = [stage for stage in stages if stage.group != "fetch"]
+    status, _ = pipeline.run(stages, selected, metrics=False, **kwargs)
+    failed = {name: state for name, state in status.items() if state in ("échec", "bloqué")}
+    assert not failed
+    return status
+
+
+def test_run_without_cache_stores_nothing(stages, monkeypatch):
+    monkeypatch.setattr(cache, "enabled", True)
+    status = run(stages, use_cache=False)
+    assert status["run_export"] == "ok"
+    assert os.stat(export_excel.export_path()).st_mode & 0o777 == 0o644
+    assert not os.path.exists(cache.charts_dir()) and not os.path.exists(cache.stages_dir())
+    assert cache.enabled
+
+
+def test_cached_run_restores_outputs(stages, monkeypatch):
+    monkeypatch.setattr(cache, "enabled", True)
+    run(stages)
+    assert os.listdir(cache.charts_dir())
+    # mêmes données réécrites : dates plus récentes, contenu identique
+    synthetic.write_raw_files(stations=10, days=120, communes=60, enterprises=500)
+    status = run(stages)
+    assert status["process_NO2"] == "en cache"
+
+
+def test_missing_dependency_is_rejected(stages):
+    without_fetch = [stage for stage in stages if stage.group != "fetch"]
+    with pytest.raises(ValueError, match="fetch_pollution"):
+        pipeline.run(without_fetch, metrics=False)
+
+
+def test_dependency_cycle_blocks_instead_of_spinning():
+    first = pipeline.Stage("first", print, inputs=["b"], outputs=["a"])
+    second = pipeline.Stage("second", print, inputs=["a"], outputs=["b"])
+    status, _ = pipeline.run(pipeline.build_graph([first, second]), metrics=False)
+    assert status == {"first": "bloqué", "second": "bloqué"}
@@ -0,0 +1,24 @@
+# tests/test_raw_store.py
+# Fusion d'un delta dans le cache brut (raw_store.merge_records)
+import os
+import raw_store
+
+
+def test_merge_streams_delta_once_and_delta_wins():
+    raw_store.write_records("NO2_Data", [{"id": i, "valeur": 0, "jour": f"2024-01-{i + 1:02d}"} for i in range(5)])
+    consumed = []
+
+    # générateur à usage unique : le delta n'est parcouru qu'une fois
+    def delta():
+        for i in range(3, 8):
+            consumed.append(i)
+            yield {"id": i, "valeur": 1, "jour": f"2024-01-{i + 1:02d}"}
+
+    count = raw_store.merge_records("NO2_Data", delta(), lambda r: r["id"], keep=lambda r: r["jour"] >= "2024-01-02")
+
+    records = list(raw_store.iter_records("NO2_Data"))
+    assert consumed == list(range(3, 8))
+    assert count == len(records) == 7
+    assert [(r["id"], r["valeur"]) for r in records] == [(1, 0), (2, 0)] + [(i, 1) for i in range(3, 8)]
+    assert sorted(name for name in os.listdir(raw_store.raw_dir)) == [
+        "NO2_Data" + raw_store.extensions[raw_store.compression]]
@@ -0,0 +1,65 @@
+# tests/test_rollup.py
+# Mise à jour incrémentale des cubes (rollup.py) contre une reconstruction complète
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+import synthetic
+import rollup
+import storage
+
+
+def save_measures(df, first, last):
+    days = df[(df["date_local"] >= first) & (df["date_local"] <= last)]
+    storage.save_table(days.drop(columns=["commune", "station"]), "NO2_data")
+
+
+def load_cubes():
+    return {grain: storage.load_table(table) for grain, (table, _) in rollup.cubes.items()}
+
+
+# Fenêtre glissante : jours ajoutés à la fin, jours sortis au début (au milieu d'un mois et d'une année)
+@pytest.mark.parametrize("first", ["2015-01-01", "2015-03-17", "2016-01-09"])
+def test_incremental_rollup_matches_full_rebuild(first):
+    df = synthetic.make_daily_measures(20, 600)
+    save_measures(df, "2015-01-01", "2016-03-31")
+    rollup.build_rollups(incremental=False)
+
+    save_measures(df, first, "2016-08-22")
+    rollup.build_rollups(incremental=True)
+    incremental = load_cubes()
+    rollup.build_rollups(incremental=False)
+    full = load_cubes()
+
+    assert incremental["journalier"]["date_local"].min() == full["journalier"]["date_local"].min()
+    for grain in rollup.cubes:
+        pdt.assert_frame_equal(incremental[grain], full[grain], check_exact=False, rtol=1e-6)
+
+
+# Tables construites depuis le cube : exposition journalière et séries par station
+@pytest.mark.parametrize("first", ["2015-03-17", "2016-03-01"])
+def test_cube_consumers_drop_days_out_of_window(first):
+    import exposition
+    import timeseries
+
+    df = synthetic.make_daily_measures(20, 600)
+    ids = np.arange(20, dtype="int32")
+    storage.save_table(pd.DataFrame({"station_id": ids, "code_station": [f"FR{i:05d}" for i in ids],
+                                     "station": [f"Station {i}" for i in ids], "commune_id": ids // 2}), "dim_station")
+    save_measures(df, "2015-01-01", "2016-03-31")
+    rollup.build_rollups(incremental=False)
+    exposition.build_daily_exposure(incremental=False)
+    timeseries.build_series(incremental=False)
+
+    save_measures(df, first, "2016-08-22")
+    rollup.build_rollups(incremental=True)
+    results = []
+    for incremental in [True, False]:
+        daily = exposition.build_daily_exposure(incremental=incremental)
+        timeseries.build_series(incremental=incremental)
+        window = np.array(timeseries.open_series("NO2").window(daily["date_local"].min()))
+        results.append((daily, timeseries.regional_daily_mean("NO2"), pd.DataFrame(window)))
+
+    for incremental, full in zip(*results):
+        pdt.assert_frame_equal(incremental, full, check_exact=False, rtol=1e-6)
+    assert results[0][1]["date_local"].min() == results[0][0]["date_local"].min()
@@ -0,0 +1,54 @@
+# tests/test_storage.py
+# Tables de data_clean/ : typage et copie CSV pour Power BI
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import synthetic
+import process_data
+import storage
+
+
+def test_csv_copies_keep_commune_and_station_names():
+    synthetic.write_raw_files(stations=5, days=10, communes=20, enterprises=50, polluants=("NO2",))
+    process_data.process_polluant_data("NO2")
+    process_data.process_population_data()
+    process_data.process_enterprise_data()
+
+    no2 = pd.read_csv(storage.table_path("NO2_data", "csv"))
+    assert list(no2.columns[:4]) == ["station_id", "station", "commune_id", "commune"]
+    assert set(no2["station"]) == {f"Station {44 + s % 5}-{s}" for s in range(5)}
+    for name in ["population_data", "enterprise_data"]:
+        assert "commune" in pd.read_csv(storage.table_path(name, "csv")).columns
+    # la table Parquet garde les seuls identifiants
+    assert "station" not in storage.load_table("NO2_data").columns
+    assert list(pd.read_csv(storage.table_path("dim_station", "csv")).columns) == \
+        ["station_id", "code_station", "station", "commune_id"]
+
+
+def test_apply_types_copies_only_when_casting():
+    typed = pd.DataFrame({
+        "commune_id": np.arange(3, dtype="int32"),
+        "date_local": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03"]),
+        "no2_value": np.ones(3, dtype="float32"),
+        "polluant": pd.Categorical(["NO2"] * 3),
+    })
+    assert storage.apply_types(typed) is typed
+
+    raw = typed.assign(commune_id=[0, 1, None], date_local=["2024-01-01 10:00", "2024-01-02", None],
+                       polluant=pd.Categorical(["NO2"] * 3, categories=["NO2", "PM10"]))
+    converted = storage.apply_types(raw)
+    assert converted["commune_id"].tolist() == [0, 1, -1] and converted["commune_id"].dtype == "int32"
+    assert converted["date_local"].iloc[0] == pd.Timestamp("2024-01-01")
+    assert list(converted["polluant"].cat.categories) == ["NO2"]
+    assert raw["commune_id"].isna().iloc[2] and raw["date_local"].iloc[0] == "2024-01-01 10:00"
+
+
+
+@pytest.mark.skipif(storage.backend == "csv", reason="tables déjà en CSV sans pyarrow")
+def test_csv_copy_only_for_power_bi_tables():
+    df = pd.DataFrame({"commune_id": np.arange(3, dtype="int32"), "valeur": np.ones(3)})
+    storage.save_table(df, "cube_journalier")
+    storage.save_table(df, "population_data")
+    assert not os.path.exists(storage.table_path("cube_journalier", "csv"))
+    assert os.path.exists(storage.table_path("population_data", "csv"))
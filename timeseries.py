@@ -0,0 +1,255 @@
+# timeseries.py
+# Séries journalières des stations en tableaux float32 mappés en mémoire (np.memmap)
+# Un fichier par polluant dans data_clean/series/ : une ligne par station_id (dimensions.py),
+# une colonne par jour du calendrier (NaN = pas de mesure), chaque série est donc contiguë.
+# Les lignes ont de la marge (capacity jours) : ajouter un jour (build_series incrémental) écrit une valeur
+# par station, sans tout réécrire. Les graphiques travaillent sur des vues du fichier (aucune copie des séries)
+# Seuls les graphiques du rapport lisent les séries : normes et épisodes restent calculés sur les tables
+# de data_clean (normes.py), par (polluant, commune, station) comme les analyses SQL de database.py
+import os
+import json
+import logging
+import numpy as np
+import storage
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+#####################################################################################
+#                               GLOBAL VARIABLE
+#####################################################################################
+
+# Marge ajoutée au calendrier quand il est plein (le fichier n'est réécrit qu'une fois par an)
+capacity_step = 366
+
+dtype = np.dtype("float32")
+
+
+#####################################################################################
+#                               FICHIERS
+#####################################################################################
+
+def series_dir():
+    return os.path.join(storage.clean_dir, "series")
+
+
+# Index des séries : {polluant: {"start": "2024-01-01", "days": n, "capacity": c, "stations": s}}
+# (écrit en dernier : c'est aussi la sortie de l'étape "series" du pipeline)
+def index_path():
+    return os.path.join(series_dir(), "series.json")
+
+
+def data_path(polluant):
+    return os.path.join(series_dir(), f"{polluant}.f32")
+
+
+# Nombre de jours de a à b (dates ou chaînes "AAAA-MM-JJ")
+def days_between(a, b):
+    return int((np.datetime64(b, "D") - np.datetime64(a, "D")).astype(np.int64))
+
+
+def load_index():
+    if not os.path.exists(index_path()):
+        return {}
+    with open(index_path(), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index(index):
+    instrumentation.write_atomic(index_path(), json.dumps(index, indent=4))
+
+
+# Le fichier correspond-il à l'index ? (processus interrompu entre l'écriture des données et de l'index)
+def is_valid(polluant, meta):
+    expected = meta["stations"] * meta["capacity"] * dtype.itemsize
+    return os.path.exists(data_path(polluant)) and os.path.getsize(data_path(polluant)) == expected
+
+
+#####################################################################################
+#                               LECTURE
+#####################################################################################
+
+class TimeSeries:
+    def __init__(self, polluant, meta, mode="r"):
+        self.polluant = polluant
+        self.start = np.datetime64(meta["start"], "D")
+        self.days = meta["days"]
+        self.capacity = meta["capacity"]
+        self.stations = meta["stations"]
+        if self.stations and self.capacity:
+            self.data = np.memmap(data_path(polluant), dtype=dtype, mode=mode, shape=(self.stations, self.capacity))
+        else:
+            self.data = np.empty((self.stations, self.capacity), dtype=dtype)
+
+    # Calendrier des jours utilisés
+    @property
+    def dates(self):
+        return self.start + np.arange(self.days)
+
+    def day_index(self, dates):
+        return (np.asarray(dates, dtype="datetime64[D]") - self.start).astype(np.int64)
+
+    # Série d'une station (vue contiguë, NaN pour les jours sans mesure)
+    def series(self, station_id):
+        if not 0 <= station_id < self.stations:
+            return np.full(self.days, np.nan, dtype=dtype)
+        return self.data[station_id, :self.days]
+
+    # Toutes les stations sur [start, end] inclus (vue stations x jours)
+    def window(self, start=None, end=None):
+        first = 0 if start is None else max(int(self.day_index(start)), 0)
+        last = self.days if end is None else min(int(self.day_index(end)) + 1, self.days)
+        return self.data[:, first:max(first, last)]
+
+    def window_dates(self, start=None, end=None):
+        first = 0 if start is None else max(int(self.day_index(start)), 0)
+        last = self.days if end is None else min(int(self.day_index(end)) + 1, self.days)
+        return self.start + np.arange(first, max(first, last))
+
+
+# Séries d'un polluant en lecture seule, None si jamais construites
+def open_series(polluant):
+    meta = load_index().get(polluant)
+    if meta is None:
+        return None
+    if not is_valid(polluant, meta):
+        raise ValueError(f"{data_path(polluant)} ne correspond pas à {index_path()} : relancer l'étape series avec --force")
+    instrumentation.count("bytes_read", meta["stations"] * meta["days"] * dtype.itemsize)
+    return TimeSeries(polluant, meta)
+
+
+#####################################################################################
+#                               ÉCRITURE
+#####################################################################################
+
+# Agrandir le fichier d'un polluant (stations en plus, calendrier plus long ou commençant plus tôt)
+# Nouvelles stations seules : le fichier est prolongé sur place ; sinon réécrit dans un fichier temporaire
+def resize(polluant, meta, stations, capacity, start):
+    old = meta if meta and is_valid(polluant, meta) else None
+    path = data_path(polluant)
+    os.makedirs(series_dir(), exist_ok=True)
+
+    if old and old["capacity"] == capacity and old["start"] == start:
+        with open(path, "r+b") as f:
+            f.truncate(stations * capacity * dtype.itemsize)
+        data = np.memmap(path, dtype=dtype, mode="r+", shape=(stations, capacity))
+        data[old["stations"]:] = np.nan
+        data.flush()
+    else:
+        tmp_path = path + ".tmp"
+        data = np.memmap(tmp_path, dtype=dtype, mode="w+", shape=(stations, capacity))
+        data[:] = np.nan
+        if old and old["stations"] and old["days"]:
+            source = np.memmap(path, dtype=dtype, mode="r", shape=(old["stations"], old["capacity"]))
+            shift = days_between(start, old["start"])
+            data[:old["stations"], shift:shift + old["days"]] = source[:, :old["days"]]
+            del source
+        data.flush()
+        del data
+        os.replace(tmp_path, path)
+
+    days = old["days"] + days_between(start, old["start"]) if old else 0
+    return {"start": start, "days": days, "capacity": capacity, "stations": stations}
+
+
+# Écrire des valeurs (station_id, jour) ; le fichier est agrandi si besoin
+# clear_from : jour à partir duquel les anciennes valeurs sont effacées (jours recalculés)
+# Retourne la nouvelle entrée de l'index (à sauvegarder avec save_index)
+def write_values(polluant, meta, station_ids, dates, values, clear_from=None):
+    station_ids = np.asarray(station_ids, dtype=np.int64)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    values = np.asarray(values, dtype=dtype)
+    if len(dates) == 0 and meta is not None:
+        return meta
+
+    first = dates.min() if len(dates) else np.datetime64("today", "D")
+    start = np.datetime64(meta["start"], "D") if meta else first
+    start = min(start, first)
+    days = max(meta["days"] + days_between(start, meta["start"]) if meta else 0,
+               days_between(start, dates.max()) + 1 if len(dates) else 0)
+    stations = max(meta["stations"] if meta else 0, int(station_ids.max()) + 1 if len(station_ids) else 0)
+    capacity = meta["capacity"] if meta and np.datetime64(meta["start"], "D") == start else 0
+    if days > capacity:
+        capacity = (days // capacity_step + 1) * capacity_step
+
+    if meta is None or stations != meta["stations"] or capacity != meta["capacity"] or str(start) != meta["start"]:
+        meta = resize(polluant, meta, stations, capacity, str(start))
+
+    series = TimeSeries(polluant, meta, mode="r+")
+    if clear_from is not None:
+        series.data[:, max(int(series.day_index(clear_from)), 0):days] = np.nan
+    series.data[station_ids, series.day_index(dates)] = values
+    series.data.flush()
+    instrumentation.count("bytes_written", len(values) * dtype.itemsize)
+    return dict(meta, days=days)
+
+
+# Effacer (NaN) les jours antérieurs à `date`
+def clear_before(polluant, meta, date):
+    series = TimeSeries(polluant, meta, mode="r+")
+    series.data[:, :max(int(series.day_index(date)), 0)] = np.nan
+    series.data.flush()
+
+
+#####################################################################################
+#                               CONSTRUCTION DEPUIS LE CUBE JOURNALIER
+#####################################################################################
+
+# Étape "series" : moyennes journalières du cube (rollup.py) -> séries par station
+# Comme rollup.build_rollups, seuls les jours à partir du dernier jour connu sont relus
+# Les jours sortis du cube (fenêtre glissante) sont effacés ; fichier reconstruit quand ils dépassent capacity_step
+def build_series(incremental=True):
+    import rollup
+
+    logger.info("Building station time series...")
+    index = load_index() if incremental else {}
+    firsts = rollup.first_days() if index else {}
+    for polluant in rollup.polluants:
+        meta = index.get(polluant)
+        if meta is not None and not is_valid(polluant, meta):
+            logger.warning("Séries %s incohérentes avec l'index, reconstruites", polluant)
+            meta = None
+        first = firsts.get(polluant)
+        if meta is not None and (first is None or days_between(meta["start"], first.date()) > capacity_step):
+            meta = None
+        if meta is None and os.path.exists(data_path(polluant)):
+            os.remove(data_path(polluant))
+
+        since = np.datetime64(meta["start"], "D") + meta["days"] - 1 if meta and meta["days"] else None
+        cube = rollup.load_cube("journalier", polluant, ['station_id', 'date_local', 'moyenne'],
+                                date_range=(str(since), None) if since is not None else None)
+        cube = cube[cube['station_id'] >= 0]
+        if cube.empty and meta is None:
+            continue
+        index[polluant] = write_values(polluant, meta, cube['station_id'].to_numpy(), cube['date_local'].to_numpy(),
+                                       cube['moyenne'].to_numpy(), clear_from=since)
+        if meta is not None and days_between(meta["start"], first.date()) > 0:
+            clear_before(polluant, index[polluant], first.date())
+        logger.info("%s : %d valeurs écrites%s", polluant, len(cube), f" depuis le {since}" if since is not None else "")
+
+    save_index(index)
+    logger.info("Séries sauvegardées dans data_clean/series/ (%s)", ", ".join(
+        f"{p} : {m['stations']} stations x {m['days']} jours" for p, m in index.items()))
+
+
+#####################################################################################
+#                               CALCULS SUR LES SÉRIES
+#####################################################################################
+
+# Moyenne régionale par jour (moyenne des stations) : date_local, <polluant>_value
+def regional_daily_mean(polluant):
+    import pandas as pd
+
+    value_col = storage.value_column(polluant)
+    series = open_series(polluant)
+    if series is None or series.days == 0:
+        return pd.DataFrame({'date_local': pd.Series(dtype='datetime64[ns]'), value_col: pd.Series(dtype='float64')})
+    window = series.window()
+    counts = (~np.isnan(window)).sum(axis=0)
+    sums = np.nansum(window, axis=0, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    keep = counts > 0
+    return pd.DataFrame({'date_local': series.dates[keep].astype('datetime64[ns]'), value_col: means[keep]})
+